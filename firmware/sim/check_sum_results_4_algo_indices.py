@@ -3,56 +3,101 @@
 #path = "sim_results_gtl_fdl_wrapper_TestVector_L1Menu_Collisions2015_25nsStage1_v6_uGT_v2_TTbar"
 #path = "sim_results_gtl_fdl_wrapper_L1Menu_Correlation_2015_hb_test"
 
+# Compares the two values following every bx-nr of a sim results file and
+# lists every bx-nr with the differing bit indices (only mismatching bx-nr with
+# --mismatches-only), followed by per bit totals. The file is read once line by
+# line, so memory does not grow with the file size.
+#
+# Accepted records (one per bx-nr):
+#
+#   bx-nr : 42              "bx-nr": 42,                  {"bx-nr": 42, "algos_tv": "0x..", "algos_sim": "0x..", ...},
+#   algos : 0f00..          "algos_tv":  "0x0f00..",
+#   ref   : 0e00..          "algos_sim": "0x0e00..",
+#
+
+from __future__ import print_function
+
 import argparse
+import json
+import sys
 
 ## HB 2015-12-17: inserted parser for path of sim results file
 def parse():
     """Parse command line arguments."""
     parser = argparse.ArgumentParser()
     parser.add_argument('path', help = "path to sim results file")
+    parser.add_argument('--mismatches-only', action = 'store_true', help = "list only bx-nr with differences")
     return parser.parse_args()
 
-def hex2bin(s):
-  padding = len(s)*4
-  decimal = int(s,16)
-  binary = bin(decimal)[2:].zfill(padding)
-  return binary
+def iter_bits(value):
+  """Yields indices of set bits of a non negative integer, lowest first."""
+  while value:
+    low = value & -value
+    yield low.bit_length() - 1
+    value ^= low
 
-def compare(array):
-  if len(array) != 2:
-    raise RuntimeError
-  hex_val = array[0].strip()
-  hex_ref = array[1].strip()
+def hex2int(s):
+  """Returns integer of a hex value token, eg. '0f00', ' "0x0f00",'."""
+  return int(s.strip().rstrip(',').strip('"'), 16)
 
-  bin_val = ''.join(reversed(hex2bin(hex_val)))
-  bin_ref = ''.join(reversed(hex2bin(hex_ref)))
+def iter_records(fp):
+  """Yields tuples (bx, value, reference) of all records of a sim results file."""
+  bx = None
+  values = []
+  for line in fp:
+    stripped = line.strip()
+    if stripped.startswith('{') and '"bx-nr"' in stripped: # one JSON record per line
+      record = json.loads(stripped.rstrip(','))
+      yield str(record['bx-nr']), int(record['algos_tv'], 16), int(record['algos_sim'], 16)
+      continue
+    tokens = line.split(':')
+    if len(tokens) < 2: continue
+    if "bx-nr" in tokens[0]:
+      if bx is not None:
+        raise RuntimeError("incomplete record for bx-nr %s" % bx)
+      bx = tokens[1].strip().rstrip(',')
+      values = []
+      continue
+    if bx is None: continue # values after the first two (eg. finor)
+    values.append(hex2int(tokens[1]))
+    if len(values) == 2:
+      yield bx, values[0], values[1]
+      bx = None
+  if bx is not None:
+    raise RuntimeError("incomplete record for bx-nr %s" % bx)
 
-  error = ""
-  for ii in range(len(bin_val)):
-    if bin_val[ii] != bin_ref[ii]:
-      error += " bit %03d, " % ii
-
-  if error:
-    print " @ %s" % error
+def compare(fp, out = sys.stdout, mismatches_only = False):
+  """Compares all records of *fp*, returns tuple (records, mismatching records, per bit totals)."""
+  totals = {}
+  n_records = 0
+  n_errors = 0
+  for bx, value, reference in iter_records(fp):
+    n_records += 1
+    diff = value ^ reference
+    if not diff:
+      if not mismatches_only:
+        out.write("%s\n" % bx)
+      continue
+    n_errors += 1
+    bits = list(iter_bits(diff))
+    for bit in bits:
+      totals[bit] = totals.get(bit, 0) + 1
+    if mismatches_only:
+      out.write("%s @ %s\n" % (bx, ", ".join(["bit %03d" % bit for bit in bits])))
+    else:
+      out.write("%s  @ %s\n" % (bx, "".join([" bit %03d, " % bit for bit in bits])))
+  return n_records, n_errors, totals
 
 # Parse command line arguments.
 args = parse()
 path = (args.path)
 
-data = {}
-key = ''
-for line in file(path).readlines():
-  if not line: continue
-  tokens = line.split(':')
-  if len(tokens) < 2: continue
-  if ("bx-nr" in tokens[0]) and (tokens[1] not in data.keys()):
-    key = tokens[1]
-    data[key] = []
-    continue
-  data[key].append(tokens[1])
-
-for key in sorted(data):
-  print key.strip(),
-  compare(data[key])
+with open(path) as fp:
+  n_records, n_errors, totals = compare(fp, mismatches_only = args.mismatches_only)
+
+print("")
+print("bx-nr compared: %d, with differences: %d" % (n_records, n_errors))
+for bit in sorted(totals):
+  print(" bit %03d: %d" % (bit, totals[bit]))
 
 # eof
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Benchmark of run_simulation.py orchestration using a stand-in vsim.
+#
+
+"""Benchmark run_simulation.py without ModelSim license.
+
+Generates a synthetic menu (XML, VHDL snippets), a synthetic testvector and a
+self contained copy of the simulation tree, then runs the full orchestration
+of run_simulation.py against fake_vsim.py (installed as `vsim' in PATH).
+Reports wall time, throughput (module BX per second) and per phase costs
+taken from the run's timings.json.
+
+By default every run simulates all modules (--no-result-cache), only the
+first run builds the library. With --warm-cache an unmeasured priming run
+fills the library and result caches, measured runs then reuse both (results
+are cached per module without mismatches, --error-rate defaults to 0).
+
+  $ python bench_simulation.py
+  $ python bench_simulation.py --modules 6 --algorithms 512 --bx 3564 --jobs 4 --shards 2
+  $ python bench_simulation.py --error-rate 0.5 --bx-time 0.0001 --repeat 3
+  $ python bench_simulation.py --warm-cache --repeat 3
+
+"""
+
+import argparse
+import glob
+import json
+import random
+import shutil
+import stat
+import subprocess
+import tempfile
+import time
+import sys, os
+
+import bench_xmlmenu
+import run_simulation
+
+DEFAULT_MODULES = 6
+DEFAULT_ALGORITHMS = 512
+DEFAULT_BX = run_simulation.LHC_BUNCH_COUNT
+DEFAULT_TRIGGER_RATE = 0.01
+DEFAULT_ERROR_RATE = 0.01
+DEFAULT_REPEAT = 1
+
+MENU_NAME = 'L1Menu_Benchmark'
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SIM_DIR = os.path.dirname(SCRIPTS_DIR)
+
+LHC_DATA = ' '.join(['0' * 16] * 8 + ['0' * 8] * 12 + ['0' * 8] * 12 + ['0' * 8] * 12 + ['0' * 8] * 4)
+"""Empty LHC data payload of a testvector line (muons, eg, tau, jet, esums)."""
+
+VHDL_SNIPPETS = ['algo_index.vhd', 'ugt_constants.vhd', 'gtl_module_signals.vhd', 'gtl_module_instances.vhd']
+
+VHDL_TEMPLATES = {
+    'fdl/algo_mapping_rop_tpl.vhd': '-- algo_mapping_rop\n{{algo_index}}\n',
+    'gtl/gtl_pkg_tpl.vhd': '-- gtl_pkg\n{{ugt_constants}}\n',
+    'gtl/gtl_module_tpl.vhd': '-- gtl_module\n{{gtl_module_signals}}\n{{gtl_module_instances}}\n',
+}
+"""Stand-in menu specific VHDL templates (paths relative to gtl_fdl_wrapper)."""
+
+def make_testvector(filename, n_bx, n_algorithms, trigger_rate=DEFAULT_TRIGGER_RATE, seed=0):
+    """Writes a synthetic testvector of *n_bx* lines with random algorithm
+    triggers of the first *n_algorithms* algorithms.
+    """
+    rng = random.Random(seed)
+    with open(filename, 'w') as fp:
+        for bx in range(n_bx):
+            algos = 0
+            for index in range(n_algorithms):
+                if rng.random() < trigger_rate:
+                    algos |= 1 << index
+            fp.write('{0:04d} {1} {2:0128x} {3:d}\n'.format(bx, LHC_DATA, algos, bool(algos)))
+
+def make_menu_dir(root, n_algorithms, n_modules, n_bx, trigger_rate):
+    """Creates a menu directory (xml, testvectors, vhdl) inside *root*. Returns its path."""
+    menu_dir = os.path.join(root, MENU_NAME)
+    os.makedirs(os.path.join(menu_dir, 'xml'))
+    os.makedirs(os.path.join(menu_dir, 'testvectors'))
+    bench_xmlmenu.make_menu(os.path.join(menu_dir, 'xml', '{0}.xml'.format(MENU_NAME)), n_algorithms, n_modules, MENU_NAME)
+    make_testvector(os.path.join(menu_dir, 'testvectors', 'TestVector_{0}.txt'.format(MENU_NAME)), n_bx, n_algorithms, trigger_rate)
+    for module_id in range(n_modules):
+        src_dir = os.path.join(menu_dir, 'vhdl', 'module_{0}'.format(module_id), 'src')
+        os.makedirs(src_dir)
+        for snippet in VHDL_SNIPPETS:
+            with open(os.path.join(src_dir, snippet), 'w') as fp:
+                fp.write('-- module_{0} {1}\n'.format(module_id, snippet))
+    return menu_dir
+
+def touch(filename):
+    """Creates an empty file including missing directories."""
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    if not os.path.exists(filename):
+        open(filename, 'w').close()
+
+def make_sim_tree(root):
+    """Creates a copy of the simulation tree with stand-in VHDL sources and MP7
+    tag inside *root*, and a `vsim' wrapper of fake_vsim.py.
+    Returns tuple (sim_dir, mp7_tag, bin_dir).
+    """
+    sim_dir = os.path.join(root, 'firmware', 'sim')
+    shutil.copytree(SIM_DIR, sim_dir)
+    wrapper_dir = os.path.join(root, 'firmware', 'hdl', 'gt_mp7_core', 'gtl_fdl_wrapper')
+    for path, content in VHDL_TEMPLATES.items():
+        touch(os.path.join(wrapper_dir, path))
+        with open(os.path.join(wrapper_dir, path), 'w') as fp:
+            fp.write(content)
+    mp7_tag = os.path.join(root, 'mp7')
+    os.makedirs(mp7_tag)
+    do_file = os.path.join(root, run_simulation.LIB_DO_FILE)
+    run_simulation.render_template(os.path.join(sim_dir, run_simulation.LIB_DO_FILE_TPL), do_file, {
+        '{{MP7_TAG}}' : mp7_tag,
+        '{{SIM_DIR}}' : sim_dir,
+    })
+    for source in run_simulation.do_file_sources(do_file):#library sources are hashed by run_simulation.py
+        touch(source)
+    os.remove(do_file)
+    bin_dir = os.path.join(root, 'bin')
+    os.makedirs(bin_dir)
+    vsim = os.path.join(bin_dir, 'vsim')
+    with open(vsim, 'w') as fp:
+        fp.write('#!/bin/sh\nexec "{0}" "{1}" "$@"\n'.format(sys.executable, os.path.join(SCRIPTS_DIR, 'fake_vsim.py')))
+    os.chmod(vsim, os.stat(vsim).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return sim_dir, mp7_tag, bin_dir
+
+def run_orchestration(root, sim_dir, mp7_tag, bin_dir, menu_dir, output, args):
+    """Runs run_simulation.py, returns contents of timings.json of the run.
+    Modules are always simulated unless *args.warm_cache* is set.
+    """
+    env = dict(os.environ)
+    env.update({
+        'SIM_ROOT': sim_dir,
+        'GTU_SETTINGS_MODELSIM_INI_VERSION': 'benchmark',
+        'PATH': os.pathsep.join([bin_dir, env.get('PATH', '')]),
+        'FAKE_VSIM_ERROR_RATE': format(args.error_rate),
+        'FAKE_VSIM_VCOM_TIME': format(args.vcom_time),
+        'FAKE_VSIM_BX_TIME': format(args.bx_time),
+    })
+    cmd = [sys.executable, os.path.join(SCRIPTS_DIR, 'run_simulation.py'),
+        '--mp7_tag', mp7_tag,
+        '--menu', menu_dir,
+        '--output', output,
+        '--lib-cache', os.path.join(root, 'sim_libs'),
+        '--jobs', format(args.jobs),
+        '--shards', format(args.shards),
+    ]
+    if args.warm_cache:
+        cmd.extend(['--result-cache', os.path.join(root, 'sim_cache')])
+    else:
+        cmd.append('--no-result-cache')
+    log_file = os.path.join(root, 'run_simulation.log')
+    with open(log_file, 'w') as logfile:
+        returncode = subprocess.call(cmd, stdout = logfile, stderr = subprocess.STDOUT, env = env, cwd = root)
+    if returncode != 0:
+        with open(log_file) as fp:
+            sys.stderr.write(fp.read()[-4000:])
+        raise RuntimeError("run_simulation.py failed with exit code {0}".format(returncode))
+    filenames = glob.glob(os.path.join(output, 'sim_results', '*', 'timings.json'))
+    if len(filenames) != 1:
+        raise RuntimeError("missing timings.json in {0}".format(output))
+    with open(filenames[0]) as fp:
+        return json.load(fp)
+
+def phase_total(timings, phase):
+    """Returns total seconds of *phase* in timings.json contents."""
+    for total in timings['totals']:
+        if total['phase'] == phase:
+            return total['total']
+    return 0.
+
+def parse():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="benchmark run_simulation.py orchestration using a stand-in vsim")
+    parser.add_argument('--modules', metavar='<n>', type=int, default=DEFAULT_MODULES, help="number of modules (default {0})".format(DEFAULT_MODULES))
+    parser.add_argument('--algorithms', metavar='<n>', type=int, default=DEFAULT_ALGORITHMS, help="number of algorithms, max. {0} (default {1})".format(run_simulation.algonum, DEFAULT_ALGORITHMS))
+    parser.add_argument('--bx', metavar='<n>', type=int, default=DEFAULT_BX, help="testvector lines (default {0})".format(DEFAULT_BX))
+    parser.add_argument('--trigger-rate', metavar='<p>', type=float, default=DEFAULT_TRIGGER_RATE, help="probability of an algorithm trigger per BX (default {0})".format(DEFAULT_TRIGGER_RATE))
+    parser.add_argument('--error-rate', metavar='<p>', type=float, help="probability of a mismatch per module and BX (default {0}, 0 with --warm-cache)".format(DEFAULT_ERROR_RATE))
+    parser.add_argument('--vcom-time', metavar='<s>', type=float, default=0., help="fake seconds per vcom command (default 0)")
+    parser.add_argument('--bx-time', metavar='<s>', type=float, default=0., help="fake seconds per simulated BX (default 0)")
+    parser.add_argument('-j', '--jobs', metavar='<n>', type=int, default=run_simulation.DEFAULT_JOBS, help="parallel simulations (default {0})".format(run_simulation.DEFAULT_JOBS))
+    parser.add_argument('--shards', metavar='<n>', type=int, default=1, help="BX shards per module (default 1)")
+    parser.add_argument('--repeat', metavar='<n>', type=int, default=DEFAULT_REPEAT, help="orchestration runs, the first one builds the library (default {0})".format(DEFAULT_REPEAT))
+    parser.add_argument('--warm-cache', action='store_true', help="measure runs reusing library and result caches filled by a priming run")
+    parser.add_argument('--keep', action='store_true', help="keep generated files")
+    args = parser.parse_args()
+    if args.error_rate is None:
+        args.error_rate = 0. if args.warm_cache else DEFAULT_ERROR_RATE
+    return args
+
+def main():
+    args = parse()
+    if not 0 < args.algorithms <= run_simulation.algonum:
+        raise RuntimeError("number of algorithms out of range: {0}".format(args.algorithms))
+    root = tempfile.mkdtemp(prefix='bench_simulation_')
+    try:
+        t0 = time.time()
+        sim_dir, mp7_tag, bin_dir = make_sim_tree(root)
+        menu_dir = make_menu_dir(root, args.algorithms, args.modules, args.bx, args.trigger_rate)
+        print("generated {0} modules, {1} algorithms, {2} BX in {3:.1f} s".format(args.modules, args.algorithms, args.bx, time.time() - t0))
+        if args.warm_cache:
+            timings = run_orchestration(root, sim_dir, mp7_tag, bin_dir, menu_dir, os.path.join(root, 'output_prime'), args)
+            print("priming run (fills library and result caches): {0:.2f} s".format(timings['wall_time']))
+        print("|-----|-----------|--------------|-------------|------------|")
+        print("| Run | wall(s)   | module BX/s  | simulate(s) | python(s)  |")
+        print("|-----|-----------|--------------|-------------|------------|")
+        runs = []
+        for index in range(args.repeat):
+            timings = run_orchestration(root, sim_dir, mp7_tag, bin_dir, menu_dir, os.path.join(root, 'output_{0}'.format(index)), args)
+            wall_time = timings['wall_time']
+            simulation = phase_total(timings, 'simulation')
+            print("|{0:>5}|{1:>11.2f}|{2:>14.0f}|{3:>13.2f}|{4:>12.2f}|".format(
+                index,
+                wall_time,
+                args.modules * args.bx / max(wall_time, 1e-9),
+                simulation,
+                wall_time - simulation, # orchestration outside of the simulation phase
+            ))
+            runs.append(timings)
+        print("|-----|-----------|--------------|-------------|------------|")
+        best = min(runs, key=lambda timings: timings['wall_time'])
+        print("")
+        print("per phase costs of fastest run:")
+        print("|----------------------|-------|-----------|")
+        print("| Phase                | Spans |  Total(s) |")
+        print("|----------------------|-------|-----------|")
+        for total in best['totals']:
+            print("|{0:<22}|{1:>7}|{2:>11.3f}|".format(total['phase'], total['count'], total['total']))
+        print("|----------------------|-------|-----------|")
+        if args.keep:
+            print("")
+            print("generated files kept in {0}".format(root))
+    finally:
+        if not args.keep:
+            shutil.rmtree(root)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Benchmark of XmlMenu parsing using synthetic menus.
+#
+
+"""Benchmark XmlMenu parsing time and memory on synthetic menus.
+
+Each menu size is parsed in a separate process to report the peak memory
+(max. RSS) of parsing this menu only.
+
+  $ python bench_xmlmenu.py
+  $ python bench_xmlmenu.py --sizes 512 4096 65536 --repeat 5
+
+"""
+
+import argparse
+import resource
+import subprocess
+import tempfile
+import shutil
+import time
+import sys, os
+
+import xmlmenu
+
+DEFAULT_SIZES = [512, 2048, 8192, 32768]
+DEFAULT_REPEAT = 3
+
+def make_menu(filename, n_algorithms, n_modules=6, name='L1Menu_Synthetic'):
+    """Writes a synthetic XML menu compatible with XmlMenu to *filename*."""
+    with open(filename, 'w') as fp:
+        fp.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        fp.write('<menu>\n')
+        fp.write('  <name>{0}</name>\n'.format(name))
+        fp.write('  <uuid_menu>00000000-0000-0000-0000-{0:012x}</uuid_menu>\n'.format(n_algorithms))
+        fp.write('  <uuid_firmware>00000000-0000-0000-0000-000000000000</uuid_firmware>\n')
+        fp.write('  <grammar_version>0.7</grammar_version>\n')
+        fp.write('  <is_valid>true</is_valid>\n')
+        fp.write('  <is_obsolete>false</is_obsolete>\n')
+        fp.write('  <n_modules>{0}</n_modules>\n'.format(n_modules))
+        fp.write('  <comment>synthetic menu with {0} algorithms</comment>\n'.format(n_algorithms))
+        for index in range(n_algorithms):
+            fp.write('  <algorithm>\n')
+            fp.write('    <name>L1_Synthetic_{0}</name>\n'.format(index))
+            fp.write('    <expression>comb{{MU{0}[MU-QLTY_SNGL,MU-ETA_2p10]}} AND comb{{EG{1}}}</expression>\n'.format(index % 25, index % 40))
+            fp.write('    <index>{0}</index>\n'.format(index))
+            fp.write('    <module_id>{0}</module_id>\n'.format(index % n_modules))
+            fp.write('    <module_index>{0}</module_index>\n'.format(index // n_modules))
+            fp.write('    <comment></comment>\n')
+            fp.write('    <labels/>\n')
+            fp.write('  </algorithm>\n')
+        fp.write('</menu>\n')
+
+def max_rss():
+    """Returns peak resident set size of current process in MiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def parse_menu(filename, repeat):
+    """Parses menu *repeat* times, prints best time (s) and peak memory (MiB)."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        menu = xmlmenu.XmlMenu(filename)
+        dt = time.time() - t0
+        best = dt if best is None else min(best, dt)
+    print("{0} {1:.6f} {2:.1f}".format(len(menu.algorithms), best, max_rss()))
+
+def parse():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="benchmark XmlMenu parsing on synthetic menus")
+    parser.add_argument('--sizes', metavar='<n>', type=int, nargs='+', default=DEFAULT_SIZES, help="number of algorithms of synthetic menus (default {0})".format(DEFAULT_SIZES))
+    parser.add_argument('--repeat', metavar='<n>', type=int, default=DEFAULT_REPEAT, help="parse repetitions, best time is reported (default {0})".format(DEFAULT_REPEAT))
+    parser.add_argument('--parse', metavar='<filename>', help=argparse.SUPPRESS) # child process mode
+    return parser.parse_args()
+
+def main():
+    args = parse()
+    if args.parse:
+        parse_menu(args.parse, args.repeat)
+        return 0
+    tmpdir = tempfile.mkdtemp(prefix='bench_xmlmenu_')
+    try:
+        print("|------------|-----------|------------|-------------|----------|")
+        print("| algorithms | size(MiB) | parse(s)   | algos/s     | rss(MiB) |")
+        print("|------------|-----------|------------|-------------|----------|")
+        for size in args.sizes:
+            filename = os.path.join(tmpdir, 'L1Menu_Synthetic_{0}.xml'.format(size))
+            make_menu(filename, size)
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--parse', filename, '--repeat', str(args.repeat)])
+            n_algorithms, seconds, rss = output.split()
+            print("|{0:>12}|{1:>11.1f}|{2:>12.4f}|{3:>13.0f}|{4:>10}|".format(
+                int(n_algorithms),
+                os.path.getsize(filename) / 1048576.,
+                float(seconds),
+                int(n_algorithms) / max(float(seconds), 1e-9),
+                rss.decode() if isinstance(rss, bytes) else rss
+            ))
+        print("|------------|-----------|------------|-------------|----------|")
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+
+"""This module provides per run BX x algorithm bit matrices of expected
+(testvector) and simulated algorithm bits.
+
+The matrix file (mismatch_matrix.bin) of a run holds two planes of one 512
+bit row per BX, `tv' (testvector algorithm word masked by the algorithms of
+all modules) and `sim' (simulated algorithm word). The `xor' view of both
+planes holds the mismatching bits. As results files only report mismatching
+BX, the planes are built from the testvector and the error records of all
+modules.
+
+>>> from bxmatrix import write_matrix, BxMatrix
+>>> write_matrix("mismatch_matrix.bin", "TestVector_L1Menu_Sample.txt", [(mask_0, "results_module_0.json"), ...])
+>>> matrix = BxMatrix("mismatch_matrix.bin")
+>>> matrix.algos(42, 'xor')          # algorithms mismatching in BX 42
+[3, 17]
+>>> matrix.bx(17, 'xor')             # BX with algorithm 17 mismatching
+[42, 1337]
+>>> matrix.counts('sim')[17]
+23
+
+Rows are accessed in place (memory mapped), column queries and counts use
+NumPy bit unpacking if available.
+
+Command line usage:
+
+  $ python bxmatrix.py mismatch_matrix.bin info
+  $ python bxmatrix.py mismatch_matrix.bin rows 40 [45] [--view xor] [--algos 0:64]
+  $ python bxmatrix.py mismatch_matrix.bin column 17 [--view xor] [--first 0] [--last 100]
+  $ python bxmatrix.py mismatch_matrix.bin counts [--view xor]
+
+File layout (little endian unless noted):
+
+  header  magic 'UGTBX\\0', version (u16), width in bits (u16), number of BX
+          (u32), zero padded to HEADER_ALIGN bytes
+  planes  tv rows followed by sim rows, one row per BX (width/8 bytes big
+          endian, bit n is algorithm index n)
+"""
+
+import binascii
+import mmap
+import struct
+import sys
+
+from testvector import ALGO_BITS, HEADER_ALIGN, align, iter_bits, popcount, read_algos
+import results
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['BxMatrix', 'build_planes', 'write_matrix']
+
+MATRIX_MAGIC = b'UGTBX\0'
+MATRIX_VERSION = 1
+MATRIX_STRUCT = struct.Struct('<6sHHI')
+VIEWS = ('tv', 'sim', 'xor')
+
+def build_planes(testvector, modules):
+    """Returns tuple (tv, sim) of lists of algorithm words per BX of a
+    *testvector* file and list *modules* of tuples (mask, results file).
+    """
+    union = 0
+    for mask, _ in modules:
+        union |= mask
+    tv = [int(algos, 16) & union for algos, _ in read_algos(testvector)]
+    sim = list(tv)
+    for mask, filename in modules:
+        for error in results.iter_errors(filename):
+            if not 0 <= error.bx < len(sim):
+                raise RuntimeError("bx-nr {0} out of testvector range in {1}".format(error.bx, filename))
+            sim[error.bx] = (sim[error.bx] & ~mask) | (error.algos_sim & mask)
+    return tv, sim
+
+def write_matrix(filename, testvector, modules, width=ALGO_BITS):
+    """Writes matrix file of a *testvector* file and list *modules* of tuples
+    (mask, results file). Returns number of BX.
+    """
+    tv, sim = build_planes(testvector, modules)
+    n_chars = width // 4
+    header = MATRIX_STRUCT.pack(MATRIX_MAGIC, MATRIX_VERSION, width, len(tv))
+    with open(filename, 'wb') as fp:
+        fp.write(header + b'\0' * (align(len(header), HEADER_ALIGN) - len(header)))
+        for plane in (tv, sim):
+            for word in plane:
+                fp.write(binascii.unhexlify('{0:0{1}x}'.format(word, n_chars)))
+    return len(tv)
+
+class BxMatrix(object):
+    """Memory mapped matrix file, views are 'tv', 'sim' and 'xor'."""
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fp:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.width, self.n_bx = MATRIX_STRUCT.unpack_from(self._mmap, 0)
+        if magic != MATRIX_MAGIC:
+            raise RuntimeError("not a matrix file: {0}".format(filename))
+        if version != MATRIX_VERSION:
+            raise RuntimeError("unsupported matrix file version {0}: {1}".format(version, filename))
+        self.row_size = self.width // 8
+        self.offsets = {
+            'tv': align(MATRIX_STRUCT.size, HEADER_ALIGN),
+            'sim': align(MATRIX_STRUCT.size, HEADER_ALIGN) + self.n_bx * self.row_size,
+        }
+    def close(self):
+        """Release memory mapping."""
+        self._mmap.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+    def __len__(self):
+        return self.n_bx
+    def _check_view(self, view):
+        if view not in VIEWS:
+            raise ValueError("invalid view: {0}".format(view))
+    def _word(self, plane, bx):
+        offset = self.offsets[plane] + bx * self.row_size
+        return int(binascii.hexlify(self._mmap[offset:offset + self.row_size]), 16)
+    def row(self, bx, view='sim'):
+        """Returns algorithm word (integer) of *bx* of *view*."""
+        self._check_view(view)
+        if bx < 0:
+            bx += self.n_bx
+        if not 0 <= bx < self.n_bx:
+            raise IndexError("BX out of range: {0}".format(bx))
+        if view == 'xor':
+            return self._word('tv', bx) ^ self._word('sim', bx)
+        return self._word(view, bx)
+    def rows(self, first=0, last=None, view='sim'):
+        """Yields tuples (bx, word) of BX range [first, last)."""
+        last = self.n_bx if last is None else min(last, self.n_bx)
+        for bx in range(first, last):
+            yield bx, self.row(bx, view)
+    def algos(self, bx, view='sim'):
+        """Returns list of algorithm indices set in *bx* of *view*."""
+        return list(iter_bits(self.row(bx, view)))
+    def plane(self, view='sim'):
+        """Returns NumPy array (BX x width) of bits of *view*, bit order of
+        columns is algorithm index (requires NumPy).
+        """
+        self._check_view(view)
+        if view == 'xor':
+            packed = self._packed('tv') ^ self._packed('sim')
+        else:
+            packed = self._packed(view)
+        return numpy.unpackbits(packed, axis=1)[:, ::-1]
+    def _packed(self, plane):
+        return numpy.frombuffer(self._mmap, dtype=numpy.uint8, count=self.n_bx * self.row_size, offset=self.offsets[plane]).reshape(self.n_bx, self.row_size)
+    def bx(self, index, view='sim', first=0, last=None):
+        """Returns list of BX of range [first, last) with algorithm *index* set in *view*."""
+        self._check_view(view)
+        last = self.n_bx if last is None else min(last, self.n_bx)
+        if numpy is not None:
+            column = self.row_size - 1 - index // 8 # byte of algorithm in big endian row
+            if view == 'xor':
+                column = self._packed('tv')[first:last, column] ^ self._packed('sim')[first:last, column]
+            else:
+                column = self._packed(view)[first:last, column]
+            return (numpy.nonzero((column >> (index % 8)) & 1)[0] + first).tolist()
+        return [bx for bx, word in self.rows(first, last, view) if (word >> index) & 1]
+    def counts(self, view='sim'):
+        """Returns list of number of BX with algorithm set per algorithm index of *view*."""
+        if numpy is not None:
+            return self.plane(view).sum(axis=0, dtype=numpy.int64).tolist()
+        counts = [0] * self.width
+        for _, word in self.rows(view=view):
+            for bit in iter_bits(word):
+                counts[bit] += 1
+        return counts
+    def n_mismatch(self):
+        """Returns number of BX with any mismatching algorithm."""
+        return sum(1 for _, word in self.rows(view='xor') if word)
+
+def index_range(value):
+    """Returns tuple (first, last) of command line argument `first:last'."""
+    first, _, last = value.partition(':')
+    return int(first or 0), int(last) if last else None
+
+def parse_args():
+    """Parse command line arguments."""
+    import argparse
+    parser = argparse.ArgumentParser(description="query BX x algorithm matrix of a simulation run")
+    parser.add_argument('matrix', help="matrix file (mismatch_matrix.bin of a run)")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('info', help="print dimensions and mismatch summary")
+    subparser = subparsers.add_parser('rows', help="print algorithms set per BX")
+    subparser.add_argument('first', type=int, help="first BX")
+    subparser.add_argument('last', type=int, nargs='?', help="last BX (including), default is first")
+    subparser.add_argument('--view', choices=VIEWS, default='xor', help="view, default is xor")
+    subparser.add_argument('--algos', metavar='<first>:<last>', type=index_range, default=(0, None), help="algorithm index range (excluding last)")
+    subparser = subparsers.add_parser('column', help="print BX with an algorithm set")
+    subparser.add_argument('index', type=int, help="algorithm index")
+    subparser.add_argument('--view', choices=VIEWS, default='xor', help="view, default is xor")
+    subparser.add_argument('--first', type=int, default=0, help="first BX")
+    subparser.add_argument('--last', type=int, help="last BX (including)")
+    subparser = subparsers.add_parser('counts', help="print number of BX per algorithm")
+    subparser.add_argument('--view', choices=VIEWS, default='xor', help="view, default is xor")
+    args = parser.parse_args()
+    if not args.command:
+        parser.error("missing command")
+    return args
+
+def main():
+    args = parse_args()
+    with BxMatrix(args.matrix) as matrix:
+        if args.command == 'info':
+            counts = matrix.counts('xor')
+            print("BX: {0}, width: {1}, BX with mismatches: {2}, algorithms failing: {3}".format(
+                matrix.n_bx, matrix.width, matrix.n_mismatch(), sum(1 for count in counts if count)))
+        elif args.command == 'rows':
+            last = args.first if args.last is None else args.last
+            first_index, last_index = args.algos
+            last_index = matrix.width if last_index is None else last_index
+            mask = ((1 << last_index) - 1) & ~((1 << first_index) - 1)
+            for bx, word in matrix.rows(args.first, last + 1, args.view):
+                word &= mask
+                print("{0:>5} {1:>4} {2}".format(bx, popcount(word), ' '.join(str(bit) for bit in iter_bits(word))))
+        elif args.command == 'column':
+            last = None if args.last is None else args.last + 1
+            bx_list = matrix.bx(args.index, args.view, args.first, last)
+            print("{0} BX: {1}".format(len(bx_list), ' '.join(str(bx) for bx in bx_list)))
+        elif args.command == 'counts':
+            for index, count in enumerate(matrix.counts(args.view)):
+                if count:
+                    print("{0:>5} {1:>8}".format(index, count))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,23 +9,13 @@ import logging
 import glob
 import sys, os
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'scripts'))
+from template import render_template # shared template engine (scripts/template.py)
+
 # Directories.
 SCRIPTS_DIR = 'scripts'
 TB_DIR = 'testbench'
 
-def render_template(src, dst, args):
-    """Replaces content of file *src* with values of dictionary *args* and writes to file *dst*.
-    >>> render_template("template.txt", "sample.txt", { 'foo' : "bar", })
-    """
-    logging.info("rendering template %s as %s", src, dst)
-    with open(src) as src:
-        content = src.read()
-    for needle, subst in args.items():
-        logging.info("  replacing `%s' by `%s'", needle, subst)
-        content = content.replace(needle, subst)
-    with open(dst, 'w') as dst:
-        dst.write(content)
-
 def parse():
     """Parse command line arguments."""
     parser = argparse.ArgumentParser()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Stand-in for ModelSim vsim used by bench_simulation.py.
+#
+
+"""Stand-in for `vsim -c ... -do "do <file>; quit -f"' without a simulator.
+
+Interprets the do-files rendered by run_simulation.py just far enough to
+honour their contract:
+
+  vlib work                     creates the (empty) work library
+  vmap work <dir>               maps the work library, appends the mapping to
+                                the -modelsimini file
+  file delete -force work       removes the work library
+  file copy <lib> work          copies the precompiled library
+  vcom ... <source>             copies the source into the work library
+  vsim ... -g<name>=<value> work.<entity>
+                                loads the testbench from the work library
+  set fileId [open $FILE_NAME]  creates running.lock once the design is "loaded"
+  run <n> ns                    reads the testbench generics and testvector,
+                                writes the results file in testbench format
+
+Behaviour is configured by environment variables:
+
+  FAKE_VSIM_ERROR_RATE  probability of an algorithm mismatch per BX (default 0)
+  FAKE_VSIM_VCOM_TIME   seconds per vcom command (default 0)
+  FAKE_VSIM_BX_TIME     seconds per simulated BX (default 0)
+  FAKE_VSIM_SEED        random seed, combined with the results filename
+"""
+
+import random
+import re
+import shutil
+import time
+import sys, os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testvector
+
+TB_FILE = 'gtl_fdl_wrapper_tb.vhd'
+
+TB_PATTERNS = {
+    'FIRST_BX': r'\bFIRST_BX\s*:\s*integer\s*:=\s*(\d+)',
+    'LAST_BX': r'\bLAST_BX\s*:\s*integer\s*:=\s*(\d+)',
+    'ALGO_MASK': r'constant\s+ALGO_MASK\s*:.*:=\s*X"([0-9a-fA-F]+)"',
+    'TESTVECTOR_FILENAME': r'\bTESTVECTOR_FILENAME\s*:\s*string\s*:=\s*"([^"]+)"',
+    'RESULTS_FILE': r'\bRESULTS_FILE\s*:\s*string\s*:=\s*"([^"]+)"',
+}
+"""Generics and constants of rendered gtl_fdl_wrapper_tb_tpl.vhd."""
+
+def env_float(name, default=0.):
+    return float(os.getenv(name, default))
+
+def read_testbench(filename, generics=None):
+    """Returns dictionary of testbench constants, see TB_PATTERNS, generic
+    defaults are overridden by dictionary *generics*.
+    """
+    with open(filename) as fp:
+        content = fp.read()
+    constants = {}
+    for key, pattern in TB_PATTERNS.items():
+        match = re.search(pattern, content)
+        if not match:
+            raise RuntimeError("missing {0} in testbench {1}".format(key, filename))
+        constants[key] = match.group(1)
+    constants.update(generics or {})
+    return constants
+
+def simulate(tb_file, generics=None):
+    """Writes results file of testbench *tb_file* using *generics*, injecting
+    random mismatches.
+    """
+    constants = read_testbench(tb_file, generics)
+    first_bx = int(constants['FIRST_BX'])
+    last_bx = int(constants['LAST_BX'])
+    mask = int(constants['ALGO_MASK'], 16)
+    mask_bits = list(testvector.iter_bits(mask))
+    error_rate = env_float('FAKE_VSIM_ERROR_RATE')
+    rng = random.Random('{0}:{1}'.format(os.getenv('FAKE_VSIM_SEED', ''), constants['RESULTS_FILE']))
+    counts_tv = [0] * testvector.ALGO_BITS
+    counts_sim = [0] * testvector.ALGO_BITS
+    errors = []
+    for bx, (algos, finor) in enumerate(testvector.read_algos(constants['TESTVECTOR_FILENAME'])):
+        if not first_bx <= bx <= last_bx:
+            continue
+        algos_tv = int(algos, 16) & mask
+        algos_sim = algos_tv
+        if mask_bits and rng.random() < error_rate:
+            algos_sim ^= 1 << rng.choice(mask_bits)
+        for bit in testvector.iter_bits(algos_tv):
+            counts_tv[bit] += 1
+        for bit in testvector.iter_bits(algos_sim):
+            counts_sim[bit] += 1
+        if algos_sim != algos_tv:
+            errors.append((bx, algos_tv, algos_sim))
+    time.sleep(env_float('FAKE_VSIM_BX_TIME') * (last_bx - first_bx + 1))
+    with open(constants['RESULTS_FILE'], 'w') as fp:
+        fp.write('{\n  "errors": [\n')
+        for index, (bx, algos_tv, algos_sim) in enumerate(errors):
+            fp.write('    {\n')
+            fp.write('      "bx-nr": {0},\n'.format(bx))
+            fp.write('      "algos_tv":  "0x{0:0128x}",\n'.format(algos_tv))
+            fp.write('      "algos_sim": "0x{0:0128x}",\n'.format(algos_sim))
+            fp.write('      "finor_tv":  {0},\n'.format(int(bool(algos_tv))))
+            fp.write('      "finor_sim": {0}\n'.format(int(bool(algos_sim))))
+            fp.write('    },\n' if index < len(errors) - 1 else '    }\n')
+        fp.write('  ],\n  "counts": [\n')
+        for bit in range(testvector.ALGO_BITS):
+            fp.write('    {{"algo_index": {0}, "algo_tv": {1}, "algo_sim": {2}}}{3}\n'.format(
+                bit, counts_tv[bit], counts_sim[bit], ',' if bit < testvector.ALGO_BITS - 1 else ''))
+        fp.write('  ]\n}\n')
+
+def run_do_file(filename, ini_file=None):
+    """Interprets do-file *filename* in the current directory, library
+    mappings are written to *ini_file*.
+    """
+    variables = {}
+    libraries = {'work': os.path.join(os.getcwd(), 'work')}
+    design = {}
+    def substitute(value):
+        value = value.replace('[pwd]', os.getcwd())
+        return re.sub(r'\$(\w+)', lambda match: variables.get(match.group(1), match.group(0)), value)
+    with open(filename) as fp:
+        for line in fp:
+            tokens = line.split()
+            if not tokens or tokens[0].startswith('#'):
+                continue
+            if tokens[0] == 'set' and len(tokens) == 3:
+                variables[tokens[1]] = substitute(tokens[2])
+            elif tokens[:2] == ['vlib', 'work']:
+                if not os.path.isdir('work'):
+                    os.makedirs('work')
+            elif tokens[0] == 'vmap' and len(tokens) == 3:
+                libraries[tokens[1]] = substitute(tokens[2])
+                if ini_file:
+                    with open(ini_file, 'a') as fp:
+                        fp.write('{0} = {1}\n'.format(tokens[1], substitute(tokens[2])))
+            elif tokens[:2] == ['file', 'delete'] and tokens[-1] == 'work':
+                shutil.rmtree('work', ignore_errors=True)
+            elif tokens[:2] == ['file', 'copy'] and tokens[-1] == 'work':
+                shutil.copytree(substitute(tokens[2]), 'work')
+            elif tokens[0] == 'vcom':
+                time.sleep(env_float('FAKE_VSIM_VCOM_TIME'))
+                source = substitute(tokens[-1])
+                if os.path.isfile(source):
+                    shutil.copy(source, libraries['work'])
+            elif tokens[0] == 'vsim':
+                library = libraries[tokens[-1].split('.')[0]]
+                design['tb_file'] = os.path.join(library, TB_FILE)
+                design['generics'] = dict(token[2:].split('=', 1) for token in tokens if token.startswith('-g'))
+            elif tokens[:2] == ['set', 'fileId']:
+                with open(variables['FILE_NAME'], 'w'):
+                    pass
+            elif tokens[0] == 'run':
+                simulate(design['tb_file'], design['generics'])
+
+def main():
+    args = sys.argv[1:]
+    if '-do' not in args:
+        raise RuntimeError("missing -do argument")
+    ini_file = args[args.index('-modelsimini') + 1] if '-modelsimini' in args else None
+    for command in args[args.index('-do') + 1].split(';'):
+        tokens = command.split()
+        if tokens and tokens[0] == 'do':
+            run_do_file(tokens[1], ini_file)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
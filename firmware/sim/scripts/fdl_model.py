@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+#
+
+"""This module provides a bit accurate model of the FDL stage (per BX).
+
+Models the algorithm slices (algo_slice.vhd) and the FINOR/veto logic of
+fdl_module.vhd for the algorithm bits of a testvector:
+
+  algo_after_bxomask    algo and algo_bx_mask (and algorithm mask)
+  algo_after_prescaler  every n-th trigger of algo_after_bxomask
+                        (algo_pre_scaler.vhd, factor 0 suppresses the algorithm)
+  veto                  algo_after_prescaler and veto_mask
+  finor_with_veto       OR of algo_after_prescaler and not OR of veto
+  rate counters         triggers before and after prescaler, post dead time
+                        (algo delayed by L1A latency and L1A), saturating
+                        (algo_rate_counter.vhd, algo_post_dead_time_counter.vhd)
+
+Outputs are aligned to the testvector BX, the FDL pipeline latency is not
+modelled. Counters start at zero and are not reset by lumi sections.
+
+Signals are evaluated for all BX at once: every algorithm is represented by
+an integer with bit n set if the algorithm fired in BX n (BX bitset).
+Prescalers use NumPy if available.
+
+>>> from fdl_model import FdlConfig, FdlModel
+>>> model = FdlModel.from_testvector("TestVector_L1Menu_Sample.txt")
+>>> result = model.run(FdlConfig(prescale_factors={42: 2}, veto_mask=1 << 7))
+>>> result.rate_before_prescaler[42], result.rate_after_prescaler[42]
+(17, 8)
+>>> result.finor_count()
+1201
+>>> for bx, algos, expected, finor, expected_finor in result.mismatches(model.rows, model.finors):
+...     pass
+
+Sweep prescale scenarios reading the testvector once:
+
+>>> results = [model.run(FdlConfig(prescale_factors={42: factor})) for factor in range(1, 10)]
+"""
+
+import binascii
+
+from testvector import ALGO_BITS, iter_bits, popcount, read_algos
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['FdlConfig', 'FdlModel', 'FdlResult', 'bx_range']
+
+RATE_COUNTER_WIDTH = 32
+PRESCALER_COUNTER_WIDTH = 24
+
+def bx_range(first, last):
+    """Returns BX bitset of BX *first* to *last* (including).
+    >>> bin(bx_range(1, 3))
+    '0b1110'
+    """
+    return ((1 << (last - first + 1)) - 1) << first
+
+def transpose(words, width):
+    """Returns list of *width* integers, bit n of integer k is bit k of
+    *words[n]* (rows of algorithm words to BX bitsets and vice versa).
+    """
+    n_words = len(words)
+    planes = [bytearray(b'0' * n_words) for _ in range(width)]
+    for index, word in enumerate(words):
+        pos = n_words - 1 - index
+        for bit in iter_bits(word):
+            planes[bit][pos] = 0x31 # '1'
+    return [int(plane.decode('ascii'), 2) if n_words else 0 for plane in planes]
+
+def saturate(count, width=RATE_COUNTER_WIDTH):
+    """Returns counter value saturating at all ones."""
+    return min(count, (1 << width) - 1)
+
+def _prescale_numpy(column, factor):
+    n_bytes = (column.bit_length() + 7) // 8
+    data = numpy.frombuffer(binascii.unhexlify('{0:0{1}x}'.format(column, n_bytes * 2)), dtype=numpy.uint8)
+    bits = numpy.unpackbits(data)[::-1] # index is BX
+    fired = (bits == 1) & (numpy.cumsum(bits, dtype=numpy.int64) % factor == 0)
+    return int(binascii.hexlify(numpy.packbits(fired[::-1]).tobytes()), 16)
+
+def prescale(column, factor, use_numpy=None):
+    """Returns BX bitset of every *factor*-th set bit of *column* (counter
+    starting at zero), factor 0 suppresses all. Factors must fit into the
+    prescaler counter (PRESCALER_COUNTER_WIDTH bits). NumPy is used if
+    available unless *use_numpy* is False.
+    >>> bin(prescale(0b1111011, 2))
+    '0b1010010'
+    """
+    if not 0 <= factor < (1 << PRESCALER_COUNTER_WIDTH):
+        raise ValueError("prescale factor out of range: {0}".format(factor))
+    if factor == 1:
+        return column
+    if factor == 0 or not column:
+        return 0
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy:
+        return _prescale_numpy(column, factor)
+    result = 0
+    for bx in list(iter_bits(column))[factor - 1::factor]:
+        result |= 1 << bx
+    return result
+
+class FdlConfig(object):
+    """FDL configuration.
+    *prescale_factors* dictionary algorithm index to prescale factor (default 1),
+    *algo_mask* integer of enabled algorithms (default all),
+    *bx_masks* dictionary algorithm index to BX bitset of enabled BX (default all, see bx_range),
+    *veto_mask* integer of veto algorithms (default none),
+    *l1a* BX bitset of BX with L1A (default none),
+    *l1a_latency_delay* delay of algorithms for post dead time counters in BX.
+    """
+    def __init__(self, prescale_factors=None, algo_mask=None, bx_masks=None, veto_mask=0, l1a=0, l1a_latency_delay=0):
+        self.prescale_factors = prescale_factors or {}
+        self.algo_mask = algo_mask
+        self.bx_masks = bx_masks or {}
+        self.veto_mask = veto_mask
+        self.l1a = l1a
+        self.l1a_latency_delay = l1a_latency_delay
+
+class FdlResult(object):
+    """FDL model outputs for all BX.
+    *algo_after_bxomask*, *algo_after_prescaler*, *veto* lists of BX bitsets
+    per algorithm index, *finor*, *local_veto*, *finor_with_veto* BX bitsets,
+    *rate_before_prescaler*, *rate_after_prescaler*, *rate_post_dead_time*
+    lists of counter values per algorithm index.
+    """
+    def __init__(self, n_bx, width):
+        self.n_bx = n_bx
+        self.width = width
+        self.algo_after_bxomask = []
+        self.algo_after_prescaler = []
+        self.veto = []
+        self.finor = 0
+        self.local_veto = 0
+        self.finor_with_veto = 0
+        self.rate_before_prescaler = []
+        self.rate_after_prescaler = []
+        self.rate_post_dead_time = []
+    def rows(self):
+        """Returns list of algo_after_prescaler words (integer) per BX."""
+        return transpose(self.algo_after_prescaler, self.n_bx)
+    def finors(self):
+        """Returns list of finor_with_veto bits per BX."""
+        return [(self.finor_with_veto >> bx) & 1 for bx in range(self.n_bx)]
+    def finor_count(self):
+        """Returns number of BX with finor_with_veto."""
+        return popcount(self.finor_with_veto)
+    def mismatches(self, rows, finors):
+        """Yields tuples (bx, algos, expected_algos, finor, expected_finor) of
+        every BX with algorithm words *rows* or FINOR bits *finors* (eg. of a
+        testvector) differing from the model.
+        """
+        for bx, (algos, expected, finor, expected_finor) in enumerate(zip(rows, self.rows(), finors, self.finors())):
+            if algos != expected or finor != expected_finor:
+                yield bx, algos, expected, finor, expected_finor
+
+class FdlModel(object):
+    """FDL model of algorithm words *rows* (integer per BX), with testvector
+    FINOR bits *finors* for comparison.
+    """
+    def __init__(self, rows, finors=None, width=ALGO_BITS):
+        self.rows = list(rows)
+        self.finors = list(finors) if finors is not None else None
+        self.width = width
+        self.n_bx = len(self.rows)
+        self.columns = transpose(self.rows, width)
+    @classmethod
+    def from_testvector(cls, filename, width=ALGO_BITS):
+        """Returns model of algorithm bits of a text or binary testvector file."""
+        rows = []
+        finors = []
+        for algos, finor in read_algos(filename):
+            rows.append(int(algos, 16))
+            finors.append(int(finor, 16))
+        return cls(rows, finors, width)
+    def run(self, config):
+        """Returns FdlResult of FdlConfig *config*."""
+        result = FdlResult(self.n_bx, self.width)
+        all_bx = (1 << self.n_bx) - 1
+        algo_mask = config.algo_mask if config.algo_mask is not None else (1 << self.width) - 1
+        delay = config.l1a_latency_delay
+        for index, column in enumerate(self.columns):
+            if not (algo_mask >> index) & 1:
+                column = 0
+            column &= config.bx_masks.get(index, all_bx)
+            prescaled = prescale(column, config.prescale_factors.get(index, 1))
+            veto = prescaled if (config.veto_mask >> index) & 1 else 0
+            result.algo_after_bxomask.append(column)
+            result.algo_after_prescaler.append(prescaled)
+            result.veto.append(veto)
+            result.finor |= prescaled
+            result.local_veto |= veto
+            result.rate_before_prescaler.append(saturate(popcount(column)))
+            result.rate_after_prescaler.append(saturate(popcount(prescaled)))
+            result.rate_post_dead_time.append(saturate(popcount((prescaled << delay) & config.l1a & all_bx)))
+        result.finor_with_veto = result.finor & ~result.local_veto
+        return result
+
+def parse_args():
+    """Parse command line arguments."""
+    import argparse
+    def index_value(value):
+        index, factor = value.split('=')
+        return int(index), int(factor)
+    parser = argparse.ArgumentParser(description="FDL model pre-check of a testvector")
+    parser.add_argument('testvector', help="text or binary testvector file")
+    parser.add_argument('--prescale', metavar='<index>=<factor>', type=index_value, nargs='+', default=[], help="prescale factors")
+    parser.add_argument('--mask', metavar='<hex>', type=lambda value: int(value, 16), help="algorithm mask")
+    parser.add_argument('--veto', metavar='<index>', type=int, nargs='+', default=[], help="veto algorithms")
+    return parser.parse_args()
+
+def main():
+    import time
+    args = parse_args()
+    t0 = time.time()
+    model = FdlModel.from_testvector(args.testvector)
+    config = FdlConfig(
+        prescale_factors=dict(args.prescale),
+        algo_mask=args.mask,
+        veto_mask=sum(1 << index for index in set(args.veto)),
+    )
+    result = model.run(config)
+    mismatches = list(result.mismatches(model.rows, model.finors))
+    print("BX: {0}, FINOR: {1}, BX differing from testvector: {2} ({3:.3f} s)".format(model.n_bx, result.finor_count(), len(mismatches), time.time() - t0))
+    print("|-------|------------|------------|------------|")
+    print("| Index | before ps. | after ps.  | post dt.   |")
+    print("|-------|------------|------------|------------|")
+    for index in range(model.width):
+        if result.rate_before_prescaler[index]:
+            print("|{0:>7}|{1:>12}|{2:>12}|{3:>12}|".format(index, result.rate_before_prescaler[index], result.rate_after_prescaler[index], result.rate_post_dead_time[index]))
+    print("|-------|------------|------------|------------|")
+    return 0
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#
+
+"""This module provides streaming access to simulation results files.
+
+A results file (results_module_N.json) written by the testbench holds an
+array of error records, one for every mismatching BX, and an array of
+algorithm trigger counts:
+
+  {
+    "errors": [
+      {"bx-nr": 42, "algos_tv": "0x...", "algos_sim": "0x...", "finor_tv": 1, "finor_sim": 0},
+      ...
+    ],
+    "counts": [
+      {"algo_index": 0, "algo_tv": 17, "algo_sim": 17},
+      ...
+    ]
+  }
+
+Records are decoded one at a time, the document is never held in memory.
+
+>>> from results import iter_errors, analyse_results
+>>> for error in iter_errors("results_module_0.json"):
+...     print(error['bx-nr'], error.diff)
+42 [3, 17]
+>>> stats = analyse_results("results_module_0.json")
+>>> stats.n_errors, stats.first_bx, stats.last_bx
+(1, 42, 42)
+>>> stats.missing[3], stats.unexpected[17]
+(1, 1)
+
+Mismatching algorithms are found by a single XOR of the algorithm words,
+iterating only the set bits of the difference.
+
+Aggregate the trigger counts of all modules into dense module x algorithm
+matrices (NumPy arrays if available):
+
+>>> from results import CountsMatrix
+>>> counts = CountsMatrix.from_results(["results_module_0.json", "results_module_1.json"])
+>>> counts_tv, counts_sim = counts.totals()
+>>> counts.multiple('sim')
+{42: [(0, 17), (1, 17)]}
+"""
+
+import json
+
+from testvector import ALGO_BITS, iter_bits
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['ErrorRecord', 'MismatchStats', 'CountsMatrix', 'iter_array', 'iter_errors', 'iter_counts', 'analyse_results', 'write_results', 'unmapped_triggers']
+
+CHUNK_SIZE = 1 << 16
+"""Number of characters read at once."""
+
+class ErrorRecord(dict):
+    """Error record of a single BX with decoded algorithm words.
+    *algos_tv*, *algos_sim* algorithm words (integer), *diff* list of indices
+    of mismatching algorithms, *missing* mask of algorithms expected but not
+    triggered, *unexpected* mask of algorithms triggered but not expected.
+    """
+    def __init__(self, record):
+        super(ErrorRecord, self).__init__(record)
+        self.bx = record['bx-nr']
+        self.algos_tv = int(record['algos_tv'], 16)
+        self.algos_sim = int(record['algos_sim'], 16)
+        self.mismatch = self.algos_tv ^ self.algos_sim
+        self.missing = self.mismatch & self.algos_tv
+        self.unexpected = self.mismatch & self.algos_sim
+        self.diff = list(iter_bits(self.mismatch))
+        self.finor_mismatch = int(record['finor_tv']) != int(record['finor_sim'])
+
+class MismatchStats(object):
+    """Per algorithm mismatch histograms of a results file.
+    *missing* list of BX count with algorithm expected but not triggered,
+    *unexpected* list of BX count with algorithm triggered but not expected,
+    *first* and *last* lists of first and last failing BX of every algorithm
+    (None if never failing), *bx* dictionary algorithm index to list of
+    failing BX, *first_bx* and *last_bx* first and last failing BX of any
+    algorithm or FINOR.
+    """
+    def __init__(self, width=ALGO_BITS):
+        self.missing = [0] * width
+        self.unexpected = [0] * width
+        self.first = [None] * width
+        self.last = [None] * width
+        self.bx = {}
+        self.n_errors = 0
+        self.finor_errors = 0
+        self.first_bx = None
+        self.last_bx = None
+    def add(self, error):
+        """Adds an ErrorRecord."""
+        bx = error.bx
+        self.n_errors += 1
+        if error.finor_mismatch:
+            self.finor_errors += 1
+        if self.first_bx is None or bx < self.first_bx:
+            self.first_bx = bx
+        if self.last_bx is None or bx > self.last_bx:
+            self.last_bx = bx
+        for bit in iter_bits(error.missing):
+            self.missing[bit] += 1
+        for bit in iter_bits(error.unexpected):
+            self.unexpected[bit] += 1
+        for bit in error.diff:
+            self.bx.setdefault(bit, []).append(bx)
+            if self.first[bit] is None or bx < self.first[bit]:
+                self.first[bit] = bx
+            if self.last[bit] is None or bx > self.last[bit]:
+                self.last[bit] = bx
+    def failing(self):
+        """Returns sorted list of indices of algorithms with mismatches."""
+        return [index for index, bx in enumerate(self.first) if bx is not None]
+
+def iter_array(filename, key, chunk_size=CHUNK_SIZE):
+    """Yields items of top level array *key* of JSON file *filename*, decoding
+    one item at a time.
+    """
+    decoder = json.JSONDecoder()
+    needle = '"{0}"'.format(key)
+    with open(filename) as fp:
+        buf = ''
+        # seek to start of array
+        while True:
+            pos = buf.find(needle)
+            if pos >= 0:
+                start = buf.find('[', pos + len(needle))
+                if start >= 0:
+                    buf = buf[start + 1:]
+                    break
+                buf = buf[pos:]
+            else:
+                buf = buf[-len(needle):]
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                return
+            buf += chunk
+        # decode items
+        pos = 0
+        eof = False
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if buf.startswith(']', pos):
+                return
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise RuntimeError("truncated results file: {0}".format(filename))
+                chunk = fp.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+
+def iter_errors(filename):
+    """Yields ErrorRecord of every error record of a results file."""
+    for record in iter_array(filename, 'errors'):
+        yield ErrorRecord(record)
+
+def iter_counts(filename):
+    """Yields dictionaries (algo_index, algo_tv, algo_sim) of a results file."""
+    return iter_array(filename, 'counts')
+
+def analyse_results(filename, width=ALGO_BITS):
+    """Returns MismatchStats of a results file."""
+    stats = MismatchStats(width)
+    for error in iter_errors(filename):
+        stats.add(error)
+    return stats
+
+def write_results(fp, errors, counts):
+    """Writes results file of iterables of *errors* and *counts* records to
+    file object *fp*, one record at a time.
+    """
+    fp.write('{\n  "errors": [')
+    for index, error in enumerate(errors):
+        fp.write(',\n    ' if index else '\n    ')
+        json.dump(dict(error), fp, sort_keys=True)
+    fp.write('\n  ],\n  "counts": [')
+    for index, count in enumerate(counts):
+        fp.write(',\n    ' if index else '\n    ')
+        json.dump(count, fp, sort_keys=True)
+    fp.write('\n  ]\n}\n')
+
+class CountsMatrix(object):
+    """Dense module x algorithm trigger counts: *tv* and *sim* hold one row of
+    *width* counts per module (NumPy arrays if available, else lists of lists).
+    """
+    def __init__(self, n_modules, width=ALGO_BITS):
+        self.n_modules = n_modules
+        self.width = width
+        if numpy is not None:
+            self.tv = numpy.zeros((n_modules, width), dtype=numpy.int64)
+            self.sim = numpy.zeros((n_modules, width), dtype=numpy.int64)
+        else:
+            self.tv = [[0] * width for _ in range(n_modules)]
+            self.sim = [[0] * width for _ in range(n_modules)]
+    @classmethod
+    def from_results(cls, filenames, width=ALGO_BITS):
+        """Returns matrix of results files *filenames*, row index is the list index."""
+        filenames = list(filenames)
+        counts = cls(len(filenames), width)
+        for row, filename in enumerate(filenames):
+            counts.load(row, filename)
+        return counts
+    def load(self, row, filename):
+        """Loads counts of a results file into *row*."""
+        tv = self.tv[row]
+        sim = self.sim[row]
+        for count in iter_counts(filename):
+            index = count['algo_index']
+            tv[index] = count['algo_tv']
+            sim[index] = count['algo_sim']
+    def totals(self):
+        """Returns tuple (tv, sim) of lists of counts per algorithm summed over all modules."""
+        if numpy is not None:
+            return self.tv.sum(axis=0).tolist(), self.sim.sum(axis=0).tolist()
+        return [sum(column) for column in zip(*self.tv)], [sum(column) for column in zip(*self.sim)]
+    def multiple(self, which='sim'):
+        """Returns dictionary algorithm index to list of tuples (row, count)
+        of algorithms counted in more than one module, *which* is 'tv' or 'sim'.
+        """
+        matrix = getattr(self, which)
+        result = {}
+        if numpy is not None:
+            fired = matrix != 0
+            for index in numpy.nonzero(fired.sum(axis=0) > 1)[0].tolist():
+                result[index] = [(row, int(matrix[row, index])) for row in numpy.nonzero(fired[:, index])[0].tolist()]
+            return result
+        for index, column in enumerate(zip(*matrix)):
+            rows = [(row, count) for row, count in enumerate(column) if count]
+            if len(rows) > 1:
+                result[index] = rows
+        return result
+
+def unmapped_triggers(counts, indices):
+    """Returns list of tuples (index, count) of non zero *counts* (list of
+    counts per algorithm index) not in *indices* (eg. algorithms of a menu).
+    """
+    if numpy is not None:
+        counts = numpy.asarray(counts, dtype=numpy.int64)
+        unmapped = numpy.ones(len(counts), dtype=bool)
+        unmapped[[index for index in indices if index < len(counts)]] = False
+        return [(index, int(counts[index])) for index in numpy.nonzero(counts * unmapped)[0].tolist()]
+    indices = set(indices)
+    return [(index, count) for index, count in enumerate(counts) if count and index not in indices]
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#
+
+"""This module provides a historical database of simulation results (SQLite).
+
+Every run appended by `run_simulation.py --results-db <file>' adds a row to
+table `runs' and one row per module and algorithm to table `algo_results':
+
+  runs           id, started, base_dir, menu_name, menu_uuid, firmware_uuid,
+                 testvector, n_modules, success
+  algo_results   run_id, module_id, algo_index, algo_name, count_tv,
+                 count_sim, n_mismatch, first_bx, last_bx, mismatch_bx
+
+An algorithm fails in a run if trigger counts differ or any BX mismatches,
+*mismatch_bx* is a comma separated list of the mismatching BX. Queries by
+algorithm index or name and by menu UUID are served by indexes.
+
+>>> from resultsdb import ResultsDB
+>>> db = ResultsDB("sim_results.sqlite")
+>>> for run in db.history(137):
+...     print(run['started'], run['count_tv'], run['count_sim'], run['failing'])
+>>> db.first_mismatch('L1_SingleMu22')
+{'id': 12, 'started': ..., 'last_good': 11, ...}
+>>> db.regressions()
+[(137, 'L1_SingleMu22')]
+
+Command line:
+
+  $ python resultsdb.py sim_results.sqlite runs --limit 10
+  $ python resultsdb.py sim_results.sqlite history 137
+  $ python resultsdb.py sim_results.sqlite first-mismatch L1_SingleMu22
+  $ python resultsdb.py sim_results.sqlite regressions
+  $ python resultsdb.py sim_results.sqlite mismatches 12
+"""
+
+import datetime
+import sqlite3
+
+__all__ = ['ResultsDB', 'format_bx', 'parse_bx']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    base_dir TEXT,
+    menu_name TEXT,
+    menu_uuid TEXT,
+    firmware_uuid TEXT,
+    testvector TEXT,
+    n_modules INTEGER,
+    success INTEGER
+);
+CREATE TABLE IF NOT EXISTS algo_results (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    module_id INTEGER NOT NULL,
+    algo_index INTEGER NOT NULL,
+    algo_name TEXT,
+    count_tv INTEGER NOT NULL,
+    count_sim INTEGER NOT NULL,
+    n_mismatch INTEGER NOT NULL,
+    first_bx INTEGER,
+    last_bx INTEGER,
+    mismatch_bx TEXT,
+    PRIMARY KEY (run_id, module_id, algo_index)
+);
+CREATE INDEX IF NOT EXISTS runs_menu_uuid ON runs (menu_uuid, started);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE INDEX IF NOT EXISTS algo_results_index ON algo_results (algo_index, run_id);
+CREATE INDEX IF NOT EXISTS algo_results_name ON algo_results (algo_name, run_id);
+"""
+
+FAILING = "(a.count_tv != a.count_sim OR a.n_mismatch > 0)"
+"""SQL condition of a failing algorithm row."""
+
+def format_bx(bx_list):
+    """Returns comma separated string of BX numbers (None if empty)."""
+    return ','.join(str(bx) for bx in bx_list) or None
+
+def parse_bx(value):
+    """Returns list of BX numbers of a comma separated string."""
+    return [int(bx) for bx in value.split(',')] if value else []
+
+def format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%S')
+
+class ResultsDB(object):
+    """Results database of SQLite file *filename*, created if missing."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+    def close(self):
+        self.connection.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+    def add_run(self, started, base_dir, menu, testvector, success, rows):
+        """Adds a run of XmlMenu *menu* started at timestamp *started*, *rows*
+        is an iterable of tuples (module_id, algo_index, algo_name, count_tv,
+        count_sim, mismatch_bx) with list of mismatching BX *mismatch_bx*.
+        Returns the run id.
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (started, base_dir, menu_name, menu_uuid, firmware_uuid, testvector, n_modules, success) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (started, base_dir, menu.name, menu.uuid_menu, menu.uuid_firmware, testvector, menu.n_modules, int(bool(success))))
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO algo_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((run_id, module_id, index, name, count_tv, count_sim, len(bx_list),
+                  min(bx_list) if bx_list else None, max(bx_list) if bx_list else None, format_bx(bx_list))
+                 for module_id, index, name, count_tv, count_sim, bx_list in rows))
+        return run_id
+    def latest_run(self, menu_uuid=None):
+        """Returns id of latest run (of menu *menu_uuid*) or None."""
+        if menu_uuid:
+            row = self.connection.execute("SELECT id FROM runs WHERE menu_uuid = ? ORDER BY started DESC, id DESC LIMIT 1", (menu_uuid,)).fetchone()
+        else:
+            row = self.connection.execute("SELECT id FROM runs ORDER BY started DESC, id DESC LIMIT 1").fetchone()
+        return row['id'] if row else None
+    def runs(self, menu_uuid=None, limit=None):
+        """Returns list of runs (latest first) with number of failing algorithms."""
+        query = """SELECT r.*, (SELECT COUNT(DISTINCT a.algo_index) FROM algo_results a WHERE a.run_id = r.id AND {0}) AS n_failing
+            FROM runs r {1} ORDER BY r.started DESC, r.id DESC LIMIT ?""".format(FAILING, "WHERE r.menu_uuid = ?" if menu_uuid else "")
+        params = ([menu_uuid] if menu_uuid else []) + [limit or -1]
+        return self.connection.execute(query, params).fetchall()
+    def _algo_condition(self, algo):
+        """Returns tuple (SQL condition, parameter) selecting algorithm *algo* (index or name)."""
+        if isinstance(algo, int):
+            return "a.algo_index = ?", algo
+        return "a.algo_name = ?", algo
+    def history(self, algo, menu_uuid=None, limit=None):
+        """Returns list of runs (oldest first) of algorithm *algo* (index or
+        name) with counts and mismatches summed over all modules.
+        """
+        condition, param = self._algo_condition(algo)
+        query = """SELECT * FROM (
+            SELECT r.id, r.started, r.menu_name, r.menu_uuid, MAX(a.algo_name) AS algo_name,
+                SUM(a.count_tv) AS count_tv, SUM(a.count_sim) AS count_sim, SUM(a.n_mismatch) AS n_mismatch,
+                MIN(a.first_bx) AS first_bx, MAX(a.last_bx) AS last_bx, MAX({0}) AS failing
+            FROM algo_results a JOIN runs r ON r.id = a.run_id
+            WHERE {1} {2}
+            GROUP BY r.id ORDER BY r.started DESC, r.id DESC LIMIT ?
+            ) ORDER BY started, id""".format(FAILING, condition, "AND r.menu_uuid = ?" if menu_uuid else "")
+        params = [param] + ([menu_uuid] if menu_uuid else []) + [limit or -1]
+        return self.connection.execute(query, params).fetchall()
+    def first_mismatch(self, algo, menu_uuid=None):
+        """Returns dictionary of the first run of the latest uninterrupted
+        sequence of runs with algorithm *algo* failing (*last_good* is the id
+        of the run before, None if never passing) or None if the algorithm
+        passes in its latest run.
+        """
+        history = self.history(algo, menu_uuid)
+        if not history or not history[-1]['failing']:
+            return None
+        first = len(history) - 1
+        while first > 0 and history[first - 1]['failing']:
+            first -= 1
+        result = dict(zip(history[first].keys(), history[first]))
+        result['last_good'] = history[first - 1]['id'] if first else None
+        result['n_runs'] = len(history) - first
+        return result
+    def mismatches(self, run_id):
+        """Returns list of failing algorithm rows of run *run_id*."""
+        query = "SELECT a.* FROM algo_results a WHERE a.run_id = ? AND {0} ORDER BY a.algo_index, a.module_id".format(FAILING)
+        return self.connection.execute(query, (run_id,)).fetchall()
+    def regressions(self, run_id=None, previous_id=None):
+        """Returns sorted list of tuples (algo_index, algo_name) failing in run
+        *run_id* (default latest) but not in run *previous_id* (default the
+        run before of the same menu UUID).
+        """
+        if run_id is None:
+            run_id = self.latest_run()
+            if run_id is None:
+                return []
+        if previous_id is None:
+            run = self.connection.execute("SELECT started, menu_uuid FROM runs WHERE id = ?", (run_id,)).fetchone()
+            if run is None:
+                raise RuntimeError("no such run: {0}".format(run_id))
+            row = self.connection.execute(
+                "SELECT id FROM runs WHERE menu_uuid IS ? AND (started < ? OR (started = ? AND id < ?)) ORDER BY started DESC, id DESC LIMIT 1",
+                (run['menu_uuid'], run['started'], run['started'], run_id)).fetchone()
+            if row is None:
+                return []
+            previous_id = row['id']
+        query = """SELECT DISTINCT a.algo_index, a.algo_name FROM algo_results a
+            WHERE a.run_id = ? AND {0} AND a.algo_index NOT IN (
+                SELECT a.algo_index FROM algo_results a WHERE a.run_id = ? AND {0})
+            ORDER BY a.algo_index""".format(FAILING)
+        return [tuple(row) for row in self.connection.execute(query, (run_id, previous_id))]
+
+def algo_value(value):
+    """Returns algorithm index (integer) or name of command line argument."""
+    return int(value) if value.isdigit() else value
+
+def parse_args():
+    """Parse command line arguments."""
+    import argparse
+    parser = argparse.ArgumentParser(description="query historical simulation results")
+    parser.add_argument('database', help="SQLite results database (see run_simulation.py --results-db)")
+    subparsers = parser.add_subparsers(dest='command')
+    subparser = subparsers.add_parser('runs', help="list runs, latest first")
+    subparser.add_argument('--menu-uuid', help="runs of menu UUID only")
+    subparser.add_argument('--limit', type=int, help="max number of runs")
+    subparser = subparsers.add_parser('history', help="trend of an algorithm over runs")
+    subparser.add_argument('algo', type=algo_value, help="algorithm index or name")
+    subparser.add_argument('--menu-uuid', help="runs of menu UUID only")
+    subparser.add_argument('--limit', type=int, help="max number of (latest) runs")
+    subparser = subparsers.add_parser('first-mismatch', help="run an algorithm started failing")
+    subparser.add_argument('algo', type=algo_value, help="algorithm index or name")
+    subparser.add_argument('--menu-uuid', help="runs of menu UUID only")
+    subparser = subparsers.add_parser('regressions', help="algorithms failing in a run but not in the previous run of the same menu")
+    subparser.add_argument('run', type=int, nargs='?', help="run id, default is latest run")
+    subparser.add_argument('--previous', type=int, help="run id to compare with")
+    subparser = subparsers.add_parser('mismatches', help="failing algorithms and mismatching BX of a run")
+    subparser.add_argument('run', type=int, nargs='?', help="run id, default is latest run")
+    args = parser.parse_args()
+    if not args.command:
+        parser.error("missing command")
+    return args
+
+def main():
+    args = parse_args()
+    with ResultsDB(args.database) as db:
+        if args.command == 'runs':
+            print("|------|---------------------|------------------------------------------|--------------------------------------|---------|---------|")
+            print("| Run  | Started             | Menu                                     | Menu UUID                            | Failing | Result  |")
+            print("|------|---------------------|------------------------------------------|--------------------------------------|---------|---------|")
+            for run in db.runs(args.menu_uuid, args.limit):
+                print("|{0:>6}|{1:<21}|{2:<42}|{3:<38}|{4:>9}|{5:<9}|".format(
+                    run['id'], format_time(run['started']), run['menu_name'] or '', run['menu_uuid'] or '', run['n_failing'], 'OK' if run['success'] else 'ERROR'))
+            print("|------|---------------------|------------------------------------------|--------------------------------------|---------|---------|")
+        elif args.command == 'history':
+            print("|------|---------------------|--------|--------|------------|----------|---------|--------|")
+            print("| Run  | Started             | l1a.tv | l1a.hw | BX errors  | first bx | last bx | Result |")
+            print("|------|---------------------|--------|--------|------------|----------|---------|--------|")
+            for run in db.history(args.algo, args.menu_uuid, args.limit):
+                print("|{0:>6}|{1:<21}|{2:>8}|{3:>8}|{4:>12}|{5:>10}|{6:>9}|{7:<8}|".format(
+                    run['id'], format_time(run['started']), run['count_tv'], run['count_sim'], run['n_mismatch'],
+                    '' if run['first_bx'] is None else run['first_bx'], '' if run['last_bx'] is None else run['last_bx'], 'ERROR' if run['failing'] else 'OK'))
+            print("|------|---------------------|--------|--------|------------|----------|---------|--------|")
+        elif args.command == 'first-mismatch':
+            run = db.first_mismatch(args.algo, args.menu_uuid)
+            if run is None:
+                print("algorithm {0} passes in its latest run".format(args.algo))
+            else:
+                print("algorithm {0} ({1}) failing since run {2} ({3}), {4} run(s), last passing run: {5}".format(
+                    args.algo, run['algo_name'] or '-', run['id'], format_time(run['started']), run['n_runs'],
+                    run['last_good'] if run['last_good'] is not None else 'none'))
+        elif args.command == 'regressions':
+            for index, name in db.regressions(args.run, args.previous):
+                print("{0:>5} {1}".format(index, name or '-'))
+        elif args.command == 'mismatches':
+            run_id = args.run if args.run is not None else db.latest_run()
+            for row in db.mismatches(run_id) if run_id is not None else []:
+                print("module {0} algo {1} ({2}): tv = {3} sim = {4}, {5} BX: {6}".format(
+                    row['module_id'], row['algo_index'], row['algo_name'] or '-', row['count_tv'], row['count_sim'], row['n_mismatch'], row['mismatch_bx'] or ''))
+    return 0
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -3,16 +3,35 @@
 #simultion program
 #all credit to Johannes Wittmann and Bernhard Arnold
 import xmlmenu
-import os, sys
-import json
+import testvector
+import results
+import timings
+import resultsdb
+import bxmatrix
+import os, sys, re
+import hashlib
+import glob
+import shutil
+import tempfile
 import subprocess
 import logging
 import argparse
 import time, datetime
+import itertools
+import multiprocessing
 from threading import Thread
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 
-o, ts = os.popen('stty size', 'r').read().split()#terminal size
-ts = int(ts)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'scripts'))
+from template import render_template # shared template engine (scripts/template.py)
+
+try:
+    import pyinotify # optional, file-system notifications for completion tracking
+except ImportError:
+    pyinotify = None
 
 whitered = "\033[37;41;1m"#collor tags
 reset = "\033[0m"
@@ -22,12 +41,33 @@ DEFAULT_MODELSIM_VERSION = '10.3b'
 DEFAULT_MODELSIM_INI_TPL = 'modelsim_tpl.ini'
 
 DO_FILE = 'gtl_fdl_wrapper.do'
+COMPILE_DO_FILE = 'gtl_fdl_wrapper_compile.do'
 TB_FILE_TPL = 'testbench/templates/gtl_fdl_wrapper_tb_tpl.vhd'
 TB_FILE = 'testbench/gtl_fdl_wrapper_tb.vhd'
 
 INI_FILE_TPL = 'modelsim_tpl.ini'
 INI_FILE = 'modelsim.ini'
 DO_FILE_TPL = 'scripts/templates/gtl_fdl_wrapper_tpl.do'
+COMPILE_DO_FILE_TPL = 'scripts/templates/gtl_fdl_wrapper_compile_tpl.do'
+LIB_DO_FILE = 'gtl_fdl_wrapper_lib.do'
+LIB_DO_FILE_TPL = 'scripts/templates/gtl_fdl_wrapper_lib_tpl.do'
+LIB_CACHE_DIR = 'sim_libs'#default location of precompiled libraries (inside output path)
+MATRIX_FILE = 'mismatch_matrix.bin'#BX x algorithm bits of testvector and simulation (see bxmatrix.py)
+RESULT_CACHE_DIR = 'sim_cache'#default location of cached module results (inside output path)
+
+DEFAULT_JOBS = multiprocessing.cpu_count()#default number of parallel vsim workers
+
+POLL_INTERVAL_MIN = 0.01#back-off polling intervals in seconds
+POLL_INTERVAL_MAX = 1.0
+RESULTS_TIMEOUT = 60.0#max seconds to wait for results file after vsim exited
+
+LHC_BUNCH_COUNT = 3564#testvector lines per orbit
+GTL_FDL_LATENCY = 6#see gt_mp7_core_pkg_sim.vhd
+SHARD_WARMUP_BX = 16#overlap of BX shards, covers GTL_FDL_LATENCY and the +/-2 BX pipeline
+# but not prescaler counters (reset at start of each shard), modules with prescale factors other than 1 are not sharded
+CLK40_PERIOD_NS = 24#testbench timing, see gtl_fdl_wrapper_tb_tpl.vhd
+SIM_OFFSET_NS = 1207#PLL and lhc_data setup time of testbench
+SIM_MARGIN_NS = 4000
 
 mp7_tag = 'cactusupgrades'
 algonum = 512#numbers of bits
@@ -38,62 +78,222 @@ IGNORED_ALGOS = [
 def read_file(filename):
     """Returns contents of a file."""
 #    with open(os.path.join(src_dir, 'gtl_module_instances.vhd'), 'rb') as fp:
-    with open(filename, 'rb') as fp:
+    with open(filename) as fp:
         return fp.read()
 
-def render_template(src, dst, args):
-    """Replaces content of file *src* with values of dictionary *args* and writes to file *dst*.
-    >>> render_template("template.txt", "sample.txt", { 'foo' : "bar", })
-    """
-    logging.debug("rendering template %s as %s", src, dst)
-    with open(src) as src:
-        content = src.read()
-    for needle, subst in args.items():
-          logging.debug("  replacing `%s' by `%s'", needle, subst)
-          content = content.replace(needle, subst)
-    with open(dst, 'w') as dst:
-        dst.write(content)
-
-def make_testvector(mask, testvectorfile, new_testverctor):#uses mask of the module, testvector file and the path of the new testvector file where the masked testvectors are stored
-    with open(testvectorfile, 'r') as tvf:
-        with open(new_testverctor,'w') as opf:
-            for line in tvf:
-                colums = line.strip().split()
-                mask_trigger = int(colums[-2], 16) & mask
-                colums[-2] = '%0128x' % mask_trigger
-                colums[-1] = '1' if mask_trigger else '0'
-                opf.write(' '.join(colums))
-                opf.write('\n')
-
 def trigger_list(testvectorfile):
     """makes a list of all triggers in testvectorfile eg. [1,0,0,1,0,1,0,0,1,1,1]"""
-    out_list = [0] * algonum
-    with open(testvectorfile, 'r') as tvf:
-        for line in tvf:
-            colums = line.strip().split()
-            trigger_list = bitfield(int(colums[-2], 16))
-            out_list = [x + y for x, y in zip(out_list, trigger_list)]
-    return out_list
-
-def bitfield(i, n=algonum):
-    """converts intager to a list of 'n' bits
-    >>> bitfield(10, 4)
-    [0, 1, 0, 1]
+    return testvector.testvector_stats(testvectorfile, width = algonum).algo_counts
+
+def run_time(lines):
+    """Returns simulation run time in ns required by testbench to process *lines* testvector lines."""
+    run_ns = SIM_OFFSET_NS + (lines + GTL_FDL_LATENCY) * CLK40_PERIOD_NS + SIM_MARGIN_NS
+    return -(-run_ns // 1000) * 1000 # round up to full us
+
+def shard_ranges(lines, shards, warmup = SHARD_WARMUP_BX):
+    """Splits *lines* testvector lines into *shards* BX ranges. Returns list of
+    tuples (first_line, last_line, first_bx, last_bx) with lines including
+    *warmup* overlap on both sides and [first_bx, last_bx] the compared range.
+    >>> shard_ranges(3564, 2, 16)
+    [(0, 1797, 0, 1781), (1766, 3563, 1782, 3563)]
     """
-    return [int(digit) for digit in '{0:0{1}b}'.format(i, n)][::-1]
-
-def run_vsim(module, msgmode, ini_file):#uses class module, arg msgmode and ini file path to start the simulation
+    ranges = []
+    size = -(-lines // shards)
+    for first_bx in range(0, lines, size):
+        last_bx = min(first_bx + size, lines) - 1
+        ranges.append((max(0, first_bx - warmup), min(lines - 1, last_bx + warmup), first_bx, last_bx))
+    return ranges
+
+def write_lines(src, dst, first, last):
+    """Writes lines *first* to *last* (including) of file *src* to file *dst*."""
+    with open(src) as fsrc:
+        with open(dst, 'w') as fdst:
+            fdst.writelines(itertools.islice(fsrc, first, last + 1))
+
+def count_lines(filename):
+    """Returns number of lines of a file."""
+    with open(filename) as fp:
+        return sum(1 for _ in fp)
+
+def merge_results(module):
+    """Merges results files of all shards of *module* into the module's results
+    file, mapping shard BX numbers back to testvector BX numbers.
+    """
+    def shard_errors(shard):
+        for error in results.iter_array(shard.results_json, 'errors'):
+            error['bx-nr'] += shard.first_line
+            yield error
+    counts = {}
+    for shard in module.shards:
+        for count in results.iter_counts(shard.results_json):
+            index = count['algo_index']
+            if index not in counts:
+                counts[index] = {'algo_index': index, 'algo_tv': 0, 'algo_sim': 0}
+            counts[index]['algo_tv'] += count['algo_tv']
+            counts[index]['algo_sim'] += count['algo_sim']
+    errors = itertools.chain.from_iterable(shard_errors(shard) for shard in module.shards)#shards are in BX order
+    with open(module.results_json, 'w') as fp:
+        results.write_results(fp, errors, [counts[index] for index in sorted(counts)])
+
+def do_file_sources(filename):
+    """Returns list of source files compiled by vcom in rendered do-file *filename*,
+    resolving variables defined by `set'.
+    """
+    variables = {}
+    sources = []
+    with open(filename) as fp:
+        for line in fp:
+            tokens = line.split()
+            if len(tokens) == 3 and tokens[0] == 'set':
+                variables[tokens[1]] = tokens[2]
+            elif tokens and tokens[0] == 'vcom':
+                sources.append(re.sub(r'\$(\w+)', lambda match: variables.get(match.group(1), match.group(0)), tokens[-1]))
+    return sources
+
+def library_hash(do_file, modelsim_version):
+    """Returns content hash of a library do-file, all of its sources and the simulator version."""
+    sha = hashlib.sha1()
+    sha.update(modelsim_version.encode('utf-8'))
+    with open(do_file, 'rb') as fp:
+        sha.update(fp.read())
+    for source in do_file_sources(do_file):
+        with open(source, 'rb') as fp:
+            sha.update(fp.read())
+    return sha.hexdigest()
+
+def build_library(sim_dir, mp7_tag, cache_dir, msgmode, ini_file, modelsim_version):
+    """Compiles the menu independent sources into a library inside *cache_dir*,
+    keyed by the content hash of its sources. Returns path to the compiled
+    library, a previously built library with same hash is reused. Library
+    mappings are written to a private copy of *ini_file*.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    build_dir = tempfile.mkdtemp(prefix = 'build-', dir = cache_dir)
+    do_file = os.path.join(build_dir, LIB_DO_FILE)
+    render_template(os.path.join(sim_dir, LIB_DO_FILE_TPL), do_file, {
+        '{{MP7_TAG}}' : mp7_tag,
+        '{{SIM_DIR}}' : sim_dir,
+    })
+    lib_dir = os.path.join(cache_dir, library_hash(do_file, modelsim_version))
+    if os.path.isdir(lib_dir):
+        logging.info("using precompiled library %s", lib_dir)
+        shutil.rmtree(build_dir)
+        return os.path.join(lib_dir, 'work')
+    logging.info("compiling menu independent library %s...", lib_dir)
+    build_ini_file = os.path.join(build_dir, INI_FILE)
+    shutil.copyfile(ini_file, build_ini_file)#vmap writes to this copy only
+    cmd = ['vsim', '-c', '-msgmode', msgmode, '-modelsimini', build_ini_file, '-do', 'do {filename}; quit -f'.format(filename = do_file)]
+    with open(os.path.join(build_dir, 'compile.log'), 'w') as logfile:
+        subprocess.check_call(cmd, stdout = logfile, cwd = build_dir)
+    os.remove(build_ini_file)#maps work to the temporary build directory
+    try:
+        os.rename(build_dir, lib_dir)
+    except OSError:#library was built concurrently by another run
+        shutil.rmtree(build_dir)
+    return os.path.join(lib_dir, 'work')
+
+def cached_result(cache_dir, key):
+    """Returns path of cached results file for *key* or None if not cached."""
+    filename = os.path.join(cache_dir, key, 'results.json')
+    return filename if os.path.isfile(filename) else None
+
+def store_result(cache_dir, key, results_json):
+    """Stores a module results file in the result cache using *key*."""
+    entry_dir = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry_dir):
+        os.makedirs(entry_dir)
+    filename = os.path.join(entry_dir, 'results.json')
+    shutil.copyfile(results_json, filename + '.tmp')
+    os.rename(filename + '.tmp', filename)#atomic, never exposes partial results
+
+def default_jobs():
+    """Returns default number of parallel simulations, limited by the number of
+    CPU cores and, if set, by the number of ModelSim licenses ($MODELSIM_LICENSES).
+    """
+    jobs = DEFAULT_JOBS
+    licenses = os.getenv('MODELSIM_LICENSES')
+    if licenses:
+        try:
+            jobs = min(jobs, int(licenses))
+        except ValueError:
+            logging.warning("ignoring invalid MODELSIM_LICENSES=%r, using number of cores", licenses)
+    return max(1, jobs)
+
+def positive_int(value):
+    """Returns integer of command line argument *value*, must be at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid integer value: %r" % value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1: %d" % number)
+    return number
+
+def wait_for_file(filename, process = None, timeout = None):
+    """Waits until *filename* exists. Returns False if *process* exited or
+    *timeout* seconds elapsed before the file was created, else True.
+    Uses inotify notifications if pyinotify is available, else back-off polling.
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    interval = POLL_INTERVAL_MIN
+    notifier = None
+    if pyinotify:
+        watch_manager = pyinotify.WatchManager()
+        notifier = pyinotify.Notifier(watch_manager, default_proc_fun = pyinotify.ProcessEvent())
+        watch_manager.add_watch(os.path.dirname(os.path.abspath(filename)), pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO)
+    try:
+        while not os.path.exists(filename):
+            if process is not None and process.poll() is not None:
+                return os.path.exists(filename)
+            if deadline is not None and time.time() >= deadline:
+                return False
+            if notifier:
+                if notifier.check_events(timeout = int(interval * 1000)):#wakes up on any event in directory
+                    notifier.read_events()
+                    notifier.process_events()
+            else:
+                time.sleep(interval)
+            interval = min(interval * 2, POLL_INTERVAL_MAX)#checks process exit less often the longer it runs
+        return True
+    finally:
+        if notifier:
+            notifier.stop()
+
+def run_vsim(module, msgmode, timings):#uses class module and arg msgmode to run the do-files of a module (compile and/or simulate)
+    lock_file = os.path.join(module.path, 'running.lock')
+    simulate = os.path.join(module.path, DO_FILE) in module.do_files
+    commands = ['do {filename}'.format(filename = filename) for filename in module.do_files]
     with open(module.results_log,'w') as logfile:
-        cmd = ['vsim', '-c', '-msgmode', msgmode, '-modelsimini', ini_file, '-do', 'do {filename}; quit -f'.format(filename = os.path.join(module.path, DO_FILE))]
-        logging.info("starting simulation for module_%d..." % module._id)
-        logging.info("executing: %s", ' '.join(['"{0}"'.format(arg) if ' ' in str(arg) else str(arg) for arg in cmd]))
-        subprocess.check_call(cmd, stdout = logfile)
-    while not os.path.exists(module.results_json): # checks for the json file
-        pass
+        cmd = ['vsim', '-c', '-msgmode', msgmode, '-modelsimini', module.ini_file, '-do', '; '.join(commands + ['quit -f'])]
+        with timings.span('compile', module.label):#vcom and design loading, ends when .do file has loaded the design
+            logging.info("starting %s for %s..." % ("simulation" if simulate else "compilation", module.label))
+            logging.info("executing: %s", ' '.join(['"{0}"'.format(arg) if ' ' in str(arg) else str(arg) for arg in cmd]))
+            process = subprocess.Popen(cmd, stdout = logfile, cwd = module.path)
+            if not simulate:
+                returncode = process.wait()
+            elif wait_for_file(lock_file, process):
+                os.remove(lock_file)
+        if simulate:
+            with timings.span('simulate', module.label):
+                returncode = process.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+    if not simulate:
+        logging.info("finished compiling {}".format(module.label))
+        return
+    if not wait_for_file(module.results_json, timeout = RESULTS_TIMEOUT): # results are complete once vsim exited
+        raise RuntimeError("missing results file %s" % module.results_json)
+    logging.info("finished simulating {}".format(module.label))
+
+def write_results_txt(module):
+    """Writes human readable mismatch report of a module's results file,
+    followed by per algorithm mismatch histograms. Returns MismatchStats.
+    """
+    stats = results.MismatchStats(algonum)
     with open(module.results_txt, 'w') as results_txt: # writes to results.txt what bx number triggert which algorithm and how often
-        jsonf = json.load(open(module.results_json))
-        errors = jsonf['errors']
-        for error in errors:
+        for error in results.iter_errors(module.results_json):
+            stats.add(error)
             results_txt.write('#' * 80 + '\n')
             results_txt.write('bx-nr      = %s\n' % error['bx-nr'])
             results_txt.write('algo_sim   = %s\n' % error['algos_sim'])
@@ -102,38 +302,91 @@ def run_vsim(module, msgmode, ini_file):#uses class module, arg msgmode and ini
             results_txt.write('fin_or_tv  = %s\n' % error['finor_tv'])
             results_txt.write('#' * 80 + '\n')
 
-            algos_sim_bin = bitfield(int(error['algos_sim'], 16))
-            algos_tv_bin = bitfield(int(error['algos_tv'], 16))
-            logging.debug('-' * ts)
-
-            for bit in range(algonum):
-                if algos_tv_bin[bit] != algos_sim_bin[bit]:
-                    if module.menu.algorithms.byIndex(bit):#checks if index has a algorithm name else wirtes not found
-                        results_txt.write('\n')
-                        results_txt.write('algo %s (%s)\n' % (bit, module.menu.algorithms.byIndex(bit).name))
-                        results_txt.write('     tv = %s sim = %s\n' % (algos_tv_bin[bit], algos_sim_bin[bit]))
-                        results_txt.write('\n')
-                    else:
-                        results_txt.write('\n')
-                        results_txt.write('algo with index: %s not found in menu\n' % bit)
-                        results_txt.write('\n')
-
-        logging.info("finished simulating module_{}".format(module._id))
-
-def check_algocount(liste):
-    """prosseses list so module id is in [0] and trgger count in [1] eg. [1, 255]"""
-    aus_liste = []
-    i = 0
-    for index in range(len(liste)):
-        if liste[index] != 0:
-            aus_liste.append((index, liste[index]))
-            i += 1
-    if i == 0:
-        aus_liste.append((-1, 0))
-    return aus_liste
-
-def check_multiple(liste):#checks if multiple triggers in list
-    return True if len(liste) > 1 else False
+            for bit in error.diff:#only mismatching bits
+                if module.menu.algorithms.byIndex(bit):#checks if index has a algorithm name else wirtes not found
+                    results_txt.write('\n')
+                    results_txt.write('algo %s (%s)\n' % (bit, module.menu.algorithms.byIndex(bit).name))
+                    results_txt.write('     tv = %s sim = %s\n' % ((error.algos_tv >> bit) & 1, (error.algos_sim >> bit) & 1))
+                    results_txt.write('\n')
+                else:
+                    results_txt.write('\n')
+                    results_txt.write('algo with index: %s not found in menu\n' % bit)
+                    results_txt.write('\n')
+
+        if stats.n_errors:
+            results_txt.write('#' * 80 + '\n')
+            results_txt.write('BX with errors: %d (FINOR: %d), first bx-nr: %d, last bx-nr: %d\n' % (stats.n_errors, stats.finor_errors, stats.first_bx, stats.last_bx))
+            results_txt.write('#' * 80 + '\n')
+            results_txt.write('  idx | missing | unexpected | first bx | last bx | name\n')
+            for bit in stats.failing():
+                algorithm = module.menu.algorithms.byIndex(bit)
+                results_txt.write('%5d | %7d | %10d | %8d | %7d | %s\n' % (bit, stats.missing[bit], stats.unexpected[bit], stats.first[bit], stats.last[bit], algorithm.name if algorithm else '-'))
+            logging.warning("%s: %d BX with errors (bx-nr %d to %d), %d algorithm(s) failing", module.label, stats.n_errors, stats.first_bx, stats.last_bx, len(stats.failing()))
+    return stats
+
+def results_db_rows(modules, counts):
+    """Yields results database rows (module_id, algo_index, algo_name,
+    count_tv, count_sim, mismatch_bx) of algorithms of each module's menu
+    slice and of algorithms triggered or failing in the module.
+    """
+    for row, module in enumerate(modules):
+        indices = set(algo.index for algo in module.menu.algorithms.byModuleId(module._id))
+        indices.update(index for index in range(algonum) if counts.tv[row][index] or counts.sim[row][index])
+        indices.update(module.stats.bx)
+        for index in sorted(indices):
+            algorithm = module.menu.algorithms.byIndex(index)
+            yield (module._id, index, algorithm.name if algorithm else None,
+                int(counts.tv[row][index]), int(counts.sim[row][index]), module.stats.bx.get(index, []))
+
+def simulation_worker(queue, msgmode, failed, timings):
+    """Takes modules from *queue* and simulates them until a None item is received.
+    Shards of a module are queued once the module's work library is compiled.
+    Failed modules are appended to list *failed*, spans are added to *timings*.
+    """
+    while True:
+        module = queue.get()
+        if module is None:
+            break
+        module.started = time.time()
+        module.queue_wait = module.started - module.queued
+        timings.add('queue', module.queued, module.started, module.label)
+        try:
+            run_vsim(module, msgmode, timings)
+        except Exception as e:
+            logging.error("simulation of %s failed: %s", module.label, e)
+            failed.append(module)
+        else:
+            for shard in module.shards:
+                shard.queued = time.time()
+                queue.put(shard)
+        module.run_time = time.time() - module.started
+        queue.task_done()
+
+def run_simulations(modules, msgmode, jobs, timings):
+    """Simulates *modules* (and their shards) using a fixed number of *jobs*
+    worker threads, recording queue, compile and simulate spans in *timings*.
+    Returns list of failed modules and shards.
+    """
+    queue = Queue()
+    failed = []
+    all_jobs = list(itertools.chain.from_iterable([module] + module.shards for module in modules))
+    for module in modules:#fills work queue, shards are queued by workers
+        module.queued = time.time()
+        queue.put(module)
+    workers = []
+    for _ in range(min(jobs, len(all_jobs))):
+        worker = Thread(target = simulation_worker, args = (queue, msgmode, failed, timings))
+        worker.daemon = True
+        workers.append(worker)
+        worker.start()
+    queue.join()#waits for all modules and shards
+    for worker in workers:
+        queue.put(None)#one stop item per worker
+    for worker in workers:#waits for all workers to finish
+        worker.join()
+    for job in all_jobs:
+        logging.info("%s: queue wait %.1f s, run time %.1f s", job.label, job.queue_wait, job.run_time)
+    return failed
 
 def logging_debug_write(textfile, string):#output into textfile and if logging.debug true prints on screen
     textfile.write(string + '\n')
@@ -142,6 +395,7 @@ def logging_debug_write(textfile, string):#output into textfile and if logging.d
 class Module(object):#module class and nessesary information
     def __init__(self, menu, _id, base_path):
         self._id = _id
+        self.label = 'module_%d' % self._id
         self.testvector = ''
         self.menu = menu
         self.testvector_filepath = ''
@@ -152,6 +406,19 @@ class Module(object):#module class and nessesary information
         self.results_json = '%s/results_module_%d.json' % (self.path, self._id)
         self.results_log = '%s/results_module_%d.log' % (self.path, self._id)
         self.results_txt = '%s/results_module_%d.txt' % (self.path, self._id)
+        self.ini_file = os.path.join(self.path, INI_FILE)#private copy, vmap writes the work library mapping
+        self.work_dir = os.path.join(self.path, 'work')
+        self.do_files = [os.path.join(self.path, COMPILE_DO_FILE), os.path.join(self.path, DO_FILE)]#executed by one vsim process
+        self.cache_key = None
+        self.first_bx = 0
+        self.last_bx = LHC_BUNCH_COUNT - 1
+        self.lines = LHC_BUNCH_COUNT
+        self.shards = []
+        self.queued = 0.
+        self.started = 0.
+        self.queue_wait = 0.
+        self.run_time = 0.
+        self.stats = None#MismatchStats of results file
 
     def algo_name(self):#gets name of algorithm based on index
         return module.menu.algorithms.byIndex(index).name
@@ -162,11 +429,54 @@ class Module(object):#module class and nessesary information
             mask = mask | (1 << algo.index)
         return mask
 
-    def make_files(self, sim_dir, view_wave, mp7_tag, menu_path):#makes files for simulation
-        render_template(os.path.join(sim_dir, DO_FILE_TPL),
-            os.path.join(self.path, DO_FILE), {
+    def result_key(self, menu_path, ini_file_tpl, simulator, testvector_digest):
+        """Returns content hash of all simulation inputs of the module: VHDL
+        snippets, masked testvector (*testvector_digest*), rendered templates,
+        modelsim.ini template *ini_file_tpl* and *simulator* (versions and
+        paths the template is rendered with). Paths inside the (timestamped)
+        run directory are ignored.
+        """
+        src_dir = os.path.join(menu_path, 'vhdl/module_%d/src' % self._id)
+        filenames = sorted(glob.glob(os.path.join(src_dir, '*.vhd')))
+        filenames.extend([os.path.join(self.path, COMPILE_DO_FILE), os.path.join(self.path, DO_FILE), os.path.join(self.path, TB_FILE), ini_file_tpl])
+        filenames.extend(sorted(glob.glob(os.path.join(self.vhdl_path, '*.vhd'))))
+        sha = hashlib.sha1()
+        sha.update(simulator.encode('utf-8'))
+        sha.update(testvector_digest.encode('utf-8'))
+        for filename in filenames:
+            with open(filename, 'rb') as fp:
+                sha.update(fp.read().replace(self.base_path.encode('utf-8'), b''))
+        return sha.hexdigest()
+
+    def prescaled(self):#checks patched gtl_pkg.vhd for prescale factors other than 1
+        content = re.sub(r'--[^\n]*', '', read_file(os.path.join(self.vhdl_path, 'gtl_pkg.vhd')))
+        match = re.search(r'constant\s+PRESCALE_FACTOR_INIT\b.*?;', content, re.S | re.I)
+        if not match:
+            return False
+        return any(int(value, 16) != 1 for value in re.findall(r'X"([0-9a-fA-F]+)"', match.group(0), re.I))
+
+    def make_shards(self, shards, sim_dir, view_wave, ini_file):#splits testvector into BX ranges simulated separately
+        ranges = shard_ranges(count_lines(self.testvector_filepath), shards)
+        self.shards = []
+        for index, (first_line, last_line, first_bx, last_bx) in enumerate(ranges):
+            shard = ModuleShard(self, index, first_line, last_line, first_bx, last_bx)
+            os.makedirs(shard.path)
+            if not os.path.exists(shard.testvector_filepath):#shard testvectors are shared by all modules
+                write_lines(self.testvector_filepath, shard.testvector_filepath, first_line, last_line)
+            shard.make_run_files(sim_dir, view_wave, ini_file)
+            self.shards.append(shard)
+        self.do_files = [os.path.join(self.path, COMPILE_DO_FILE)]#module only compiles the work library of its shards
+        return self.shards
+
+    def make_files(self, sim_dir, view_wave, mp7_tag, menu_path, lib_dir, ini_file):#makes files for simulation
+        self.make_sim_files(sim_dir, view_wave, mp7_tag, lib_dir, ini_file)
+        self.make_vhdl_files(sim_dir, menu_path)
+
+    def make_sim_files(self, sim_dir, view_wave, mp7_tag, lib_dir, ini_file):#makes do-files, testbench and modelsim.ini
+        render_template(os.path.join(sim_dir, COMPILE_DO_FILE_TPL),
+            os.path.join(self.path, COMPILE_DO_FILE), {
             '{{MP7_TAG}}' : mp7_tag,
-            '{{VIEW_WAVE}}' : format(view_wave),
+            '{{LIB_DIR}}' : lib_dir,
             '{{MENU_DIR}}' : self.vhdl_path,
             '{{MOD_TB_DIR}}' : self.testbench_path,
             '{{SIM_DIR}}' : sim_dir,
@@ -175,8 +485,28 @@ class Module(object):#module class and nessesary information
             os.path.join(self.path, TB_FILE), {
             '{{TESTVECTOR_FILENAME}}' : self.testvector_filepath,
             '{{RESULTS_FILE}}' : self.results_json,#results.json
+            '{{ALGO_MASK}}' : '%0128x' % self.get_mask(),
+            '{{FIRST_BX}}' : format(self.first_bx),
+            '{{LAST_BX}}' : format(self.last_bx),
+        })
+        self.make_run_files(sim_dir, view_wave, ini_file)
+
+    def make_run_files(self, sim_dir, view_wave, ini_file):#makes do-file simulating BX range using compiled work library and modelsim.ini
+        shutil.copyfile(ini_file, self.ini_file)
+        render_template(os.path.join(sim_dir, DO_FILE_TPL),
+            os.path.join(self.path, DO_FILE), {
+            '{{VIEW_WAVE}}' : format(view_wave),
+            '{{SIM_DIR}}' : sim_dir,
+            '{{WORK_DIR}}' : self.work_dir,
+            '{{FIRST_BX}}' : format(self.first_bx),
+            '{{LAST_BX}}' : format(self.last_bx),
+            '{{TESTVECTOR_FILENAME}}' : self.testvector_filepath,
+            '{{RESULTS_FILE}}' : self.results_json,
+            '{{RUN_TIME}}' : format(run_time(self.lines)),
         })
 
+    def make_vhdl_files(self, sim_dir, menu_path):#patches menu specific VHDL files
+
         uGTalgosPath = os.path.abspath(os.path.join(sim_dir, '..'))
         src_dir = os.path.join(menu_path, 'vhdl/module_%d/src' % self._id)
 
@@ -194,21 +524,50 @@ class Module(object):#module class and nessesary information
         render_template(os.path.join(gtl_dir, 'gtl_pkg_tpl.vhd'), '%s/vhdl/gtl_pkg.vhd' % self.path, replace_map)
         render_template(os.path.join(gtl_dir, 'gtl_module_tpl.vhd'), '%s/vhdl/gtl_module.vhd' % self.path, replace_map)
 
+class ModuleShard(Module):#BX range of a module, simulated by its own vsim process using the module's work library
+    def __init__(self, module, index, first_line, last_line, first_bx, last_bx):
+        super(ModuleShard, self).__init__(module.menu, module._id, module.base_path)
+        self.module = module
+        self.index = index
+        self.label = '%s shard %d' % (module.label, index)
+        self.path = os.path.join(module.path, 'shard_%d' % index)
+        self.vhdl_path = module.vhdl_path#shares patched VHDL files, testbench and work library of module
+        self.testbench_path = module.testbench_path
+        self.work_dir = module.work_dir
+        self.do_files = [os.path.join(self.path, DO_FILE)]
+        self.testvector_filepath = os.path.join(module.base_path, 'testvector_shard_%d.txt' % index)
+        self.results_json = '%s/results_module_%d_shard_%d.json' % (self.path, self._id, index)
+        self.results_log = '%s/results_module_%d_shard_%d.log' % (self.path, self._id, index)
+        self.results_txt = '%s/results_module_%d_shard_%d.txt' % (self.path, self._id, index)
+        self.ini_file = os.path.join(self.path, INI_FILE)
+        self.first_line = first_line
+        self.lines = last_line - first_line + 1
+        self.first_bx = first_bx - first_line#compared range relative to shard testvector
+        self.last_bx = last_bx - first_line
+
 def parse():
     parser = argparse.ArgumentParser()
     parser.add_argument('--mp7_tag', type=os.path.abspath, help = "path to MP7 tag", required = True)
     parser.add_argument('--menu', metavar = 'path', help = 'menue folder path', type = os.path.abspath, required = True)
-    parser.add_argument('--testvector', metavar = 'path', help = 'testvector file path')
+    parser.add_argument('--testvector', metavar = 'path', help = 'testvector file path (text or binary)')
     parser.add_argument('--output', metavar = 'path', help = '', type = os.path.abspath)
     parser.add_argument('--view-wave', action = 'store_true', help = "shows the waveform")
     parser.add_argument('--wlf', action = 'store_true', help = "no console transcript info, warning and error messages (transcript output to vsim.wlf)")
     parser.add_argument('--xilinx-path', metavar = '<path>', default = DEFAULT_XILINX_PATH, help = "path to xilinx installation, default is `{DEFAULT_XILINX_PATH}'".format(**globals()))
     parser.add_argument('--modelsim', metavar = '<version>', default = DEFAULT_MODELSIM_VERSION, help = "select modelsim version, default is `{DEFAULT_MODELSIM_VERSION}'".format(**globals()))
     parser.add_argument('--config', metavar = '<filename>', default = DEFAULT_MODELSIM_INI_TPL, help = "set modelsim INI template file, default is `{DEFAULT_MODELSIM_INI_TPL}'".format(**globals()))
+    parser.add_argument('--lib-cache', metavar = '<path>', type = os.path.abspath, help = "directory of precompiled simulation libraries, default is `<output>/{LIB_CACHE_DIR}'".format(**globals()))
+    parser.add_argument('--result-cache', metavar = '<path>', type = os.path.abspath, help = "directory of cached module results, default is `<output>/{RESULT_CACHE_DIR}'".format(**globals()))
+    parser.add_argument('--no-result-cache', action = 'store_true', help = "simulate all modules, even if cached results exist")
+    parser.add_argument('--menu-cache', action = 'store_true', help = "use cached parsed XML menu (stored next to XML file)")
+    parser.add_argument('--results-db', metavar = '<filename>', type = os.path.abspath, help = "append results of this run to SQLite database (see resultsdb.py)")
+    parser.add_argument('--shards', metavar = 'N', type = positive_int, default = 1, help = "split each module into N BX ranges simulated in parallel, default is 1")
+    parser.add_argument('-j', '--jobs', metavar = 'N', type = positive_int, default = None, help = "number of parallel simulations, default is number of cores (limited by $MODELSIM_LICENSES)")
     parser.add_argument('-v', '--verbose', action = 'store_const',const = logging.DEBUG, help = "enables debug prints to console", default = logging.INFO)
     return parser.parse_args()
 
 def main():
+    timing = timings.Timings()#wall time spans of all phases, see timings.json
     args = parse()
 
     sim_dir = os.getenv('SIM_ROOT')
@@ -219,9 +578,20 @@ def main():
     if not args.output:
         args.output = sim_dir
 
+    if not args.lib_cache:
+        args.lib_cache = os.path.join(args.output, LIB_CACHE_DIR)
+
+    if not args.result_cache:
+        args.result_cache = os.path.join(args.output, RESULT_CACHE_DIR)
+    if args.no_result_cache:
+        args.result_cache = None
+
     # Setup console logging
     logging.basicConfig(format = '%(levelname)s: %(message)s', level = args.verbose)
 
+    # Resolve default number of jobs after logging setup (may log a warning)
+    args.jobs = args.jobs or default_jobs()
+
     # Set message mode:
     # wlf => no output to console for transcript info, warning and error messages (transcript output to vsim.wlf).
     # tran => output to console.
@@ -247,7 +617,15 @@ def main():
 
     os.makedirs(base_dir)#makes folders
 
-    menu = xmlmenu.XmlMenu(menu_filepath)
+    if testvector.is_binary(testvector_filepath):#testbench reads text testvectors only
+        binary_filepath = testvector_filepath
+        testvector_filepath = os.path.join(base_dir, 'TestVector_%s.txt' % _base)
+        with timing.span('testvector conversion'):
+            testvector.binary_to_text(binary_filepath, testvector_filepath)
+        logging.info("converted binary testvector %s to %s", binary_filepath, testvector_filepath)
+
+    with timing.span('menu'):
+        menu = xmlmenu.XmlMenu(menu_filepath, cache = args.menu_cache)
 
 
     modules = []
@@ -262,64 +640,80 @@ def main():
         '{{MODELSIM_VERSION}}' : args.modelsim,
     })
 
+    gtu_settings = os.getenv('GTU_SETTINGS_MODELSIM_INI_VERSION')
+    if not gtu_settings:#checks for gtu settings
+        raise RuntimeError("GTU settings not set (run gtu-settings-XXX)")
+
+    with timing.span('library'):
+        lib_dir = build_library(sim_dir, args.mp7_tag, args.lib_cache, msgmode, ini_file, args.modelsim)
+
     logging.info('Creating Modules and Masks...')
 
     for module in modules:#gives each module the information
-        module_id = 'module_%d' % module._id
-        testvector_base_name = os.path.splitext(os.path.basename(testvector_filepath))[0]
-        module.testvector_filepath = os.path.join(module.path, '%s_%s.txt' %(testvector_base_name, module_id))
+        module.testvector_filepath = testvector_filepath#shared by all modules, masked by testbench
 
         os.makedirs('%s/testbench' % module.path)
         os.makedirs('%s/vhdl' % module.path)
         logging.debug('Module_%d: %0128x' % (module._id, module.get_mask()))
 
-        make_testvector(module.get_mask(), testvector_filepath, module.testvector_filepath)#mask, testvectorfile, out_dir
-
         logging.debug('Module_%d created at %s' % (module._id, base_dir))
 
-        module.make_files(sim_dir, args.view_wave, args.mp7_tag, args.menu)#sim_dir, view_wave, mp7_tag, menu_path
+        with timing.span('templates', module.label):
+            module.make_files(sim_dir, args.view_wave, args.mp7_tag, args.menu, lib_dir, ini_file)#sim_dir, view_wave, mp7_tag, menu_path, lib_dir, ini_file
 
     logging.info('finished creating modules and masks')
-    logging.info('starting simulations...')
 
-    gtu_settings = os.getenv('GTU_SETTINGS_MODELSIM_INI_VERSION')
-    if not gtu_settings:#checks for gtu settings
-        raise RuntimeError("GTU settings not set (run gtu-settings-XXX)")
-
-    threads = []
-    for module in modules:#makes for all simulations a thread
-        thread = Thread(target = run_vsim, args = (module, msgmode, ini_file))
-        threads.append(thread)
-        thread.start()
-        while not os.path.exists(os.path.join(module.path, 'running.lock')):#stops starting of new threads if .do file is still in use
-            time.sleep(0.5)
-        os.remove(os.path.join(module.path, 'running.lock'))
-
-    for thread in threads:#waits for all threads to finish
-        thread.join()
+    pending = []
+    simulator = ' '.join([args.modelsim, gtu_settings, args.xilinx_path])
+    with timing.span('testvector masking'):
+        digests = testvector.masked_digests(testvector_filepath, [module.get_mask() for module in modules])#single pass for all modules
+    for module, digest in zip(modules, digests):#reuses results of modules with unchanged inputs
+        module.cache_key = module.result_key(args.menu, os.path.join(sim_dir, INI_FILE_TPL), simulator, digest)
+        cached = cached_result(args.result_cache, module.cache_key) if args.result_cache else None
+        if cached:
+            logging.info("module_%d unchanged, using cached results %s", module._id, cached)
+            with timing.span('results', module.label):
+                shutil.copyfile(cached, module.results_json)
+                module.stats = write_results_txt(module)
+        else:
+            pending.append(module)
+
+    if args.shards > 1:#compiles module once, simulates its BX ranges in parallel
+        for module in pending:
+            if module.prescaled():
+                logging.warning("%s: prescale factors other than 1, not sharded (prescaler counters are not warmed up)", module.label)
+                continue
+            with timing.span('templates', module.label):
+                module.make_shards(args.shards, sim_dir, args.view_wave, ini_file)
+
+    logging.info('starting simulations of %d module(s) in %d vsim run(s) (%d parallel jobs)...', len(pending), sum(len(module.shards) or 1 for module in pending), args.jobs)
+
+    with timing.span('simulation'):
+        failed = run_simulations(pending, msgmode, args.jobs, timing)
+    failed_modules = set(job.module if isinstance(job, ModuleShard) else job for job in failed)
+
+    for module in pending:
+        if module in failed_modules:
+            continue
+        with timing.span('results', module.label):
+            if module.shards:
+                merge_results(module)
+            module.stats = write_results_txt(module)
+        if args.result_cache and not module.stats.n_errors:#modules with mismatches are simulated again
+            store_result(args.result_cache, module.cache_key, module.results_json)
+
+    if failed:
+        raise RuntimeError("simulation failed for: %s" % ', '.join([job.label for job in failed]))
     logging.info('finished all simulations')
-    print ('')
-
-    algos_sim = {}
-    algos_tv = {}
 
-    for module in modules:#steps through all modules and makes a list with trigger count and module
-        jsonf = json.load(open(module.results_json))
-        counts = jsonf['counts']
-        for count in counts:
-            index = count['algo_index']
-            if index not in algos_sim:
-                algos_sim[index] = []
-            algos_sim[index].append(count['algo_sim'])
-            if index not in algos_tv:
-                algos_tv[index] = []
-            algos_tv[index].append(count['algo_tv'])
+    with timing.span('mismatch matrix'):
+        bxmatrix.write_matrix(os.path.join(base_dir, MATRIX_FILE), testvector_filepath, [(module.get_mask(), module.results_json) for module in modules])
+    print ('')
 
-    for index in range(len(algos_sim)):#makes a list with tuples (module id, trigger count)
-        algos_sim[index] = check_algocount(algos_sim[index])
+    summary_start = time.time()
 
-    for index in range(len(algos_tv)):
-        algos_tv[index] = check_algocount(algos_tv[index])
+    counts = results.CountsMatrix.from_results([module.results_json for module in modules], algonum)#module x algorithm trigger counts
+    counts_tv, counts_sim = counts.totals()
 
     # Summary logging
     sum_log = logging.getLogger("sum_log")
@@ -347,7 +741,7 @@ def main():
         if algo.name in IGNORED_ALGOS:
             result = 'IGNORE'
         #checks if algorithm trigger count is equal in both hardware and testvectors
-        elif algos_tv[algo.index][0][1] != algos_sim[algo.index][0][1]:
+        elif counts_tv[algo.index] != counts_sim[algo.index]:
             result = 'ERROR'
             success = False
 
@@ -355,21 +749,15 @@ def main():
             algo.module_id,
             algo.index,
             algo.name,
-            algos_tv[algo.index][0][1],
-            algos_sim[algo.index][0][1],
+            counts_tv[algo.index],
+            counts_sim[algo.index],
             result
         ))
 
     sum_log.info("|-----|-----|------------------------------------------------------------------|--------|--------|--------|")
 
-    trigger_liste = trigger_list(testvector_filepath)#gets a list: index is algorithm index and content is the trigger count in the testvector file
-
     # prints bits which are present in the testvector but have no corresponding algo in the menu
-    errors=[]
-
-    for index in range(len(trigger_liste)):
-        if menu.algorithms.byIndex(index) == None and trigger_liste[index] > 0:
-            errors.append((index, trigger_liste[index]))
+    errors = results.unmapped_triggers(trigger_list(testvector_filepath), [algo.index for algo in algorithms])
 
     if errors:
         success = False
@@ -383,21 +771,30 @@ def main():
         sum_log.info("|-------|--------|")
 
 
-    for index in range(len(algos_sim)):#checks if algorithm triggert more than once in simulation and testvector file and prints it red on screen
-        if check_multiple(algos_sim[index]):
-            sum_log.info("Multiple algorithms found in simulation!")
-            for i in range(len(algos_sim[index])):
-                sum_log.info('Module: {}'.format(algos_sim[index][0][0]))
-                sum_log.info('    Index: {}'.format(index))
-                sum_log.info('    algoname: {}'.format(menu.algorithms.byIndex(index).name if menu.algorithms.byIndex(index).name else 'not found in menu'))
-
-    for index in range(len(algos_tv)):
-        if check_multiple(algos_tv[index]):
-            sum_log.info("Multiple algorithms found in testvectors!")
-            for i in range(len(algos_tv[index])):
-                sum_log.info('Module: {}'.format(algos_tv[index][0][0]))
+    for source, which in (('simulation', 'sim'), ('testvectors', 'tv')):#checks if algorithm triggert in more than one module
+        multiple = counts.multiple(which)
+        for index in sorted(multiple):
+            algorithm = menu.algorithms.byIndex(index)
+            sum_log.info("Multiple algorithms found in {}!".format(source))
+            for row, count in multiple[index]:
+                sum_log.info('Module: {}'.format(modules[row]._id))
                 sum_log.info('    Index: {}'.format(index))
-                sum_log.info('    algoname: {}'.format(menu.algorithms.byIndex(index).name if menu.algorithms.byIndex(index).name else 'not found in menu'))
+                sum_log.info('    algoname: {}'.format(algorithm.name if algorithm else 'not found in menu'))
+                sum_log.info('    triggers: {}'.format(count))
+
+    timing.add('summary', summary_start, time.time())
+
+    if args.results_db:#one row per module and algorithm, see resultsdb.py
+        with timing.span('results database'):
+            with resultsdb.ResultsDB(args.results_db) as db:
+                run_id = db.add_run(timestamp, base_dir, menu, testvector_filepath, success, results_db_rows(modules, counts))
+        logging.info("added run %d to results database %s", run_id, args.results_db)
+
+    # Timing summary
+    timing.write_json(os.path.join(base_dir, 'timings.json'))
+    sum_log.info("")
+    for line in timing.table():
+        sum_log.info(line)
 
     print ("")
 
@@ -8,6 +8,8 @@ import logging
 import glob
 import sys, os
 import shutil
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'scripts'))
+from template import render_template # shared template engine (scripts/template.py)
 # Default paths and versions.
 DEFAULT_XILINX_PATH = '/opt/xilinx/14.6'
 DEFAULT_MODELSIM_VERSION = '10.3b'
@@ -32,41 +34,10 @@ def remove_file(filename):
     if os.path.isfile(filename) or os.path.islink(filename):
         os.remove(filename)
 ## *****************************************************************************************************
-def render_template(src, dst, args):
-    """Replaces content of file *src* with values of dictionary *args* and writes to file *dst*.
-    >>> render_template("template.txt", "sample.txt", { 'foo' : "bar", })
-    """
-    logging.info("rendering template %s as %s", src, dst)
-    with open(src) as src:
-        content = src.read()
-    for needle, subst in args.items():
-        logging.info("  replacing `%s' by `%s'", needle, subst)
-        content = content.replace(needle, subst)
-    with open(dst, 'w') as dst:
-        dst.write(content)
-## *****************************************************************************************************
 def call_process(*args):
     logging.info("executing: %s", ' '.join(['"{0}"'.format(arg) if ' ' in str(arg) else str(arg) for arg in args]))
     return subprocess.check_call(args)
 ## *****************************************************************************************************
-def template_replace(template, replace_map, result):
-    """Load template by replacing keys from dictionary and writing to result
-    file. The function ignores VHDL escaped lines.
-
-    Example:
-    >>> template_replace('sample.tpl.vhd', {'name': "title"}, 'sample.vhd')"""
-    # Read content of source file.
-    with open(template, 'rb') as fp:
-        lines = fp.readlines()
-    # Replace placeholders.
-    for key, value in replace_map.items():
-        for i, line in enumerate(lines):
-            if not line.strip().startswith('--'):
-                lines[i] = line.replace(key, value)
-    # Write content to destination file.
-    with open(result, 'wb') as fp:
-        fp.write(''.join(lines))
-## *****************************************************************************************************
 def read_file(filename):
     """Returns contents of a file."""
 #    with open(os.path.join(src_dir, 'gtl_module_instances.vhd'), 'rb') as fp:
@@ -173,9 +144,9 @@ def main():
     gtl_dir = os.path.join(gtl_fdl_wrapper_dir, 'gtl')
     fdl_dir = os.path.join(gtl_fdl_wrapper_dir, 'fdl')
     # Patch VHDL files
-    template_replace(os.path.join(fdl_dir, 'algo_mapping_rop_tpl.vhd'), replace_map, os.path.join(sim_dir_vhdl_temp, 'algo_mapping_rop.vhd'))
-    template_replace(os.path.join(gtl_dir, 'gtl_pkg_tpl.vhd'), replace_map, os.path.join(sim_dir_vhdl_temp, 'gtl_pkg.vhd'))
-    template_replace(os.path.join(gtl_dir, 'gtl_module_tpl.vhd'), replace_map, os.path.join(sim_dir_vhdl_temp, 'gtl_module.vhd'))
+    render_template(os.path.join(fdl_dir, 'algo_mapping_rop_tpl.vhd'), os.path.join(sim_dir_vhdl_temp, 'algo_mapping_rop.vhd'), replace_map, skip_comments = True)
+    render_template(os.path.join(gtl_dir, 'gtl_pkg_tpl.vhd'), os.path.join(sim_dir_vhdl_temp, 'gtl_pkg.vhd'), replace_map, skip_comments = True)
+    render_template(os.path.join(gtl_dir, 'gtl_module_tpl.vhd'), os.path.join(sim_dir_vhdl_temp, 'gtl_module.vhd'), replace_map, skip_comments = True)
     # Run Modelsim with makefile, on fail (1) raise error.
     if 0 != call_process('vsim', '-c', '-msgmode', msgmode, '-do', 'do {filename}; quit -f'.format(filename = DO_FILE)):
         print "something went wrong"
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+
+"""Tests of fdl_model.py against a clock by clock simulation of one algorithm
+slice (algo_slice.vhd): algo_pre_scaler.vhd counter_p, compare_p and
+prescaled_algo_p, delay_element.vhd (l1a_latency_delay) and
+algo_post_dead_time_counter.vhd counter_p, sampled once per BX.
+
+  $ python -m unittest test_fdl_model
+"""
+
+import random
+import unittest
+
+import fdl_model
+from fdl_model import FdlConfig, FdlModel, PRESCALER_COUNTER_WIDTH, RATE_COUNTER_WIDTH
+
+def simulate_algo_slice(algo, factor, l1a, delay):
+    """Returns tuple (algo_after_prescaler, rate_cnt_post_dead_time) of lists
+    *algo* and *l1a* of bits per BX, prescale factor *factor* and L1A latency
+    delay *delay* in BX.
+    """
+    counter_mask = (1 << PRESCALER_COUNTER_WIDTH) - 1
+    counter_end = (1 << RATE_COUNTER_WIDTH) - 1
+    counter = 0
+    post_dead_time = 0
+    delay_line = [0] * delay
+    prescaled = []
+    for algo_i, l1a_i in zip(algo, l1a):
+        limit = ((counter + 1) & counter_mask) == factor
+        prescaled_algo_o = int(factor != 0 and limit and algo_i == 1)
+        if limit and algo_i:
+            counter = 0
+        elif algo_i:
+            counter = (counter + 1) & counter_mask
+        prescaled.append(prescaled_algo_o)
+        delay_line.append(prescaled_algo_o)
+        algo_delayed = delay_line.pop(0)
+        if post_dead_time == counter_end:
+            pass
+        elif algo_delayed and l1a_i:
+            post_dead_time += 1
+    return prescaled, post_dead_time
+
+def bitset(bits):
+    """Returns BX bitset of list of bits per BX."""
+    return sum(bit << bx for bx, bit in enumerate(bits))
+
+class FdlModelTest(unittest.TestCase):
+
+    N_BX = 3564
+
+    def setUp(self):
+        self.rng = random.Random(42)
+
+    def random_bits(self, probability):
+        return [int(self.rng.random() < probability) for _ in range(self.N_BX)]
+
+    def test_post_dead_time(self):
+        for factor in (0, 1, 2, 3, 7, 1000):
+            for delay in (0, 1, 5, 127):
+                algo = self.random_bits(0.3)
+                l1a = self.random_bits(0.5)
+                model = FdlModel([bit << 3 for bit in algo], width=8)
+                result = model.run(FdlConfig(prescale_factors={3: factor}, l1a=bitset(l1a), l1a_latency_delay=delay))
+                prescaled, post_dead_time = simulate_algo_slice(algo, factor, l1a, delay)
+                self.assertEqual(result.algo_after_prescaler[3], bitset(prescaled), "factor {0}, delay {1}".format(factor, delay))
+                self.assertEqual(result.rate_post_dead_time[3], post_dead_time, "factor {0}, delay {1}".format(factor, delay))
+
+    def test_prescale_fallback(self):
+        for factor in (0, 1, 2, 5, 64, (1 << PRESCALER_COUNTER_WIDTH) - 1):
+            column = bitset(self.random_bits(0.5))
+            expected, _ = simulate_algo_slice([(column >> bx) & 1 for bx in range(self.N_BX)], factor, [0] * self.N_BX, 0)
+            self.assertEqual(fdl_model.prescale(column, factor, use_numpy=False), bitset(expected))
+            if fdl_model.numpy is not None:
+                self.assertEqual(fdl_model.prescale(column, factor, use_numpy=True), bitset(expected))
+
+    def test_prescale_factor_range(self):
+        for factor in (-1, 1 << PRESCALER_COUNTER_WIDTH):
+            self.assertRaises(ValueError, fdl_model.prescale, 1, factor)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+#
+
+"""This module provides fast statistics of uGT testvector files.
+
+A testvector line holds the BX number, the LHC data, the 512 bit algorithm
+word (hex) and the FINOR bit, separated by whitespace. Only the last two
+columns are evaluated.
+
+Count algorithm triggers of a testvector file:
+
+>>> from testvector import testvector_stats
+>>> stats = testvector_stats("TestVector_L1Menu_Sample.txt")
+>>> stats.algo_counts[42]
+17
+>>> stats.finor_count
+1234
+>>> stats.bx_popcounts[:4]
+[0, 3, 0, 1]
+
+Counting uses NumPy bit unpacking if available, else bit-parallel integer
+arithmetic (bit sliced counters), both avoid per-bit Python loops.
+
+Convert a testvector to the packed binary format (one fixed size record per
+BX) and access any BX or BX range without parsing the rest of the file:
+
+>>> from testvector import text_to_binary, BinaryTestvector
+>>> text_to_binary("TestVector_L1Menu_Sample.txt", "TestVector_L1Menu_Sample.bin")
+3564
+>>> tv = BinaryTestvector("TestVector_L1Menu_Sample.bin")
+>>> record = tv[42]
+>>> record.bx, record.algos, record.finor
+(42, 1267650600228229401496703205376, 1)
+>>> [record.bx for record in tv.records(100, 103)]
+[100, 101, 102]
+
+Command line usage:
+
+  $ python testvector.py to-binary <src.txt> <dest.bin>
+  $ python testvector.py to-text <src.bin> <dest.txt> [--first <bx>] [--last <bx>]
+  $ python testvector.py stats <testvector> [--mask <hex>]
+
+Binary file layout (little endian unless noted):
+
+  header  magic 'UGTTV\\0', version (u16), BX digits (u16), number of LHC data
+          tokens (u16), record size (u32), hex digits of every token (u16 each),
+          zero padded to a multiple of HEADER_ALIGN bytes
+  record  BX number (u32), LHC data tokens (big endian, ceil(digits/2) bytes
+          each), algorithm word (64 bytes big endian), FINOR (u8), zero padded
+          to a multiple of RECORD_ALIGN bytes
+"""
+
+import binascii
+import hashlib
+import itertools
+import mmap
+import struct
+import sys, os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['TestvectorStats', 'BitCounter', 'BinaryTestvector', 'Record', 'testvector_stats', 'read_algos', 'masked_digests', 'is_binary', 'text_to_binary', 'binary_to_text']
+
+ALGO_BITS = 512
+"""Width of algorithm word."""
+
+CHUNK_LINES = 65536
+"""Number of lines processed at once by NumPy implementation."""
+
+BINARY_MAGIC = b'UGTTV\0'
+BINARY_VERSION = 1
+HEADER_STRUCT = struct.Struct('<6sHHHI')
+HEADER_ALIGN = 64
+RECORD_ALIGN = 8
+"""Binary testvector format, see module documentation."""
+
+def popcount(value):
+    """Returns number of set bits of a non negative integer."""
+    return bin(value).count('1')
+
+def iter_bits(value):
+    """Yields indices of set bits of a non negative integer, lowest first.
+    >>> list(iter_bits(0b10110))
+    [1, 2, 4]
+    """
+    while value:
+        low = value & -value
+        yield low.bit_length() - 1
+        value ^= low
+
+def read_algos(filename):
+    """Yields tuples (algos, finor) of hex strings of every line of a text or
+    binary testvector file.
+    """
+    if is_binary(filename):
+        n_chars = ALGO_BITS // 4
+        for record in BinaryTestvector(filename):
+            yield '{0:0{1}x}'.format(record.algos, n_chars), str(record.finor)
+        return
+    with open(filename) as fp:
+        for line in fp:
+            columns = line.rsplit(None, 2)
+            if len(columns) < 2:
+                continue # skip empty lines
+            yield columns[-2], columns[-1]
+
+class BitCounter(object):
+    """Counts set bits per bit position of added integers using bit sliced
+    counters: plane k holds bit k of all position counters, adding a value
+    is a ripple carry over the planes (O(log n) integer operations).
+    """
+    def __init__(self, width=ALGO_BITS):
+        self.width = width
+        self.planes = []
+    def add(self, value):
+        """Add integer *value*, incrementing counters of all set bits."""
+        carry = value
+        planes = self.planes
+        k = 0
+        while carry:
+            if k == len(planes):
+                planes.append(carry)
+                return
+            plane = planes[k]
+            planes[k] = plane ^ carry
+            carry &= plane
+            k += 1
+    def counts(self):
+        """Returns list of counters, index is the bit position."""
+        result = [0] * self.width
+        for k, plane in enumerate(self.planes):
+            for bit in iter_bits(plane):
+                result[bit] += 1 << k
+        return result
+
+class TestvectorStats(object):
+    """Statistics of a testvector file.
+    *algo_counts* list of trigger counts per algorithm index
+    *finor_count* number of BX with FINOR set
+    *bx_popcounts* list of number of triggered algorithms per BX (line)
+    """
+    def __init__(self, width=ALGO_BITS):
+        self.algo_counts = [0] * width
+        self.finor_count = 0
+        self.bx_popcounts = []
+    @property
+    def n_bx(self):
+        """Number of evaluated BX (lines)."""
+        return len(self.bx_popcounts)
+
+def _stats_int(lines, mask, width):
+    """Pure Python implementation using bit sliced counters."""
+    stats = TestvectorStats(width)
+    counter = BitCounter(width)
+    popcounts = stats.bx_popcounts
+    finor_count = 0
+    for algos, finor in lines:
+        value = int(algos, 16)
+        if mask is not None:
+            value &= mask
+        counter.add(value)
+        popcounts.append(popcount(value))
+        if finor != '0':
+            finor_count += 1
+    stats.algo_counts = counter.counts()
+    stats.finor_count = finor_count
+    return stats
+
+def _stats_numpy(lines, mask, width):
+    """NumPy implementation unpacking chunks of algorithm words to bit matrices."""
+    stats = TestvectorStats(width)
+    n_bytes = width // 8
+    n_chars = width // 4
+    counts = numpy.zeros(width, dtype=numpy.int64)
+    mask_bits = None
+    if mask is not None:
+        mask_bytes = numpy.frombuffer(binascii.unhexlify('{0:0{1}x}'.format(mask, n_chars)), dtype=numpy.uint8)
+        mask_bits = numpy.unpackbits(mask_bytes)[::-1]
+    while True:
+        chunk = list(itertools.islice(lines, CHUNK_LINES))
+        if not chunk:
+            break
+        buf = b''.join(binascii.unhexlify(algos[-n_chars:].rjust(n_chars, '0')) for algos, finor in chunk)
+        words = numpy.frombuffer(buf, dtype=numpy.uint8).reshape(len(chunk), n_bytes)
+        bits = numpy.unpackbits(words, axis=1)[:, ::-1] # column index is bit index
+        if mask_bits is not None:
+            bits = bits & mask_bits
+        counts += bits.sum(axis=0, dtype=numpy.int64)
+        stats.bx_popcounts.extend(bits.sum(axis=1, dtype=numpy.int64).tolist())
+        stats.finor_count += sum(1 for algos, finor in chunk if finor != '0')
+    stats.algo_counts = counts.tolist()
+    return stats
+
+def testvector_stats(filename, mask=None, width=ALGO_BITS, use_numpy=None):
+    """Returns TestvectorStats of testvector file *filename*. Algorithm words
+    are masked by integer *mask* if given (the FINOR column is used unchanged).
+    NumPy is used if available unless *use_numpy* is False.
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    lines = read_algos(filename)
+    if use_numpy:
+        return _stats_numpy(lines, mask, width)
+    return _stats_int(lines, mask, width)
+
+def masked_digests(filename, masks):
+    """Returns list of SHA1 hex digests of testvector file *filename* with
+    algorithm words masked by each integer of *masks*, reading the file once.
+    Only columns seen by a module's simulation are hashed: the BX number and
+    LHC data and the masked algorithm word (FINOR is derived from it).
+    """
+    shas = [hashlib.sha1() for mask in masks]
+    with open(filename) as fp:
+        for line in fp:
+            columns = line.rsplit(None, 2)
+            if len(columns) < 3:
+                continue
+            head = columns[0].encode('utf-8')
+            value = int(columns[1], 16)
+            for mask, sha in zip(masks, shas):
+                sha.update(head)
+                sha.update('{0:x}\n'.format(value & mask).encode('utf-8'))
+    return [sha.hexdigest() for sha in shas]
+
+def is_binary(filename):
+    """Returns True if *filename* is a binary testvector file."""
+    with open(filename, 'rb') as fp:
+        return fp.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+def align(size, alignment):
+    """Returns *size* rounded up to a multiple of *alignment*."""
+    return -(-size // alignment) * alignment
+
+class Record(object):
+    """Testvector record of a single BX.
+    *bx* BX number, *data* list of LHC data tokens (hex strings), *algos*
+    algorithm word (integer), *finor* FINOR bit (integer).
+    """
+    def __init__(self, bx, data, algos, finor):
+        self.bx = bx
+        self.data = data
+        self.algos = algos
+        self.finor = finor
+    def __repr__(self):
+        return "Record(bx={self.bx}, algos=0x{self.algos:x}, finor={self.finor})".format(**locals())
+
+class RecordLayout(object):
+    """Binary record layout defined by the hex digits of the BX number and of
+    every LHC data token.
+    """
+    def __init__(self, bx_digits, token_digits):
+        self.bx_digits = bx_digits
+        self.token_digits = list(token_digits)
+        self.token_bytes = [(digits + 1) // 2 for digits in self.token_digits]
+        self.data_size = sum(self.token_bytes)
+        self.algos_offset = 4 + self.data_size
+        self.finor_offset = self.algos_offset + ALGO_BITS // 8
+        self.record_size = align(self.finor_offset + 1, RECORD_ALIGN)
+        self.header_size = align(HEADER_STRUCT.size + 2 * len(self.token_digits), HEADER_ALIGN)
+        self.padding = b'\0' * (self.record_size - self.finor_offset - 1)
+    @classmethod
+    def from_line(cls, line):
+        """Returns layout matching a testvector text line."""
+        columns = line.split()
+        return cls(len(columns[0]), [len(token) for token in columns[1:-2]])
+    def header(self):
+        """Returns packed file header."""
+        header = HEADER_STRUCT.pack(BINARY_MAGIC, BINARY_VERSION, self.bx_digits, len(self.token_digits), self.record_size)
+        header += struct.pack('<{0}H'.format(len(self.token_digits)), *self.token_digits)
+        return header.ljust(self.header_size, b'\0')
+    @classmethod
+    def from_header(cls, buf):
+        """Returns layout of packed file header *buf*."""
+        magic, version, bx_digits, n_tokens, record_size = HEADER_STRUCT.unpack_from(buf, 0)
+        if magic != BINARY_MAGIC:
+            raise RuntimeError("not a binary testvector file")
+        if version != BINARY_VERSION:
+            raise RuntimeError("unsupported binary testvector version: {0}".format(version))
+        token_digits = struct.unpack_from('<{0}H'.format(n_tokens), buf, HEADER_STRUCT.size)
+        layout = cls(bx_digits, token_digits)
+        if layout.record_size != record_size:
+            raise RuntimeError("invalid binary testvector record size: {0}".format(record_size))
+        return layout
+    def pack(self, line):
+        """Returns packed record of a testvector text line."""
+        columns = line.split()
+        tokens = columns[1:-2]
+        if len(tokens) != len(self.token_digits):
+            raise ValueError("invalid number of LHC data tokens in line: {0}".format(line[:16]))
+        data = b''.join(binascii.unhexlify(token.rjust(2 * size, '0')) for token, size in zip(tokens, self.token_bytes))
+        algos = binascii.unhexlify(columns[-2].rjust(ALGO_BITS // 4, '0'))
+        return struct.pack('<I', int(columns[0], 10)) + data + algos + struct.pack('<B', int(columns[-1], 16)) + self.padding
+    def unpack(self, buf, offset=0):
+        """Returns Record of packed record in *buf* at *offset*."""
+        bx, = struct.unpack_from('<I', buf, offset)
+        data = []
+        pos = offset + 4
+        for digits, size in zip(self.token_digits, self.token_bytes):
+            data.append(binascii.hexlify(buf[pos:pos + size]).decode('ascii')[-digits:])
+            pos += size
+        algos = int(binascii.hexlify(buf[offset + self.algos_offset:offset + self.finor_offset]), 16)
+        finor, = struct.unpack_from('<B', buf, offset + self.finor_offset)
+        return Record(bx, data, algos, finor)
+    def format(self, record):
+        """Returns testvector text line (without newline) of a Record."""
+        return ' '.join(['{0:0{1}d}'.format(record.bx, self.bx_digits)] + record.data + ['{0:0{1}x}'.format(record.algos, ALGO_BITS // 4), '{0:x}'.format(record.finor)])
+
+class BinaryTestvector(object):
+    """Memory mapped binary testvector file providing random access by BX
+    (record) index without parsing the rest of the file.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fp:
+            size = os.fstat(fp.fileno()).st_size
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.layout = RecordLayout.from_header(self._mmap)
+        self._length = (size - self.layout.header_size) // self.layout.record_size
+    def close(self):
+        """Release memory mapping."""
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+    def __len__(self):
+        return self._length
+    def _offset(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("testvector index out of range: {0}".format(index))
+        return self.layout.header_size + index * self.layout.record_size
+    def __getitem__(self, index):
+        return self.layout.unpack(self._mmap, self._offset(index))
+    def __iter__(self):
+        return self.records()
+    def records(self, first=0, last=None):
+        """Yields records of index range [first, last)."""
+        last = self._length if last is None else min(last, self._length)
+        for index in range(first, last):
+            yield self[index]
+    def algos(self, index):
+        """Returns algorithm word of record *index* as integer (without unpacking LHC data)."""
+        offset = self._offset(index)
+        return int(binascii.hexlify(self._mmap[offset + self.layout.algos_offset:offset + self.layout.finor_offset]), 16)
+    def lines(self, first=0, last=None):
+        """Yields testvector text lines (with newline) of index range [first, last)."""
+        for record in self.records(first, last):
+            yield self.layout.format(record) + '\n'
+
+def text_to_binary(src, dst):
+    """Converts testvector text file *src* to binary file *dst*. Returns number of records."""
+    count = 0
+    with open(src) as fsrc:
+        lines = (line for line in fsrc if line.strip())
+        first = next(lines, None)
+        if first is None:
+            raise RuntimeError("empty testvector file: {0}".format(src))
+        layout = RecordLayout.from_line(first)
+        with open(dst, 'wb') as fdst:
+            fdst.write(layout.header())
+            for line in itertools.chain([first], lines):
+                fdst.write(layout.pack(line))
+                count += 1
+    return count
+
+def binary_to_text(src, dst, first=0, last=None):
+    """Converts records [first, last) of binary testvector *src* to text file *dst*."""
+    with BinaryTestvector(src) as tv:
+        with open(dst, 'w') as fdst:
+            fdst.writelines(tv.lines(first, last))
+
+def parse_args():
+    """Parse command line arguments."""
+    import argparse
+    parser = argparse.ArgumentParser(description="uGT testvector tools")
+    subparsers = parser.add_subparsers(dest='command')
+    subparser = subparsers.add_parser('to-binary', help="convert text to binary testvector")
+    subparser.add_argument('src', help="text testvector file")
+    subparser.add_argument('dst', help="binary testvector file")
+    subparser = subparsers.add_parser('to-text', help="convert binary to text testvector")
+    subparser.add_argument('src', help="binary testvector file")
+    subparser.add_argument('dst', help="text testvector file")
+    subparser.add_argument('--first', metavar='<bx>', type=int, default=0, help="first record")
+    subparser.add_argument('--last', metavar='<bx>', type=int, help="last record (excluding)")
+    subparser = subparsers.add_parser('stats', help="print algorithm trigger counts")
+    subparser.add_argument('src', help="text or binary testvector file")
+    subparser.add_argument('--mask', metavar='<hex>', type=lambda value: int(value, 16), help="algorithm mask")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.command == 'to-binary':
+        print("converted {0} records".format(text_to_binary(args.src, args.dst)))
+    elif args.command == 'to-text':
+        binary_to_text(args.src, args.dst, args.first, args.last)
+    elif args.command == 'stats':
+        stats = testvector_stats(args.src, args.mask)
+        print("BX: {0}, FINOR: {1}".format(stats.n_bx, stats.finor_count))
+        for index, count in enumerate(stats.algo_counts):
+            if count:
+                print("{0:>5} {1:>8}".format(index, count))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
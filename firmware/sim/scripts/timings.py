@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+
+"""This module provides wall time spans of the simulation pipeline phases.
+
+>>> from timings import Timings
+>>> timings = Timings()
+>>> with timings.span('menu'):
+...     menu = XmlMenu(filename)
+>>> with timings.span('simulate', 'module_0'):
+...     simulate()
+>>> timings.write_json('timings.json')
+>>> for line in timings.table():
+...     print(line)
+
+Spans may be recorded from multiple threads.
+"""
+
+import contextlib
+import json
+import time
+from threading import Lock
+
+__all__ = ['Span', 'Timings']
+
+class Span(object):
+    """Wall time span of a phase, *label* names the module (or None for global
+    phases), *start* and *end* are seconds since start of the run.
+    """
+    def __init__(self, phase, label, start, end):
+        self.phase = phase
+        self.label = label
+        self.start = start
+        self.end = end
+    @property
+    def duration(self):
+        return self.end - self.start
+    def to_dict(self):
+        return {'phase': self.phase, 'module': self.label, 'start': round(self.start, 3), 'end': round(self.end, 3), 'duration': round(self.duration, 3)}
+
+class Timings(object):
+    """Collects spans of a run starting at *origin* (timestamp, default now)."""
+    def __init__(self, origin=None):
+        self.origin = time.time() if origin is None else origin
+        self.spans = []
+        self._lock = Lock()
+    def add(self, phase, start, end, label=None):
+        """Adds span of timestamps *start* to *end*."""
+        with self._lock:
+            self.spans.append(Span(phase, label, start - self.origin, end - self.origin))
+    @contextlib.contextmanager
+    def span(self, phase, label=None):
+        """Context manager recording a span of the enclosed code, also on errors."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, start, time.time(), label)
+    def wall_time(self):
+        """Returns seconds from start of run to end of last span."""
+        return max([span.end for span in self.spans] or [0.])
+    def totals(self):
+        """Returns list of tuples (phase, count, total seconds) in order of first occurrence."""
+        totals = {}
+        order = []
+        for span in sorted(self.spans, key=lambda span: span.start):
+            if span.phase not in totals:
+                totals[span.phase] = [0, 0.]
+                order.append(span.phase)
+            totals[span.phase][0] += 1
+            totals[span.phase][1] += span.duration
+        return [(phase, totals[phase][0], totals[phase][1]) for phase in order]
+    def write_json(self, filename):
+        """Writes spans and per phase totals to JSON file *filename*."""
+        data = {
+            'origin': self.origin,
+            'wall_time': round(self.wall_time(), 3),
+            'totals': [{'phase': phase, 'count': count, 'total': round(total, 3)} for phase, count, total in self.totals()],
+            'spans': [span.to_dict() for span in sorted(self.spans, key=lambda span: span.start)],
+        }
+        with open(filename, 'w') as fp:
+            json.dump(data, fp, indent=2)
+    def table(self):
+        """Returns list of lines of a human readable table of all spans,
+        followed by per phase totals.
+        """
+        lines = []
+        lines.append("|----------------------|------------------------|-----------|-----------|")
+        lines.append("| Phase                | Module                 | Start (s) |  Time (s) |")
+        lines.append("|----------------------|------------------------|-----------|-----------|")
+        for span in sorted(self.spans, key=lambda span: span.start):
+            lines.append("|{0:<22}|{1:<24}|{2:>11.2f}|{3:>11.2f}|".format(span.phase, span.label or '', span.start, span.duration))
+        lines.append("|----------------------|------------------------|-----------|-----------|")
+        for phase, count, total in self.totals():
+            lines.append("|{0:<22}|{1:<24}|{2:>11}|{3:>11.2f}|".format(phase, '{0} span(s)'.format(count), '', total))
+        lines.append("|----------------------|------------------------|-----------|-----------|")
+        lines.append("| Wall time            |                        |           |{0:>11.2f}|".format(self.wall_time()))
+        lines.append("|----------------------|------------------------|-----------|-----------|")
+        return lines
@@ -31,46 +31,108 @@ Filter algorithms by attributes:
 ...     for algorithm in menu.algorithms.byModule(module):
 ...         do_something(...)
 
+Use an on-disk cache of the parsed menu to speed up repeated loading (lxml is
+only required if the cache is missing or outdated):
+
+>>> menu = XmlMenu("sample.xml", cache=True) # cache next to XML file
+>>> menu = XmlMenu("sample.xml", cache="/tmp/menus") # cache in directory
+
 """
 
 import sys, os
-
-try:
-    from lxml import etree
-except ImportError:
-    raise RuntimeError("package lxml is missing, please install \"python-lxml\" using your package manager")
+import json
+import hashlib
+import tempfile
 
 __all__ = [ 'XmlMenu', '__doc__' ]
 
-def filter_first(function, sequence):
-    """Retruns first match of filter() result or None if nothing was found."""
-    return list(filter(function, sequence) or [None])[0]
+CACHE_VERSION = 1
+"""Version of cache file format, cache files of other versions are ignored."""
+
+CACHE_SUFFIX = '.cache.json'
+"""Suffix of cache files stored next to the XML file."""
+
+HEADER_TAGS = {
+    'name': (str, None),
+    'uuid_menu': (str, None),
+    'uuid_firmware': (str, None),
+    'grammar_version': (str, None),
+    'is_valid': (bool, None),
+    'is_obsolete': (bool, None),
+    'n_modules': (int, None),
+    'comment': (str, ""),
+}
+"""Menu header tags with format and default value."""
+
+ALGORITHM_TAGS = {
+    'name': (str, None),
+    'index': (int, None),
+    'expression': (str, None),
+    'module_id': (int, None),
+    'module_index': (int, None),
+    'comment': (str, ""),
+}
+"""Algorithm tags with format and default value."""
+
+HEADER_FIELDS = ('name', 'uuid_menu', 'uuid_firmware', 'grammar_version', 'is_valid', 'is_obsolete', 'n_modules', 'comment')
+"""Menu attributes stored in cache files."""
+
+def import_etree():
+    """Returns lxml etree module, imported on demand."""
+    try:
+        from lxml import etree
+    except ImportError:
+        raise RuntimeError("package lxml is missing, please install \"python-lxml\" using your package manager")
+    return etree
+
+def user_cache_dir():
+    """Returns user cache directory for menu cache files."""
+    base = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'xmlmenu')
 
-def get_xpath(elem, path, fmt=str, default=None):
-    """Easy access using etree elem xpath method. Returns value of 'default' if
-    element was not found (default is 'None').
+def cache_filename(filename, cache_dir=None):
+    """Returns cache filename of XML file *filename*. If *cache_dir* is given
+    the cache file is located inside this directory, else next to the XML file.
     """
-    results = elem.xpath('{path}/text()'.format(path=path))
-    if results:
-        return fmt(results[0])
+    filename = os.path.abspath(filename)
+    if cache_dir:
+        key = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+        return os.path.join(cache_dir, '{0}{1}'.format(key, CACHE_SUFFIX))
+    dirname, basename = os.path.split(filename)
+    return os.path.join(dirname, '.{0}{1}'.format(basename, CACHE_SUFFIX))
+
+def file_hash(filename):
+    """Returns SHA1 hex digest of file content."""
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def get_text(elem, fmt=str, default=None):
+    """Returns formatted text of etree element or value of 'default' if element
+    has no text (default is 'None').
+    """
+    if elem.text:
+        return fmt(elem.text)
     return default
 
-def fast_iter(context, func, *args, **kwargs):
-    """Fast XML iterator for huge XML files.
+def iter_children(context):
+    """Yields (root, elem) for every fully parsed direct child of the root
+    element of an iterparse *context* with 'end' events. Processed children are
+    cleared and removed from the tree to keep memory usage constant.
     http://lxml.de/parsing.html#modifying-the-tree
-    Based on Liza Daly's fast_iter
-    http://www.ibm.com/developerworks/xml/library/x-hiperfparse/
-    See also http://effbot.org/zone/element-iterparse.htm
     """
     for event, elem in context:
-        func(elem, *args, **kwargs)
+        parent = elem.getparent()
+        if parent is None or parent.getparent() is not None:
+            continue # root element or nested element
+        yield parent, elem
         # It's safe to call clear() here because no descendants will be
-        # accessed
+        # accessed, also eliminate now-empty references from the root node.
         elem.clear()
-        # Also eliminate now-empty references from the root node to elem
-        for ancestor in elem.xpath('ancestor-or-self::*'):
-            while ancestor.getprevious() is not None:
-                del ancestor.getparent()[0]
+        while elem.getprevious() is not None:
+            del parent[0]
     del context
 
 class Algorithm(object):
@@ -89,19 +151,68 @@ class Algorithm(object):
                "module(id={self.module_id}, index={self.module_index}))".format(**locals())
 
 class AlgorithmContainer(list):
-    """List container with extended lookup methods for content."""
+    """List container with extended lookup methods for content.
+    Lookups use hash indexes by index, name, module id and module index that
+    are kept up to date when adding algorithms.
+    """
+    def __init__(self, *args):
+        super(AlgorithmContainer, self).__init__(*args)
+        self._reindex()
+    def _reindex(self):
+        """Rebuild all lookup indexes from list content."""
+        self._by_index = {}
+        self._by_name = {}
+        self._by_module_id = {}
+        self._by_module_index = {}
+        for algorithm in self:
+            self._index(algorithm)
+    def _index(self, algorithm):
+        """Add algorithm to lookup indexes, first match wins for unique keys."""
+        self._by_index.setdefault(algorithm.index, algorithm)
+        self._by_name.setdefault(algorithm.name, algorithm)
+        self._by_module_id.setdefault(algorithm.module_id, []).append(algorithm)
+        self._by_module_index.setdefault(algorithm.module_index, []).append(algorithm)
+    def append(self, algorithm):
+        super(AlgorithmContainer, self).append(algorithm)
+        self._index(algorithm)
+    def extend(self, algorithms):
+        for algorithm in algorithms:
+            self.append(algorithm)
+    def __iadd__(self, algorithms):
+        self.extend(algorithms)
+        return self
+    def _mutator(name):
+        """Wraps list method *name* to rebuild indexes after modification."""
+        method = getattr(list, name)
+        def wrapper(self, *args):
+            result = method(self, *args)
+            self._reindex()
+            return result
+        wrapper.__name__ = name
+        return wrapper
+    insert = _mutator('insert')
+    remove = _mutator('remove')
+    pop = _mutator('pop')
+    reverse = _mutator('reverse')
+    sort = _mutator('sort')
+    __setitem__ = _mutator('__setitem__')
+    __delitem__ = _mutator('__delitem__')
+    if hasattr(list, '__setslice__'): # Python 2
+        __setslice__ = _mutator('__setslice__')
+        __delslice__ = _mutator('__delslice__')
+    del _mutator
     def byIndex(self, index):
         """Retruns algorithm by index or None if not found."""
-        return filter_first(lambda algorithm: algorithm.index == index, self)
+        return self._by_index.get(index)
     def byModuleId(self, id):
         """Returns list of algorithms assigned to module id or empty list if none found."""
-        return filter(lambda algorithm: algorithm.module_id == id, self)
+        return list(self._by_module_id.get(id, []))
     def byModuleIndex(self, index):
         """Returns list of algorithms assigned to module index or empty list if none found."""
-        return filter(lambda algorithm: algorithm.module_index == index, self)
+        return list(self._by_module_index.get(index, []))
     def byName(self, name):
         """Retruns algorithm by name or None if not found."""
-        return filter_first(lambda algorithm: algorithm.name == name, self)
+        return self._by_name.get(name)
 
 class XmlMenu(object):
     """Container holding some information of the XML menu.
@@ -121,7 +232,7 @@ class XmlMenu(object):
     [...]
     """
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, cache=None):
         self.filename = None
         self.name = None
         self.uuid_menu = None
@@ -132,37 +243,112 @@ class XmlMenu(object):
         self.n_modules = 0
         self.comment = ""
         self.algorithms = AlgorithmContainer()
-        if filename: self.read(filename)
+        if filename: self.read(filename, cache)
 
-    def read(self, filename):
-        """Read XML from file and parse its content."""
+    def read(self, filename, cache=None):
+        """Read XML from file and parse its content. If *cache* is True a cache
+        file next to the XML file is used (or in the user cache directory if
+        not writeable), if *cache* is a path the cache file is located inside
+        this directory.
+        """
         self.filename = os.path.abspath(filename)
         self.algorithms = AlgorithmContainer()
+        if not cache:
+            return self._parse()
+        cache_dir = None if cache is True else cache
+        if self._read_cache(cache_filename(self.filename, cache_dir)):
+            return
+        if cache is True and self._read_cache(cache_filename(self.filename, user_cache_dir())):
+            return
+        self._parse()
+        self._write_cache(cache_dir)
+
+    def _cache_stat(self):
+        """Returns file size and mtime of XML file used to validate cache files."""
+        st = os.stat(self.filename)
+        return st.st_size, st.st_mtime
+
+    def _read_cache(self, filename):
+        """Load menu from cache file. Returns False if cache file is missing,
+        invalid or outdated.
+        """
+        try:
+            with open(filename, 'r') as fp:
+                data = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return False
+        size, mtime = self._cache_stat()
+        if data.get('version') != CACHE_VERSION or data.get('size') != size or data.get('mtime') != mtime:
+            return False
+        if data.get('sha1') != file_hash(self.filename):
+            return False
+        try:
+            header = dict((field, data['header'][field]) for field in HEADER_FIELDS)
+            algorithms = AlgorithmContainer(Algorithm(*values) for values in data['algorithms'])
+        except (KeyError, TypeError):
+            return False
+        for field, value in header.items():
+            setattr(self, field, value)
+        self.algorithms = algorithms
+        return True
+
+    def _write_cache(self, cache_dir=None):
+        """Write menu to cache file, falls back to user cache directory if
+        cache file can not be written next to XML file.
+        """
+        size, mtime = self._cache_stat()
+        data = {
+            'version': CACHE_VERSION,
+            'size': size,
+            'mtime': mtime,
+            'sha1': file_hash(self.filename),
+            'header': dict((field, getattr(self, field)) for field in HEADER_FIELDS),
+            'algorithms': [[a.index, a.name, a.expression, a.module_id, a.module_index, a.comment] for a in self.algorithms],
+        }
+        for directory in ([cache_dir] if cache_dir else [None, user_cache_dir()]):
+            filename = cache_filename(self.filename, directory)
+            try:
+                if not os.path.isdir(os.path.dirname(filename)):
+                    os.makedirs(os.path.dirname(filename))
+                # Write to temporary file first, rename is atomic.
+                fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename))
+                with os.fdopen(fd, 'w') as fp:
+                    json.dump(data, fp, separators=(',', ':'))
+                os.rename(tmpname, filename)
+                return filename
+            except (IOError, OSError):
+                continue
+        return None
+
+    def _parse(self):
+        """Parse XML file using lxml in a single streaming pass, collecting
+        header fields and algorithms.
+        """
+        etree = import_etree()
+        header = {}
+        for tag, (fmt, default) in HEADER_TAGS.items():
+            setattr(self, tag, default)
         with open(self.filename, 'rb') as fp:
-            # Access static elements
-            context = etree.parse(fp)
-            self.name = get_xpath(context, 'name')
-            self.uuid_menu = get_xpath(context, 'uuid_menu')
-            self.uuid_firmware = get_xpath(context, 'uuid_firmware')
-            self.grammar_version = get_xpath(context, 'grammar_version')
-            self.is_valid = get_xpath(context, 'is_valid', bool)
-            self.is_obsolete = get_xpath(context, 'is_obsolete', bool)
-            self.n_modules = get_xpath(context, 'n_modules', int)
-            self.comment = get_xpath(context, 'comment', default="")
-            # Access list of algorithms
-            fp.seek(0) # Seek begin of file
-            context = etree.iterparse(fp, tag='algorithm')
-            fast_iter(context, self._read_algorithm)
+            context = etree.iterparse(fp, events=('end',))
+            for root, elem in iter_children(context):
+                if elem.tag == 'algorithm':
+                    self._read_algorithm(elem)
+                elif elem.tag in HEADER_TAGS and elem.tag not in header:
+                    fmt, default = HEADER_TAGS[elem.tag]
+                    header[elem.tag] = get_text(elem, fmt, default)
+        for tag, value in header.items():
+            setattr(self, tag, value)
 
     def _read_algorithm(self, elem):
         """Fetch information from an algorithm tag and appends it to the list of algorithms."""
-        name = get_xpath(elem, 'name')
-        index = get_xpath(elem, 'index', int)
-        expression = get_xpath(elem, 'expression')
-        module_id = get_xpath(elem, 'module_id', int)
-        module_index = get_xpath(elem, 'module_index', int)
-        comment = get_xpath(elem, 'comment', default="")
-        algorithm = Algorithm(index, name, expression, module_id, module_index, comment)
+        fields = {}
+        for child in elem:
+            if child.tag in ALGORITHM_TAGS and child.tag not in fields:
+                fmt, default = ALGORITHM_TAGS[child.tag]
+                fields[child.tag] = get_text(child, fmt, default)
+        for tag, (fmt, default) in ALGORITHM_TAGS.items():
+            fields.setdefault(tag, default)
+        algorithm = Algorithm(**fields)
         self.algorithms.append(algorithm)
 
 if __name__ == '__main__':
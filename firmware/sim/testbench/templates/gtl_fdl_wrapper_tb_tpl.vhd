@@ -43,6 +43,14 @@ use work.gt_mp7_core_pkg.all;
 use work.gtl_pkg.all;
 
 entity gtl_fdl_wrapper_TB is
+    generic(
+        -- compared range of testvector lines, preceding and following lines are only used for pipeline warm-up (BX sharding),
+        -- overridden by vsim -g to simulate ranges without recompiling
+        FIRST_BX : integer := {{FIRST_BX}};
+        LAST_BX : integer := {{LAST_BX}};
+        TESTVECTOR_FILENAME : string := "{{TESTVECTOR_FILENAME}}";
+        RESULTS_FILE : string := "{{RESULTS_FILE}}"
+    );
 end gtl_fdl_wrapper_TB;
 
 architecture rtl of gtl_fdl_wrapper_TB is
@@ -64,6 +72,8 @@ architecture rtl of gtl_fdl_wrapper_TB is
     constant OFFSET_LHC_DATA  : time :=  7 ns;
 
     constant LHC_BUNCH_COUNT: integer := 3564;
+    -- algorithms of simulated module, bits of other modules in testvector are ignored
+    constant ALGO_MASK : std_logic_vector(MAX_NR_ALGOS-1 downto 0) := X"{{ALGO_MASK}}";
 
     signal clk160 : std_logic;
     signal lhc_clk : std_logic;
@@ -113,8 +123,8 @@ begin
         variable algo_vector_data_occur : algo_occur_array(MAX_NR_ALGOS-1 downto 0) := (others => 0);
         variable diff_occur, algo_mismatch : integer := 0;
 
-        file testvector_file : text open read_mode is "{{TESTVECTOR_FILENAME}}";
-        file error_file : text open write_mode is "{{RESULTS_FILE}}";
+        file testvector_file : text open read_mode is TESTVECTOR_FILENAME;
+        file error_file : text open write_mode is RESULTS_FILE;
 
         function str_to_slv(str : string) return std_logic_vector is
             alias str_norm : string(1 to str'length) is str;
@@ -142,9 +152,14 @@ begin
             bx_nr_vector_data(temp_counter) := l(1 to 4); -- bx nr
             testdata(temp_counter) := string_to_lhc_data_t(l(6 to 638)); -- without bx_nr, algos and finor
             algo_vector_string(temp_counter) := l(639 to 766); -- algo strings
-            algo_vector_data(temp_counter) := str_to_slv(l(639 to 766)); -- algos
-            finor_vector_data(temp_counter) := str_to_slv(l(768 to 768)); -- finor
-            finor_vector_string(temp_counter) := l(768 to 768); -- finor string
+            algo_vector_data(temp_counter) := str_to_slv(l(639 to 766)) and ALGO_MASK; -- algos of module
+            -- finor of module, finor column of testvector covers all modules
+            if algo_vector_data(temp_counter) = (MAX_NR_ALGOS-1 downto 0 => '0') then
+                finor_vector_string(temp_counter) := "0"; -- finor string
+            else
+                finor_vector_string(temp_counter) := "1"; -- finor string
+            end if;
+            finor_vector_data(temp_counter) := str_to_slv(finor_vector_string(temp_counter)); -- finor
             temp_counter := temp_counter + 1;
         end loop;
 
@@ -158,11 +173,11 @@ begin
         report "******************************************************************** ERROR LISTING ***********************************************************************************************";
         report "**********************************************************************************************************************************************************************************";
 
-        for i in 0 to LHC_BUNCH_COUNT+GTL_FDL_LATENCY-1 loop
-            if i < LHC_BUNCH_COUNT then
+        for i in 0 to temp_counter+GTL_FDL_LATENCY-1 loop
+            if i < temp_counter then
                 lhc_data <= testdata(i);
             end if;
-            if i >= GTL_FDL_LATENCY then
+            if i >= GTL_FDL_LATENCY+FIRST_BX and i <= GTL_FDL_LATENCY+LAST_BX then
                 for j in 0 to MAX_NR_ALGOS-1 loop
                     if algo_after_prescaler_rop(j) = '1' then
                         algo_after_prescaler_rop_occur(j) := algo_after_prescaler_rop_occur(j) + 1;
@@ -8,5 +8,10 @@ catch { config_ip_cache -export [get_ips -all algos_0] }
 generate_target all [get_files top/top.srcs/sources_1/ip/algos_0/algos_0.xci] 
 export_ip_user_files -of_objects [get_files top/top.srcs/sources_1/ip/algos_0/algos_0.xci] 
 create_ip_run [get_files -of_objects [get_fileset sources_1] top/top.srcs/sources_1/ip/algos_0/algos_0.xci] 
-launch_runs -jobs 14 algos_0_synth_1
+if {$argc < 1} {
+    puts "ERROR: missing number of jobs, run with -tclargs <jobs> (startSynth.py passes the share of its core budget)"
+    exit 1
+}
+set jobs [lindex $argv 0]
+launch_runs -jobs $jobs algos_0_synth_1
 exit
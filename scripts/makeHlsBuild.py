@@ -3,6 +3,7 @@
 
 import toolbox as tb
 import mp7patch
+import mirror
 
 import argparse
 import urllib
@@ -55,6 +56,8 @@ def parse_args():
     parser.add_argument('-m', '--module', default=DefaultNrModules, help="MP7 module ID (default: 0)")
     parser.add_argument('-t', '--tag', metavar='<tag>', default=DefaultMp7FwTag, help="mp7fw tag (default: DefaultMp7FwTag)")
     parser.add_argument('-b', '--build', metavar='<version>', required=True, type=tb.build_t, help='menu build version (eg. 0x1001)')
+    parser.add_argument('--mirror', metavar='<path>', default=mirror.DefaultMirrorDir, type=os.path.abspath, help="local git mirror directory (default is {})".format(mirror.DefaultMirrorDir))
+    parser.add_argument('--mirror-mode', metavar='<mode>', default=mirror.DefaultMode, choices=mirror.Modes, help="create checkouts from mirror using {} (default is {})".format('/'.join(mirror.Modes), mirror.DefaultMode))
     return parser.parse_args()
 
 def main():
@@ -93,8 +96,9 @@ def main():
     print '====================================================='
     print ''
 
-    os.system('git clone https://github.com/herbberg/hls4gtl {work_dir}/hls4gtl'.format(**locals()))
-    os.system('git clone https://github.com/herbberg/mp7ugt_hls {work_dir}/mp7ugt_hls'.format(**locals()))
+    # Check out from local mirrors (see mirror.py refresh)
+    mirror.clone('hls4gtl', '{work_dir}/hls4gtl'.format(**locals()), args.mirror, args.mirror_mode)
+    mirror.clone('mp7ugt_hls', '{work_dir}/mp7ugt_hls'.format(**locals()), args.mirror, args.mirror_mode)
     os.chdir('{work_dir}/hls4gtl'.format(**locals()))
     
     os.system('python manage.py init {menu_dir} {args.module}'.format(**locals()))
@@ -102,7 +106,7 @@ def main():
     session = "hls_0x{args.build}".format(**locals())
     logging.info("starting screen session '%s' for HLS and FW synthesis ...", session)
     
-    command = ('bash -c "python manage.py cosim; python manage.py export; python {work_dir}/mp7ugt_hls/scripts/makeProject.py -t {args.tag} -b 0x{args.build} -m {menu_dir} --hls {work_dir}/hls4gtl/hls_impl/solution1/impl/ip -p {work_dir}/work; python {work_dir}/mp7ugt_hls/scripts/startSynth.py {args.vivado} {work_dir}/work/mp7_ugt/0x{args.build}/mp7fw_v2_4_1/build/build_0x{args.build}.cfg --screen no"'.format(**locals()))    
+    command = ('bash -c "python manage.py cosim; python manage.py export; python {work_dir}/mp7ugt_hls/scripts/makeProject.py -t {args.tag} -b 0x{args.build} -m {menu_dir} --hls {work_dir}/hls4gtl/hls_impl/solution1/impl/ip -p {work_dir}/work --mirror {args.mirror} --mirror-mode {args.mirror_mode}; python {work_dir}/mp7ugt_hls/scripts/startSynth.py {args.vivado} {work_dir}/work/mp7_ugt/0x{args.build}/mp7fw_v2_4_1/build/build_0x{args.build}.cfg --screen no"'.format(**locals()))    
     run_command('screen', '-dmS', session, command)
     # list running screen sessions
     run_command('screen', '-ls')
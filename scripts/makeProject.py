@@ -3,6 +3,7 @@
 
 import toolbox as tb
 import mp7patch
+import mirror
 
 import argparse
 import urllib
@@ -10,7 +11,9 @@ import shutil
 import logging
 from distutils.dir_util import copy_tree
 import subprocess
+import multiprocessing
 import ConfigParser
+import time
 import sys, os
 
 EXIT_SUCCESS = 0
@@ -42,6 +45,20 @@ TARGET_PKG = os.path.join(firmware_dir, 'hdl', 'gt_mp7_top_pkg.vhd')
 
 Tcl_addHlsIpCore = 'addHlsIpCore.tcl'
 
+FirmwareDirs = ['cfg', 'hdl', 'ngc', 'ucf']
+"""Firmware source directories shared by all modules."""
+
+LinkModes = ['hardlink', 'symlink', 'copy']
+DefaultLinkMode = 'hardlink'
+"""Default mode to create module trees from the shared source tree. Hardlinks
+share the read-only inode with all modules, a module making a linked file
+writable (chmod u+w) and editing it changes the file of every module. Use
+mode copy for module trees edited by hand.
+"""
+
+ModuleLog = 'makeProject.log'
+"""Log file of module build area creation (inside module directory)."""
+
 def parse_args():
     """Parse command line arguments."""
     parser = argparse.ArgumentParser()
@@ -52,8 +69,92 @@ def parse_args():
     parser.add_argument('-b', '--build', metavar='<version>', required=True, type=tb.build_t, help='menu build version (eg. 0x1001)')
     parser.add_argument('--tclfile', default=Tcl_addHlsIpCore, help="file name tcl script for HLS IP core")
     parser.add_argument('--hls', metavar='<path>', required=True, help='path to HLS IP')
+    parser.add_argument('-j', '--jobs', metavar='<n>', type=tb.jobs_t, default=multiprocessing.cpu_count(), help="max. number of module build areas created in parallel (default is number of cores)")
+    parser.add_argument('--mirror', metavar='<path>', default=mirror.DefaultMirrorDir, type=os.path.abspath, help="local git mirror directory (default is {})".format(mirror.DefaultMirrorDir))
+    parser.add_argument('--mirror-mode', metavar='<mode>', default=mirror.DefaultMode, choices=mirror.Modes, help="create mp7fw checkout from mirror using {} (default is {})".format('/'.join(mirror.Modes), mirror.DefaultMode))
+    parser.add_argument('--link', metavar='<mode>', default=DefaultLinkMode, choices=LinkModes, help="create module source trees using {} (default is {})".format('/'.join(LinkModes), DefaultLinkMode))
     return parser.parse_args()
 
+def failed_log(project_dir, module_id):
+    """Returns path of log file of a failed module kept after removing its
+    partial build area.
+    """
+    return os.path.join(project_dir, 'module_{}_{}'.format(module_id, ModuleLog))
+
+def create_module(module_id, args, mp7path, project_dir, shared_fw_dir):
+    """Creates build area of module *module_id*, output of the project manager
+    is written to the module's log file. Returns tuple (files, bytes, seconds)
+    of linked source files.
+    """
+    module_name = 'module_{}'.format(module_id)
+    module_dir = os.path.join(project_dir, module_name)
+    local_fw_dir = os.path.abspath(os.path.join(module_dir, 'mp7_ugt'))
+
+    # Creat module build area
+    os.makedirs(local_fw_dir)
+
+    log_file = os.path.join(module_dir, ModuleLog)
+    with open(log_file, 'w') as log:
+        logging.info("%s: creating build area (log: %s)", module_name, log_file)
+
+        # Link shared sources to module build area
+        linked_files = 0
+        linked_bytes = 0
+        start = time.time()
+        for name in FirmwareDirs:
+            files, size = tb.link_tree(os.path.join(shared_fw_dir, name), os.path.join(local_fw_dir, 'firmware', name), args.link)
+            linked_files += files
+            linked_bytes += size
+        link_time = time.time() - start
+
+        # Read generated VHDL snippets
+        src_dir = os.path.join(args.menu, 'vhdl', module_name, 'src')
+
+        gtl_fdl_wrapper_dir = os.path.join(local_fw_dir, 'firmware', 'hdl', 'gt_mp7_core', 'gtl_fdl_wrapper')
+        gtl_dir = os.path.join(gtl_fdl_wrapper_dir, 'gtl')
+        fdl_dir = os.path.join(gtl_fdl_wrapper_dir, 'fdl')
+
+        # Copy constants_pkg.vhd from "menu" (HLS), the only module specific source
+        tb.materialize(os.path.join(src_dir, 'constants_pkg.vhd'), os.path.join(gtl_dir, 'constants_pkg.vhd'))
+
+        # Run project manager (inside MP7 tag)
+        command = ['python', 'ProjectManager.py', 'vivado', local_fw_dir, '-w', module_dir]
+        log.write(">$ {}\n".format(' '.join(command)))
+        log.flush()
+        returncode = subprocess.call(command, cwd=mp7path, stdout=log, stderr=subprocess.STDOUT)
+        if returncode != 0:
+            raise RuntimeError("project manager failed with exit code {} (see {})".format(returncode, log_file))
+
+    #
+    # Create TCL file for adding HLS IP core into Vivado IP catalog
+    #
+    #set_prop = "set_property ip_repo_paths %s", args.hls, "[current_project]\n"
+    hls_ip_file = open(os.path.join(module_dir, args.tclfile),"w")
+    hls_ip_file.write("open_project top/top.xpr\n")
+    hls_ip_file.write("set_property ip_repo_paths ")
+    hls_ip_file.write(args.hls)
+    hls_ip_file.write(" [current_project]\n")
+    hls_ip_file.write("update_ip_catalog\n")
+    hls_ip_file.write("create_ip -name algos -library hls -version 1.0 -module_name algos_0\n")
+    hls_ip_file.write("generate_target {instantiation_template} [get_files top/top.srcs/sources_1/ip/algos_0/algos_0.xci]\n")
+    hls_ip_file.write("generate_target all [get_files top/top.srcs/sources_1/ip/algos_0/algos_0.xci]\n")
+    hls_ip_file.write("catch { config_ip_cache -export [get_ips -all algos_0] }\n")
+    hls_ip_file.write("generate_target all [get_files top/top.srcs/sources_1/ip/algos_0/algos_0.xci] \n")
+    hls_ip_file.write("export_ip_user_files -of_objects [get_files top/top.srcs/sources_1/ip/algos_0/algos_0.xci] \n")
+    hls_ip_file.write("create_ip_run [get_files -of_objects [get_fileset sources_1] top/top.srcs/sources_1/ip/algos_0/algos_0.xci] \n")
+    # number of jobs is allocated by startSynth.py (-tclargs <jobs>), see addHlsIpCore.tcl
+    hls_ip_file.write("if {$argc < 1} {\n")
+    hls_ip_file.write("    puts \"ERROR: missing number of jobs, run with -tclargs <jobs> (startSynth.py passes the share of its core budget)\"\n")
+    hls_ip_file.write("    exit 1\n")
+    hls_ip_file.write("}\n")
+    hls_ip_file.write("set jobs [lindex $argv 0]\n")
+    hls_ip_file.write("launch_runs -jobs $jobs algos_0_synth_1\n")
+    hls_ip_file.write("exit\n")
+    hls_ip_file.close()
+
+    logging.info("%s: finished", module_name)
+    return linked_files, linked_bytes, link_time
+
 def main():
     """Main routine."""
 
@@ -107,10 +208,9 @@ def main():
     logging.info("creating directory %s", mp7path)
     os.makedirs(mp7path)
 
-    # Check out mp7fw
+    # Check out mp7fw (from local mirror, see mirror.py refresh)
+    mirror.clone('mp7fw_v2_4_1', mp7path, args.mirror, args.mirror_mode)
     os.chdir(mp7path)
-
-    os.system('git clone https://github.com/herbberg/mp7fw_v2_4_1 {mp7path}'.format(**locals()))
     
     # Patching top VHDL
     
@@ -127,56 +227,62 @@ def main():
     project_dir = os.path.abspath(os.path.join(build_area_dir, menu_name))
     os.makedirs(project_dir)
 
-    # Do for every module of the menu...
-    for module_id in range(modules):
-        module_name = 'module_{}'.format(module_id)
-        module_dir = os.path.join(project_dir, module_name)
-        local_fw_dir = os.path.abspath(os.path.join(module_dir, 'mp7_ugt'))
-
-        # Creat module build area
-        os.makedirs(local_fw_dir)
-
-        # Copy sources to module build area
-        copy_tree(os.path.join(firmware_dir, 'cfg'), os.path.join(local_fw_dir, 'firmware', 'cfg'))
-        copy_tree(os.path.join(firmware_dir, 'hdl'), os.path.join(local_fw_dir, 'firmware', 'hdl'))
-        copy_tree(os.path.join(firmware_dir, 'ngc'), os.path.join(local_fw_dir, 'firmware', 'ngc'))
-        copy_tree(os.path.join(firmware_dir, 'ucf'), os.path.join(local_fw_dir, 'firmware', 'ucf'))
-
-        # Read generated VHDL snippets
-        src_dir = os.path.join(args.menu, 'vhdl', module_name, 'src')
-
-        gtl_fdl_wrapper_dir = os.path.join(local_fw_dir, 'firmware', 'hdl', 'gt_mp7_core', 'gtl_fdl_wrapper')
-        gtl_dir = os.path.join(gtl_fdl_wrapper_dir, 'gtl')
-        fdl_dir = os.path.join(gtl_fdl_wrapper_dir, 'fdl')
+    # Copy sources once to a shared read-only tree, module trees link to it
+    shared_fw_dir = os.path.join(project_dir, 'shared', 'firmware')
+    logging.info("creating shared source tree %s", shared_fw_dir)
+    start = time.time()
+    for name in FirmwareDirs:
+        copy_tree(os.path.join(firmware_dir, name), os.path.join(shared_fw_dir, name))
+    copy_time = time.time() - start
+    tb.make_readonly(shared_fw_dir)
+
+    # Create module build areas in parallel
+    logging.info("creating %d module build area(s) using %d process(es)...", modules, min(args.jobs, modules))
+    pool = multiprocessing.Pool(min(args.jobs, modules))
+    try:
+        pending = [(module_id, pool.apply_async(create_module, (module_id, args, mp7path, project_dir, shared_fw_dir))) for module_id in range(modules)]
+        pool.close()
+
+        # Collect results of all modules, errors are reported after all modules finished
+        linked_files = 0
+        linked_bytes = 0
+        link_time = 0.
+        failed = []
+        for module_id, result in pending:
+            try:
+                files, size, duration = result.get()
+            except Exception as e:
+                logging.error("module_%d: %s", module_id, e)
+                failed.append(module_id)
+                continue
+            linked_files += files
+            linked_bytes += size
+            link_time += duration
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    # Remove partial build areas of failed modules, keeping their logs
+    for module_id in failed:
+        module_dir = os.path.join(project_dir, 'module_{}'.format(module_id))
+        log_file = os.path.join(module_dir, ModuleLog)
+        if os.path.isfile(log_file):
+            shutil.move(log_file, failed_log(project_dir, module_id))
+        tb.remove(module_dir)
+
+    if failed:
+        raise RuntimeError("failed to create module(s): {} (see {})".format(
+            ', '.join('module_{}'.format(module_id) for module_id in failed),
+            ', '.join(failed_log(project_dir, module_id) for module_id in failed)))
+
+    # Report savings of linked module trees (estimating copy time by the shared tree),
+    # times are summed over modules as linking runs in parallel pool workers
+    logging.info("module source trees: %d files (%.1f MiB) linked instead of copied (%s)", linked_files, linked_bytes / 1024. ** 2, args.link)
+    logging.info("module source trees: created in %.2f s summed over modules, copying would take about %.2f s summed (%.2f s saved)",
+        copy_time + link_time, copy_time * modules, copy_time * (modules - 1) - link_time)
 
-        # Copy constants_pkg.vhd from "menu" (HLS)
-        shutil.copyfile(os.path.join(src_dir, 'constants_pkg.vhd'), os.path.join(gtl_dir, 'constants_pkg.vhd'))
-
-        # Run project manager
-        subprocess.check_call(['python', 'ProjectManager.py', 'vivado', local_fw_dir, '-w', module_dir])
-
-        #
-        # Create TCL file for adding HLS IP core into Vivado IP catalog
-        #
-        os.chdir(module_dir)
-        #set_prop = "set_property ip_repo_paths %s", args.hls, "[current_project]\n"
-        hls_ip_file = open(args.tclfile,"w")
-        hls_ip_file.write("open_project top/top.xpr\n")
-        hls_ip_file.write("set_property ip_repo_paths ")
-        hls_ip_file.write(args.hls)
-        hls_ip_file.write(" [current_project]\n")
-        hls_ip_file.write("update_ip_catalog\n")
-        hls_ip_file.write("create_ip -name algos -library hls -version 1.0 -module_name algos_0\n")
-        hls_ip_file.write("generate_target {instantiation_template} [get_files top/top.srcs/sources_1/ip/algos_0/algos_0.xci]\n")
-        hls_ip_file.write("generate_target all [get_files top/top.srcs/sources_1/ip/algos_0/algos_0.xci]\n")
-        hls_ip_file.write("catch { config_ip_cache -export [get_ips -all algos_0] }\n")
-        hls_ip_file.write("generate_target all [get_files top/top.srcs/sources_1/ip/algos_0/algos_0.xci] \n")
-        hls_ip_file.write("export_ip_user_files -of_objects [get_files top/top.srcs/sources_1/ip/algos_0/algos_0.xci] \n")
-        hls_ip_file.write("create_ip_run [get_files -of_objects [get_fileset sources_1] top/top.srcs/sources_1/ip/algos_0/algos_0.xci] \n")
-        hls_ip_file.write("launch_runs -jobs 14 algos_0_synth_1\n")
-        hls_ip_file.write("exit\n")
-        hls_ip_file.close()
-        
     # Go to build area root directory.
     os.chdir(mp7path)
     os.chdir(build_area_dir)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""mirror.py -- local mirror cache of git repositories used by the build scripts
+
+Build areas are created from bare mirrors (git clone --mirror) inside a local
+mirror directory instead of cloning from the network. A missing mirror is
+created on first use, existing mirrors are only updated by the explicit
+refresh command, so creating build areas works on nodes without network
+access once the mirrors exist.
+
+Modes of creating a repository from its mirror:
+
+  reference  clone sharing the objects of the mirror (git clone --shared),
+             origin is set to the upstream URL
+  worktree   detached worktree of the mirror (git worktree add)
+
+Mirrors never prune unreachable objects (gc.pruneExpire never) as clones
+reference their objects.
+
+    $ python mirror.py list
+    $ python mirror.py refresh [<name> ...]
+    $ python mirror.py clone mp7fw_v2_4_1 <path> [--mode worktree]
+
+"""
+
+import argparse
+import logging
+import shutil
+import subprocess
+import tempfile
+import sys, os
+
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+
+Repositories = {
+    'mp7fw_v2_4_1': 'https://github.com/herbberg/mp7fw_v2_4_1',
+    'hls4gtl': 'https://github.com/herbberg/hls4gtl',
+    'mp7ugt_hls': 'https://github.com/herbberg/mp7ugt_hls',
+}
+"""Repositories used by the build scripts."""
+
+DefaultMirrorDir = os.getenv('UGT_MIRROR_DIR', os.path.expanduser('~/work_vivado_hls/mirrors'))
+"""Default local mirror directory (environment variable UGT_MIRROR_DIR)."""
+
+Modes = ['reference', 'worktree']
+DefaultMode = 'reference'
+
+def git(*args, **kwargs):
+    """Runs git command, raises RuntimeError on failure."""
+    command = ['git'] + list(args)
+    logging.info(">$ %s", ' '.join(command))
+    if subprocess.call(command, **kwargs) != 0:
+        raise RuntimeError("git command failed: {}".format(' '.join(command)))
+
+def mirror_path(name, mirror_dir=DefaultMirrorDir):
+    """Returns path of mirror of repository *name*."""
+    return os.path.join(mirror_dir, '{}.git'.format(name))
+
+def ensure_mirror(name, mirror_dir=DefaultMirrorDir):
+    """Creates mirror of repository *name* if missing, returns its path. The
+    mirror is cloned into a temporary directory and renamed into place, a
+    mirror created concurrently by another process is used instead.
+    """
+    path = mirror_path(name, mirror_dir)
+    if not os.path.isdir(path):
+        logging.info("creating mirror of %s in %s ...", name, path)
+        if not os.path.isdir(mirror_dir):
+            try:
+                os.makedirs(mirror_dir)
+            except OSError:
+                if not os.path.isdir(mirror_dir):
+                    raise
+        tmp_path = tempfile.mkdtemp(prefix='.{}-'.format(name), dir=mirror_dir)
+        try:
+            git('clone', '--mirror', Repositories[name], tmp_path)
+            git('config', 'gc.pruneExpire', 'never', cwd=tmp_path)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+                logging.info("mirror of %s created by another process, using %s", name, path)
+        finally:
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path)
+    return path
+
+def refresh(name, mirror_dir=DefaultMirrorDir):
+    """Fetches all refs of repository *name* into its mirror (created if missing)."""
+    path = mirror_path(name, mirror_dir)
+    if not os.path.isdir(path):
+        return ensure_mirror(name, mirror_dir)
+    logging.info("refreshing mirror of %s ...", name)
+    git('remote', 'update', '--prune', cwd=path)
+    git('worktree', 'prune', cwd=path)
+    return path
+
+def clone(name, dest, mirror_dir=DefaultMirrorDir, mode=DefaultMode):
+    """Creates repository *name* at *dest* (missing or empty directory) from
+    its local mirror, see Modes.
+    """
+    path = ensure_mirror(name, mirror_dir)
+    if os.path.isdir(dest):
+        if os.listdir(dest):
+            raise RuntimeError("destination is not empty: {}".format(dest))
+        os.rmdir(dest)
+    if mode == 'worktree':
+        git('worktree', 'add', '--detach', dest, 'HEAD', cwd=path)
+    elif mode == 'reference':
+        git('clone', '--shared', path, dest)
+        git('remote', 'set-url', 'origin', Repositories[name], cwd=dest)
+    else:
+        raise RuntimeError("invalid mirror mode: {}".format(mode))
+    return dest
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mirror', metavar='<path>', default=DefaultMirrorDir, type=os.path.abspath, help="local mirror directory (default is {})".format(DefaultMirrorDir))
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('list', help="list repositories and mirrors")
+    subparser = subparsers.add_parser('refresh', help="create or update mirrors")
+    subparser.add_argument('names', metavar='<name>', nargs='*', help="repositories {} (default all)".format(', '.join(sorted(Repositories.keys()))))
+    subparser = subparsers.add_parser('clone', help="create repository from mirror")
+    subparser.add_argument('name', metavar='<name>', choices=sorted(Repositories.keys()), help="repository")
+    subparser.add_argument('dest', metavar='<path>', type=os.path.abspath, help="destination directory")
+    subparser.add_argument('--mode', default=DefaultMode, choices=Modes, help="mirror mode (default is {})".format(DefaultMode))
+    return parser.parse_args()
+
+def main():
+    """Main routine."""
+
+    # Parse command line arguments.
+    args = parse_args()
+
+    # Setup console logging
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
+
+    if args.command == 'list':
+        for name in sorted(Repositories.keys()):
+            path = mirror_path(name, args.mirror)
+            print "{:<16} {:<48} {}".format(name, Repositories[name], path if os.path.isdir(path) else "(no mirror)")
+    elif args.command == 'refresh':
+        for name in args.names:
+            if name not in Repositories:
+                raise RuntimeError("no such repository: {}".format(name))
+        for name in args.names or sorted(Repositories.keys()):
+            refresh(name, args.mirror)
+    elif args.command == 'clone':
+        clone(args.name, args.dest, args.mirror, args.mode)
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError, message:
+        logging.error(message)
+        sys.exit(EXIT_FAILURE)
+    sys.exit(EXIT_SUCCESS)
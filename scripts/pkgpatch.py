@@ -40,6 +40,8 @@ import shutil
 from getpass import getuser # for username
 from socket import gethostname # for machines hostname
 
+from template import render_template
+
 # Set application name (script file name).
 name = os.path.basename(__file__)
 
@@ -100,19 +102,8 @@ def main():
             '{{IPBUS_BUILD_VERSION}}': hex_value(args.build),
         }
 
-        # Read content of source file.
-        with open(args.src, 'rb') as src:
-            lines = src.readlines()
-
-        # Replace placeholders.
-        for key, value in replace_map.items():
-            for i, line in enumerate(lines):
-                if not line.strip().startswith('--'):
-                    lines[i] = line.replace(key, value)
-
-        # Write content to destination file.
-        with open(args.dest, 'wb') as dest:
-            dest.write(''.join(lines))
+        # Replace placeholders (except in VHDL comments).
+        render_template(args.src, args.dest, replace_map, skip_comments = True)
 
         return 0
     except IOError, message:
@@ -0,0 +1,322 @@
+# Scheduler
+
+"""Resource aware scheduler running the synthesis steps of modules.
+
+Queued modules are started in order as long as the number of running modules
+is below the job limit and enough memory is available, ie. the free memory
+and the total memory minus the memory reserved for every running module both
+exceed the memory required per module. Every module runs its steps in
+sequence, a failed step is retried up to *retries* times before the module is
+marked as failed. The state of all modules is written to a JSON status file
+after every change.
+
+Steps running parallel jobs (eg. Vivado `launch_runs -jobs') receive their
+share of a machine wide core budget by placeholder `{cores}' in the command.
+The budget is split by the number of modules planned to run at once (job
+limit, modules fitting into the total memory or remaining modules) and
+limited to cores not allocated to other running steps, so steps started
+after other modules finished get more.
+Shares are fixed when a step starts, running steps are not rebalanced. Steps
+without placeholder are not accounted for, eg. `make bitfile' runs synth_1
+and impl_1 with the job count of the MP7 build scripts.
+
+>>> scheduler = Scheduler([Step('project', 'make project'), Step('ip', 'vivado -mode batch -source ip.tcl -tclargs {cores}')],
+...     status_file='synth_status.json', max_jobs=4, memory_per_job=16 * GiB, core_budget=32)
+>>> scheduler.add('module_0', '/path/to/module_0')
+>>> failed = scheduler.run()
+>>> for line in status_table(read_status('synth_status.json')):
+...     print line
+
+"""
+
+import datetime
+import json
+import logging
+import multiprocessing
+import signal
+import socket
+import subprocess
+import time
+import os
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+ABORTED = 'aborted'
+
+GiB = 1024 ** 3
+
+POLL_INTERVAL = 5.0
+"""Seconds between polling running steps."""
+
+CORES_PLACEHOLDER = '{cores}'
+"""Placeholder of allocated cores in step commands."""
+
+def meminfo():
+    """Returns dictionary of /proc/meminfo values in bytes."""
+    info = {}
+    with open('/proc/meminfo') as fp:
+        for line in fp:
+            key, value = line.split(':', 1)
+            info[key] = int(value.split()[0]) * 1024
+    return info
+
+def memory_available():
+    """Returns available memory in bytes."""
+    info = meminfo()
+    if 'MemAvailable' in info:
+        return info['MemAvailable']
+    return info['MemFree'] + info.get('Buffers', 0) + info.get('Cached', 0)
+
+def memory_total():
+    """Returns total memory in bytes."""
+    return meminfo()['MemTotal']
+
+def cpu_count():
+    """Returns number of cores."""
+    return multiprocessing.cpu_count()
+
+def pid_alive(pid):
+    """Returns True if a process *pid* exists on this machine."""
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+class Step(object):
+    """Synthesis step *name* running shell *command* in the module directory."""
+    def __init__(self, name, command):
+        self.name = name
+        self.command = command
+    @property
+    def parallel(self):
+        """True if command takes the number of allocated cores."""
+        return CORES_PLACEHOLDER in self.command
+
+class Job(object):
+    """Module job running all steps in directory *path*, output is appended
+    to log file *log* (default `synth.log' inside *path*).
+    """
+    def __init__(self, name, path, log=None):
+        self.name = name
+        self.path = path
+        self.log = log or os.path.join(path, 'synth.log')
+        self.state = QUEUED
+        self.step = 0
+        self.attempt = 0
+        self.started = None
+        self.finished = None
+        self.step_started = None
+        self.returncode = None
+        self.process = None
+        self.cores = 0
+    def to_dict(self, steps):
+        return {
+            'name': self.name,
+            'path': self.path,
+            'log': self.log,
+            'state': self.state,
+            'step': steps[self.step].name if self.step < len(steps) else None,
+            'attempt': self.attempt,
+            'started': self.started,
+            'finished': self.finished,
+            'step_started': self.step_started,
+            'returncode': self.returncode,
+            'cores': self.cores,
+        }
+
+class Scheduler(object):
+    """Runs *steps* (list of Step) for every added module, at most *max_jobs*
+    modules at once, each requiring *memory_per_job* bytes of memory, parallel
+    steps share *core_budget* cores (default number of cores).
+    """
+    def __init__(self, steps, status_file=None, max_jobs=1, memory_per_job=0, retries=1, core_budget=None, poll_interval=POLL_INTERVAL):
+        self.steps = steps
+        self.status_file = status_file
+        self.max_jobs = max(1, max_jobs)
+        self.memory_per_job = memory_per_job
+        self.retries = retries
+        self.core_budget = max(1, core_budget or cpu_count())
+        self.poll_interval = poll_interval
+        self.jobs = []
+    def add(self, name, path, log=None):
+        """Queues module *name* building in directory *path*."""
+        job = Job(name, path, log)
+        self.jobs.append(job)
+        return job
+    def running(self):
+        return [job for job in self.jobs if job.state == RUNNING]
+    def queued(self):
+        return [job for job in self.jobs if job.state == QUEUED]
+    def failed(self):
+        return [job for job in self.jobs if job.state in (FAILED, ABORTED)]
+    def max_running(self):
+        """Returns max. number of modules running at once, limited by the job
+        limit and the total memory.
+        """
+        if not self.memory_per_job:
+            return self.max_jobs
+        return max(1, min(self.max_jobs, memory_total() // self.memory_per_job))
+    def can_start(self):
+        """Returns True if resources allow to start another module."""
+        running = len(self.running())
+        if running >= self.max_running():
+            return False
+        if not running or not self.memory_per_job:
+            return True # always run at least one module
+        return memory_available() >= self.memory_per_job
+    def allocate_cores(self, job):
+        """Returns number of cores for a parallel step of *job*."""
+        planned = max(1, min(self.max_running(), len(self.running()) + len(self.queued())))
+        allocated = sum(other.cores for other in self.running() if other is not job)
+        return max(1, min(self.core_budget // planned, self.core_budget - allocated))
+    def start_step(self, job):
+        """Starts current step of *job* (in a new process group)."""
+        step = self.steps[job.step]
+        job.attempt += 1
+        job.step_started = time.time()
+        job.returncode = None
+        command = step.command
+        job.cores = 0
+        if step.parallel:
+            job.cores = self.allocate_cores(job)
+            command = command.replace(CORES_PLACEHOLDER, format(job.cores))
+        logging.info("%s: starting step '%s' (attempt %d of %d%s)...", job.name, step.name, job.attempt, self.retries + 1,
+            ", {0} cores".format(job.cores) if job.cores else "")
+        with open(job.log, 'a') as fp:
+            fp.write("\n### {0}: step '{1}' attempt {2}: {3}\n".format(datetime.datetime.now().isoformat(), step.name, job.attempt, command))
+        logfile = open(job.log, 'a')
+        try:
+            job.process = subprocess.Popen(['bash', '-c', command], cwd=job.path, stdout=logfile, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+        finally:
+            logfile.close()
+    def start(self, job):
+        """Starts first step of *job*."""
+        job.state = RUNNING
+        job.started = time.time()
+        self.start_step(job)
+    def poll(self, job):
+        """Checks running step of *job*, starts next step or a retry.
+        Returns True if the job changed.
+        """
+        returncode = job.process.poll()
+        if returncode is None:
+            return False
+        step = self.steps[job.step]
+        job.process = None
+        job.cores = 0
+        job.returncode = returncode
+        if returncode == 0:
+            logging.info("%s: finished step '%s' (%.0f s)", job.name, step.name, time.time() - job.step_started)
+            job.step += 1
+            job.attempt = 0
+            if job.step < len(self.steps):
+                self.start_step(job)
+            else:
+                job.state = DONE
+                job.finished = time.time()
+                logging.info("%s: done (%.0f s)", job.name, job.finished - job.started)
+        elif job.attempt <= self.retries:
+            logging.warning("%s: step '%s' failed with exit code %d, retrying (see %s)", job.name, step.name, returncode, job.log)
+            self.start_step(job)
+        else:
+            job.state = FAILED
+            job.finished = time.time()
+            logging.error("%s: step '%s' failed with exit code %d (see %s)", job.name, step.name, returncode, job.log)
+        return True
+    def abort(self):
+        """Terminates all running steps."""
+        for job in self.running():
+            if job.process is not None:
+                logging.warning("%s: aborting step '%s'", job.name, self.steps[job.step].name)
+                try:
+                    os.killpg(job.process.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+                job.process.wait()
+                job.process = None
+            job.cores = 0
+            job.state = ABORTED
+            job.finished = time.time()
+        for job in self.queued():
+            job.state = ABORTED
+        self.write_status()
+    def run(self):
+        """Runs all queued modules, returns list of failed modules. Running
+        steps are terminated on SIGTERM or keyboard interrupt.
+        """
+        def terminate(signum, frame):
+            raise KeyboardInterrupt()
+        handler = signal.signal(signal.SIGTERM, terminate)
+        try:
+            self.write_status()
+            while self.queued() or self.running():
+                changed = False
+                for job in self.running():
+                    changed |= self.poll(job)
+                while self.queued() and self.can_start():
+                    self.start(self.queued()[0])
+                    changed = True
+                if changed:
+                    self.write_status()
+                if self.running():
+                    time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            self.abort()
+            raise RuntimeError("synthesis aborted")
+        finally:
+            signal.signal(signal.SIGTERM, handler)
+        return self.failed()
+    def status(self):
+        """Returns status dictionary."""
+        return {
+            'pid': os.getpid(),
+            'host': socket.gethostname(),
+            'updated': time.time(),
+            'max_jobs': self.max_jobs,
+            'memory_per_job': self.memory_per_job,
+            'retries': self.retries,
+            'core_budget': self.core_budget,
+            'steps': [step.name for step in self.steps],
+            'jobs': [job.to_dict(self.steps) for job in self.jobs],
+        }
+    def write_status(self):
+        """Writes status file (atomically replaced)."""
+        if not self.status_file:
+            return
+        filename = '{0}.tmp'.format(self.status_file)
+        with open(filename, 'w') as fp:
+            json.dump(self.status(), fp, indent=2)
+        os.rename(filename, self.status_file)
+
+def read_status(filename):
+    """Returns status dictionary of status file."""
+    with open(filename) as fp:
+        return json.load(fp)
+
+def status_table(status):
+    """Returns list of lines of a human readable status table."""
+    now = time.time()
+    alive = status['host'] != socket.gethostname() or pid_alive(status['pid'])
+    lines = []
+    lines.append("scheduler pid {0} on {1} ({2}), max. {3} module(s), {4:.0f} GiB per module, {5} cores, updated {6}".format(
+        status['pid'], status['host'], "running" if alive else "not running",
+        status['max_jobs'], float(status['memory_per_job']) / GiB, status['core_budget'],
+        datetime.datetime.fromtimestamp(status['updated']).strftime('%Y-%m-%d %H:%M:%S')))
+    lines.append("|------------|----------|----------|---------|-------|----------|------------------------------------------")
+    lines.append("| Module     | State    | Step     | Attempt | Cores | Time (m) | Log")
+    lines.append("|------------|----------|----------|---------|-------|----------|------------------------------------------")
+    for job in status['jobs']:
+        state = job['state']
+        if state == RUNNING and not alive:
+            state = 'stale'
+        if job['started'] is None:
+            minutes = ''
+        else:
+            minutes = '{0:.1f}'.format(((job['finished'] or now) - job['started']) / 60.)
+        lines.append("| {0:<11}| {1:<9}| {2:<9}| {3:>7} | {4:>5} | {5:>8} | {6}".format(
+            job['name'], state, job['step'] or '', job['attempt'] or '', job['cores'] or '', minutes, job['log']))
+    lines.append("|------------|----------|----------|---------|-------|----------|------------------------------------------")
+    return lines
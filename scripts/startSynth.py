@@ -1,19 +1,38 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8 -*-
 
-"""startSynth.py -- starting module synthesis using screens
+"""startSynth.py -- starting module synthesis using a resource aware scheduler
+
+Modules are synthesized by a scheduler limiting the number of concurrently
+running modules by cores and free memory, failed steps are retried. By
+default the scheduler runs inside a detached screen session, query its status
+using option --status.
 """
 
+import toolbox as tb
+import scheduler
+
 import subprocess
 import argparse
 import logging
 import ConfigParser
+import pipes
 import sys, os, re
 
 VIVADO_BASE_DIR_1 = '/opt/xilinx/Vivado'
 VIVADO_BASE_DIR_2 = '/opt/Xilinx/Vivado'
 """Default Xilinx Vivado installation location."""
 
+DefaultCoresPerModule = 4
+"""Default number of cores required per module synthesis."""
+DefaultMemoryPerModule = 20
+"""Default memory in GiB required per module synthesis."""
+DefaultRetries = 1
+"""Default number of retries of a failed synthesis step."""
+
+StatusFile = 'synth_status.json'
+"""Scheduler status file inside build area."""
+
 EXIT_SUCCESS = 0
 EXIT_FAILURE = 1
 
@@ -28,6 +47,13 @@ def vivado_t(version):
         raise ValueError("not a xilinx vivado version: '{version}'".format(**locals()))
     return version
 
+def retries_t(value):
+    """Validates number of retries (zero or more)."""
+    retries = int(value)
+    if retries < 0:
+        raise ValueError("not a number of retries: '{value}'".format(**locals()))
+    return retries
+
 Tcl_addHlsIpCore = 'addHlsIpCore.tcl'
 
 def parse_args():
@@ -37,8 +63,12 @@ def parse_args():
     parser.add_argument('config', type=os.path.abspath, help="build configuration file to read")
     parser.add_argument('--tclfile', default=Tcl_addHlsIpCore, help="file name tcl script for HLS IP core")
     parser.add_argument('--vivado_base_dir', help="Xilinx Vivado installation location")
-    parser.add_argument('--screen', default='yes', help="use screen ('yes'[default] or 'no'")
-    
+    parser.add_argument('--screen', default='yes', help="run scheduler inside a screen session ('yes'[default] or 'no')")
+    parser.add_argument('-j', '--jobs', metavar='<n>', type=tb.jobs_t, help="max. number of modules synthesized at once (default is number of cores / {0})".format(DefaultCoresPerModule))
+    parser.add_argument('--cores', metavar='<n>', type=tb.jobs_t, help="cores shared by Vivado jobs of all running modules (default is number of cores)")
+    parser.add_argument('--memory', metavar='<GiB>', type=float, default=DefaultMemoryPerModule, help="memory required per module synthesis (default {0} GiB)".format(DefaultMemoryPerModule))
+    parser.add_argument('--retries', metavar='<n>', type=retries_t, default=DefaultRetries, help="retries of a failed synthesis step (default {0})".format(DefaultRetries))
+    parser.add_argument('--status', action='store_true', help="print status of running synthesis and exit")
     return parser.parse_args()
 
 def main():
@@ -65,11 +95,20 @@ def main():
     modules = int(config.get('menu', 'modules'))
     buildarea = config.get('firmware', 'buildarea')
 
+    status_file = os.path.join(buildarea, StatusFile)
+
+    if args.status:
+        if not os.path.isfile(status_file):
+            raise RuntimeError("no synthesis status found: {status_file}".format(**locals()))
+        for line in scheduler.status_table(scheduler.read_status(status_file)):
+            print line
+        return
+
     logging.info("preparing to start synthesis for menu '%s' ...", menu)
 
     # settings filename
-    settings64_1 = os.path.join(VIVADO_BASE_DIR_1, args.vivado, 'settings64.sh')
-    settings64_2 = os.path.join(VIVADO_BASE_DIR_2, args.vivado, 'settings64.sh')
+    settings64_1 = os.path.join(args.vivado_base_dir or VIVADO_BASE_DIR_1, args.vivado, 'settings64.sh')
+    settings64_2 = os.path.join(args.vivado_base_dir or VIVADO_BASE_DIR_2, args.vivado, 'settings64.sh')
     if os.path.isfile(settings64_1):
         settings64 = settings64_1
     elif os.path.isfile(settings64_2):
@@ -80,24 +119,44 @@ def main():
             "  check if Xilinx Vivado {args.vivado} is installed on this machine.".format(**locals())
         )
 
+    if args.screen == 'yes':
+        # screen session name for build
+        session = "build_{build}".format(**locals())
+        # run this script without screen inside the screen session
+        command = ' '.join(pipes.quote(arg) for arg in [sys.executable, os.path.abspath(__file__), args.vivado, args.config,
+            '--tclfile', args.tclfile, '--memory', format(args.memory), '--retries', format(args.retries), '--screen', 'no'] +
+            (['--vivado_base_dir', args.vivado_base_dir] if args.vivado_base_dir else []) +
+            (['--jobs', format(args.jobs)] if args.jobs else []) +
+            (['--cores', format(args.cores)] if args.cores else []))
+        logging.info("starting screen session '%s' ...", session)
+        run_command('screen', '-dmS', pipes.quote(session), command)
+        run_command('screen', '-ls')
+        logging.info("query status using: %s %s %s --status", pipes.quote(os.path.abspath(__file__)), args.vivado, pipes.quote(args.config))
+        return
+
+    jobs = args.jobs or max(1, scheduler.cpu_count() // DefaultCoresPerModule)
+
+    # synthesis steps executed inside module build directory
+    steps = [
+        scheduler.Step('project', 'source {settings64}; make project'.format(**locals())),
+        scheduler.Step('ip', 'source {settings64}; vivado -mode batch -source {args.tclfile} -tclargs {{cores}}'.format(**locals())),
+        scheduler.Step('bitfile', 'source {settings64}; make bitfile'.format(**locals())),
+    ]
+    synth = scheduler.Scheduler(steps, status_file, max_jobs=jobs, memory_per_job=int(args.memory * scheduler.GiB), retries=args.retries, core_budget=args.cores)
+
     for i in range(modules):
-        # screen session name for module
-        session = "build_{build}_{i}".format(**locals())
         # module build directory inside build area
         builddir = os.path.join(buildarea, 'module_{i}'.format(**locals()))
-        # command to be executed inside module screen session or without screen session
-        command = 'bash -c "source {settings64}; cd {builddir}; make project && vivado -mode batch -source {args.tclfile} && make bitfile"'.format(**locals())
-        
-        if args.screen == 'yes':
-        # run screen command
-            logging.info("starting screen session '%s' for module %s ...", session, i)
-            run_command('screen', '-dmS', session, command)
-        else:
-            run_command(command)
+        synth.add('module_{i}'.format(**locals()), builddir)
 
-    if args.screen == 'yes':
-    # list running screen sessions
-        run_command('screen', '-ls')
+    logging.info("synthesizing %d module(s), max. %d at once, %.0f GiB per module, %d cores ...", modules, jobs, args.memory, synth.core_budget)
+    failed = synth.run()
+
+    for line in scheduler.status_table(synth.status()):
+        logging.info(line)
+
+    if failed:
+        raise RuntimeError("synthesis failed for: {0}".format(', '.join(job.name for job in failed)))
 
     logging.info("done.")
 
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+
+"""Compiled templates shared by all scripts.
+
+A template is parsed once per set of placeholders into literal text and
+placeholder positions and rendered in a single pass, substituted values are
+not scanned again. Placeholders (eg. `{{NAME}}') are arbitrary strings given
+as keys of the replace map. Placeholders on VHDL comment lines (starting with
+`--') are kept if *skip_comments* is set. Templates loaded from files are
+cached (by path and modification time), so rendering the same template for
+many modules parses it only once.
+
+>>> import template
+>>> template.render_template('sample_tpl.vhd', 'sample.vhd', {'{{name}}': "title"})
+>>> tpl = template.load('sample_tpl.vhd', skip_comments=True)
+>>> for module in modules:
+...     content = tpl.render({'{{name}}': module.name})
+
+"""
+
+import logging
+import re
+import os
+
+__all__ = ['Template', 'load', 'render_template']
+
+class Template(object):
+    """Template of string *content*.
+    >>> Template("foo {{bar}} baz").render({'{{bar}}': "42"})
+    'foo 42 baz'
+    """
+    def __init__(self, content, skip_comments=False):
+        self.content = content
+        self.skip_comments = skip_comments
+        self._compiled = {}
+    def compile(self, keys):
+        """Returns tuple (literals, placeholders) of content split at all
+        occurrences of *keys* (longest key first), cached per set of keys.
+        """
+        keys = frozenset(keys)
+        compiled = self._compiled.get(keys)
+        if compiled is None:
+            content = self.content
+            literals = []
+            placeholders = []
+            pos = 0
+            if keys:
+                pattern = re.compile('|'.join(re.escape(key) for key in sorted(keys, key=len, reverse=True)))
+                for match in pattern.finditer(content):
+                    if self.skip_comments:
+                        line_start = content.rfind('\n', 0, match.start()) + 1
+                        if content[line_start:match.start()].lstrip().startswith('--'):
+                            continue # keep placeholder inside VHDL comment line
+                    literals.append(content[pos:match.start()])
+                    placeholders.append(match.group(0))
+                    pos = match.end()
+            literals.append(content[pos:])
+            compiled = self._compiled[keys] = (literals, placeholders)
+        return compiled
+    def render(self, replace_map):
+        """Returns content with placeholders replaced by values of dictionary *replace_map*."""
+        literals, placeholders = self.compile(replace_map)
+        parts = [literals[0]]
+        for placeholder, literal in zip(placeholders, literals[1:]):
+            parts.append(replace_map[placeholder])
+            parts.append(literal)
+        return ''.join(parts)
+
+_cache = {}
+
+def load(filename, skip_comments=False):
+    """Returns compiled Template of file *filename*, cached until the file changes."""
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    key = (filename, skip_comments)
+    entry = _cache.get(key)
+    if entry is None or entry[0] != (stat.st_mtime, stat.st_size):
+        with open(filename) as fp:
+            entry = ((stat.st_mtime, stat.st_size), Template(fp.read(), skip_comments))
+        _cache[key] = entry
+    return entry[1]
+
+def render_template(src, dst, replace_map, skip_comments=False):
+    """Replaces placeholders of template file *src* with values of dictionary
+    *replace_map* and writes to file *dst*.
+    >>> render_template("template.txt", "sample.txt", {'{{foo}}': "bar"})
+    """
+    logging.debug("rendering template %s as %s", src, dst)
+    content = load(src, skip_comments).render(replace_map)
+    with open(dst, 'w') as fp:
+        fp.write(content)
@@ -8,6 +8,8 @@ import pwd
 import socket
 import sys, os
 
+from template import render_template
+
 def build_t(value):
     """Custom build type validator for argparse. Argument value must be of
     format 0x1234, else an exception of type ValueError is raised.
@@ -16,6 +18,15 @@ def build_t(value):
     try: return "{0:04x}".format(int(value, 16))
     except ValueError: raise TypeError("Invalid build version: `{0}'".format(value))
 
+def jobs_t(value):
+    """Custom number of jobs validator for argparse. Argument value must be a
+    positive integer, else an exception of type ValueError is raised.
+    >>> parser.add_argument('-j', type=jobs_t)
+    """
+    jobs = int(value)
+    if jobs < 1: raise ValueError("Invalid number of jobs: `{0}'".format(value))
+    return jobs
+
 def remove(filename):
     """Savely remove a directory, file or a symbolic link."""
     if os.path.isfile(filename):
@@ -37,6 +48,71 @@ def read_file(filename):
     with open(filename, 'rb') as fp:
         return fp.read()
 
+def make_readonly(path):
+    """Removes write permissions of all files of directory tree *path*."""
+    for root, dirs, filenames in os.walk(path):
+        for filename in filenames:
+            filename = os.path.join(root, filename)
+            st = os.stat(filename)
+            os.chmod(filename, st.st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+def copy_writable(src, dst):
+    """Copies file *src* to *dst* keeping its times and permissions, but
+    writable by the owner (sources of a read-only tree).
+    """
+    shutil.copyfile(src, dst)
+    st = os.stat(src)
+    os.utime(dst, (st.st_atime, st.st_mtime))
+    os.chmod(dst, stat.S_IMODE(st.st_mode) | stat.S_IWUSR)
+
+def link_tree(src, dst, mode='hardlink'):
+    """Creates directory tree *dst* with all files of tree *src* linked
+    (*mode* 'hardlink' or 'symlink') or copied ('copy', writable copies).
+    Hardlinks fall back to copies if not supported by the file system.
+    Returns tuple (files, bytes) of linked (not copied) files.
+
+    Hardlinks share the inode, including its permissions, with *src*: a
+    read-only *src* only prevents accidental writes, a `chmod u+w' of a
+    linked file makes it writable in every tree. Files to be edited must be
+    replaced by copies first (see materialize).
+
+    Example:
+    >>> link_tree('shared/firmware/hdl', 'module_0/mp7_ugt/firmware/hdl')
+    (76, 952164)
+
+    """
+    files = 0
+    size = 0
+    for root, dirs, filenames in os.walk(src):
+        target_dir = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        for filename in filenames:
+            source = os.path.join(root, filename)
+            target = os.path.join(target_dir, filename)
+            if mode == 'symlink':
+                os.symlink(os.path.abspath(source), target)
+            elif mode == 'hardlink':
+                try:
+                    os.link(source, target)
+                except OSError:
+                    copy_writable(source, target)
+                    continue
+            else:
+                copy_writable(source, target)
+                continue
+            files += 1
+            size += os.path.getsize(source)
+    return files, size
+
+def materialize(src, dst):
+    """Replaces linked file *dst* by a copy of file *src* (never writes
+    through a link into the shared tree).
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    shutil.copyfile(src, dst)
+
 def make_executable(filename):
     """Set executable flag for file."""
     st = os.stat(filename)
@@ -50,18 +126,7 @@ def template_replace(template, replace_map, result):
     >>> template_replace('sample.tpl.vhd', {'name': "title"}, 'sample.vhd')
 
     """
-    # Read content of source file.
-    with open(template, 'rb') as fp:
-        lines = fp.readlines()
-    # Replace placeholders.
-    for key, value in replace_map.items():
-        for i, line in enumerate(lines):
-            # Ignore VHDL comments
-            if not line.strip().startswith('--'):
-                lines[i] = line.replace(key, value)
-    # Write content to destination file.
-    with open(result, 'wb') as fp:
-        fp.write(''.join(lines))
+    render_template(template, result, replace_map, skip_comments = True)
 
 def count_modules(menu):
     """Returns count of modules of menu. *menu* is the path to the menu directory."""